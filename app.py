@@ -5,13 +5,18 @@
 
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-import threading, time, json
+import os, threading, time, json
 from core import (
     settings_store, save_settings, URL_DEFAULT, DEFAULT_EXPORT_NAME, FIELD_MAPPING,
     fetch_sections, parse_section, merge_section3_into2, AdvancedTreeview,
-    BottomStatsTable, ColumnSettingsDialog, AppSettingsDialog
+    BottomStatsTable, ColumnSettingsDialog, AppSettingsDialog,
+    pipeline_profiler, ProfilingPanel, intraday_history, diff_snapshots,
+    alert_engine, AlertsPanel, GroupStatsPanel, ui_dispatcher, op_profiler,
+    parse_market_sharded, warm_market_pool, shutdown_market_pool
 )
 from client_type_export import ClientTypeExportWindow
+from snapshot_server import SnapshotServer
+from shm_snapshot import SharedSnapshotWriter, DEFAULT_NAME as SHM_DEFAULT_NAME
 
 class MarketApp:
     def __init__(self, root):
@@ -19,14 +24,24 @@ class MarketApp:
         self.root.title("TSETMC Viewer")
         self.data_url = settings_store.get('data_url', URL_DEFAULT)
         self.runtime_log = settings_store.get('runtime_log', {'column_widths': {}, 'converted_numeric_columns': [], 'visible_columns': {}})
+        pipeline_profiler.load(self.runtime_log.get('pipeline_profile'))
+        # نتایج رشته‌های کاری و callbackهای جدول از این صف روی رشتهٔ Tk اجرا می‌شوند
+        ui_dispatcher.attach(root)
+        # پروسه‌های پارس موازی در پس‌زمینه بالا می‌آیند؛ تا آماده شدن، refresh در همین پردازه پارس می‌کند
+        if settings_store.get('parallel_parse', False):
+            warm_market_pool(settings_store.get('parse_workers') or None)
 
         toolbar = ttk.Frame(root); toolbar.pack(fill=tk.X, padx=8, pady=6)
         btn_style = {'padx': 8, 'pady': 6}
         ttk.Button(toolbar, text="بارگذاری/به‌روزرسانی", command=self.load_sections_thread).pack(side=tk.LEFT, **btn_style)
         ttk.Button(toolbar, text="فیلترها", command=self.open_filters).pack(side=tk.LEFT, **btn_style)
+        ttk.Button(toolbar, text="آمار گروهی", command=self.open_group_stats).pack(side=tk.LEFT, **btn_style)
         ttk.Button(toolbar, text="اعمال فیلتر ویژه", command=self.apply_special_filters).pack(side=tk.LEFT, **btn_style)
         ttk.Button(toolbar, text="خروجی CSV", command=self.export_current_view).pack(side=tk.LEFT, **btn_style)
         ttk.Button(toolbar, text="خروجی لاگ", command=self.export_log).pack(side=tk.LEFT, **btn_style)
+        ttk.Button(toolbar, text="پروفایل", command=self.open_profiling_panel).pack(side=tk.LEFT, **btn_style)
+        self.alerts_button = ttk.Button(toolbar, text="هشدارها", command=self.open_alerts_panel)
+        self.alerts_button.pack(side=tk.LEFT, **btn_style)
         ttk.Button(toolbar, text="تنظیمات برنامه", command=self.open_app_settings).pack(side=tk.LEFT, **btn_style)
         ttk.Button(toolbar, text="خروجی حقیقی/حقوقی نماد", command=self.open_client_type_export).pack(side=tk.LEFT, **btn_style)
 
@@ -37,17 +52,51 @@ class MarketApp:
         self.search_entry.bind("<KeyRelease>", self.on_search_change_debounced)
         ttk.Button(search_frame, text="Next", command=self.search_next).pack(side=tk.LEFT, padx=6)
         self.search_count_label = ttk.Label(search_frame, text="(0)"); self.search_count_label.pack(side=tk.LEFT)
+        self.alert_label = ttk.Label(search_frame, text="", foreground="#b00020"); self.alert_label.pack(side=tk.RIGHT)
 
         self.notebook = ttk.Notebook(root); self.notebook.pack(fill=tk.BOTH, expand=True, padx=8, pady=8)
         self.trees = []
+        self._tab_specs = []  # (section index, frame) for each tab; tree is built on first selection
+        self._sections = []
         self.bottom_frame = None
         self.bottom_stats = None
         self._search_after_id = None
         self.current_tree = None
         self._load_thread = None
+        self.group_panels = []  # GroupStatsPanelهای باز؛ در on_tab_changed به جدول فعلی وصل می‌شوند
+        self._prev_snapshot = None  # base_df دیدبان در refresh قبلی (برای diff_snapshots)
+        self.last_diff = None
+        self._unseen_alerts = 0
+        self.api_server = None
+        self.shm_writer = None
+        self.configure_api_server()
+        self.configure_shm_publisher()
 
         self.load_sections_thread()
 
+    def configure_api_server(self):
+        """روشن/خاموش کردن سرور محلی snapshot طبق تنظیمات؛ متن خطا یا None."""
+        enabled = bool(settings_store.get('api_server_enabled', False))
+        try:
+            port = int(settings_store.get('api_port', 8765))
+        except (TypeError, ValueError):
+            port = None
+        if enabled and not (port is not None and 0 < port < 65536):
+            return f"پورت نامعتبر: {settings_store.get('api_port')}"
+        if self.api_server and (not enabled or self.api_server.port != port):
+            self.api_server.stop()
+            self.api_server = None
+        if enabled and self.api_server is None:
+            try:
+                server = SnapshotServer(port=port)
+                server.start()
+            except (OSError, OverflowError) as e:
+                return str(e)
+            self.api_server = server
+            if self._prev_snapshot is not None:
+                server.publish(self._prev_snapshot)
+        return None
+
     def load_sections_thread(self):
         if self._load_thread and self._load_thread.is_alive():
             return
@@ -57,58 +106,152 @@ class MarketApp:
     def _load_sections_safe(self):
         try:
             start = time.time()
+            pipeline_profiler.begin_run('refresh')
             sections = fetch_sections(self.data_url)
             self.runtime_log['last_fetch_time'] = time.strftime("%Y-%m-%d %H:%M:%S")
             self.runtime_log['load_duration'] = round(time.time() - start, 3)
-            self.root.after(0, lambda: self._populate_tabs(sections))
+            ui_dispatcher.post(self._populate_tabs, sections)
         except Exception as e:
-            self.root.after(0, lambda: messagebox.showerror("خطا در دریافت داده", str(e)))
+            pipeline_profiler.end_run()
+            ui_dispatcher.post(messagebox.showerror, "خطا در دریافت داده", str(e))
 
+    @op_profiler.profiled('refresh')
     def _populate_tabs(self, sections):
+        """
+        فقط قاب خالی تب‌ها ساخته می‌شود؛ پارس و ساخت AdvancedTreeview هر بخش
+        اولین بار که تبش انتخاب شود انجام می‌شود (_build_tab). بخش 2 اول ساخته می‌شود.
+        """
         try:
             for tab in self.notebook.tabs():
                 self.notebook.forget(tab)
             self.trees.clear()
+            self._tab_specs.clear()
+            self._sections = sections
+            first_idx = 0
             for i, sec in enumerate(sections):
                 if not sec.strip(): continue
-                if i == 2:
-                    df2 = parse_section(sec, FIELD_MAPPING)
-                    df3 = parse_section(sections[3], None) if len(sections) > 3 else None
-                    df = merge_section3_into2(df2, df3 if df3 is not None else None)
-                else:
-                    df = parse_section(sec, None)
                 frame = ttk.Frame(self.notebook)
                 self.notebook.add(frame, text=f"بخش {i}")
-                vscroll = ttk.Scrollbar(frame, orient="vertical")
-                hscroll = ttk.Scrollbar(frame, orient="horizontal")
-                tree = AdvancedTreeview(frame, df, app_runtime_log=self.runtime_log, yscrollcommand=vscroll.set, xscrollcommand=hscroll.set)
-                tree.grid(row=0, column=0, sticky="nsew")
-                vscroll.config(command=tree.yview); vscroll.grid(row=0, column=1, sticky="ns")
-                hscroll.config(command=tree.xview); hscroll.grid(row=1, column=0, sticky="ew")
-                frame.grid_rowconfigure(0, weight=1); frame.grid_columnconfigure(0, weight=1)
-                self.trees.append(tree)
-            # reapply persisted filters to last tree
-            if self.trees:
-                persisted = settings_store.get('saved_filters_full', [])
-                if persisted:
-                    try:
-                        self.trees[-1]._reapply_persisted_filters(persisted)
-                        self.trees[-1].apply_all_filters()
-                    except Exception:
-                        pass
-            for idx, tab_id in enumerate(self.notebook.tabs()):
-                if self.notebook.tab(tab_id, option='text') == "بخش 2":
-                    self.notebook.select(idx)
-                    break
+                if i == 2:
+                    first_idx = len(self._tab_specs)
+                self._tab_specs.append((i, frame))
+                self.trees.append(None)
+            if self._tab_specs:
+                self.notebook.select(first_idx)
             self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
             self.on_tab_changed()
         except Exception as e:
             messagebox.showerror("خطا در ساخت تب‌ها", str(e))
+        finally:
+            pipeline_profiler.end_run()
+            self.runtime_log['pipeline_profile'] = pipeline_profiler.to_log()
+
+    def _build_tab(self, idx):
+        sec_idx, frame = self._tab_specs[idx]
+        sections = self._sections
+        book = None
+        if sec_idx == 2 and settings_store.get('parallel_parse', False):
+            # پارس، ادغام و آماده‌سازی تکه‌تکه در چند پردازه؛ جدول دیگر آماده‌سازی اولیه را تکرار نمی‌کند
+            df, book = parse_market_sharded(sections[2], sections[3] if len(sections) > 3 else None,
+                                            FIELD_MAPPING, workers=settings_store.get('parse_workers') or None)
+        elif sec_idx == 2:
+            df2 = parse_section(sections[2], FIELD_MAPPING)
+            df3 = parse_section(sections[3], None) if len(sections) > 3 else None
+            df = merge_section3_into2(df2, df3 if df3 is not None else None)
+        else:
+            df = parse_section(sections[sec_idx], None)
+        vscroll = ttk.Scrollbar(frame, orient="vertical")
+        hscroll = ttk.Scrollbar(frame, orient="horizontal")
+        # فیلترهای ذخیره‌شده فقط برای جدول دیدبان (بخش ۲) و همان ابتدا اعمال می‌شوند تا جدول یک بار پر شود
+        persisted = settings_store.get('saved_filters_full', []) if sec_idx == 2 else None
+        # تاریخچهٔ درون‌روز فقط از دیدبان (بخش ۲) ثبت می‌شود و ستون‌های مشتقش را به همان جدول می‌دهد
+        hooks = [intraday_history.update_frame] if sec_idx == 2 else None
+        tree = AdvancedTreeview(frame, df, app_runtime_log=self.runtime_log, persisted_filters=persisted,
+                                prepare_hooks=hooks, order_book=book, yscrollcommand=vscroll.set, xscrollcommand=hscroll.set)
+        tree.grid(row=0, column=0, sticky="nsew")
+        vscroll.config(command=tree.yview); vscroll.grid(row=0, column=1, sticky="ns")
+        hscroll.config(command=tree.xview); hscroll.grid(row=1, column=0, sticky="ew")
+        frame.grid_rowconfigure(0, weight=1); frame.grid_columnconfigure(0, weight=1)
+        self.trees[idx] = tree
+        if sec_idx == 2:
+            self._update_snapshot_diff(tree.base_df)
+            if self.shm_writer:
+                self._publish_shared(tree)
+        return tree
+
+    def configure_shm_publisher(self):
+        """روشن/خاموش کردن انتشار ستون‌های عددی دیدبان در حافظهٔ مشترک؛ متن خطا یا None."""
+        enabled = bool(settings_store.get('shm_enabled', False))
+        name = settings_store.get('shm_name') or SHM_DEFAULT_NAME
+        if self.shm_writer and (not enabled or self.shm_writer.name != name):
+            self.shm_writer.close()
+            self.shm_writer = None
+        if enabled and self.shm_writer is None:
+            self.shm_writer = SharedSnapshotWriter(name)
+            tree = next((t for (sec, _), t in zip(self._tab_specs, self.trees) if sec == 2 and t is not None), None)
+            if tree is not None:
+                return self._publish_shared(tree)
+        return None
+
+    def _publish_shared(self, tree):
+        try:
+            with pipeline_profiler.stage('shm_publish', rows=len(tree.base_df)):
+                self.shm_writer.publish(tree.base_df, numeric=tree.numeric_column)
+        except Exception as e:
+            return str(e)
+        return None
+
+    def _update_snapshot_diff(self, snapshot):
+        """تفاوت دیدبان با refresh قبلی؛ مبنای کارهای افزایشی (هشدارها، آمار و ...)."""
+        try:
+            with pipeline_profiler.stage('diff', rows=len(snapshot)):
+                self.last_diff = diff_snapshots(self._prev_snapshot, snapshot)
+            self.runtime_log['last_diff'] = self.last_diff.summary()
+        except Exception:
+            self.last_diff = None
+        self._prev_snapshot = snapshot
+        if self.api_server:
+            try:
+                self.api_server.publish(snapshot, self.last_diff)
+            except Exception:
+                pass
+        self._evaluate_alerts(snapshot)
+
+    def _evaluate_alerts(self, snapshot):
+        """قواعد هشدار فقط روی ردیف‌های جدید/تغییرکردهٔ last_diff ارزیابی می‌شوند."""
+        if not alert_engine.rules:
+            return
+        try:
+            with pipeline_profiler.stage('alerts', rows=len(snapshot) if self.last_diff is None else len(self.last_diff.curr_positions)):
+                events = alert_engine.evaluate(snapshot, self.last_diff)
+        except Exception:
+            return
+        if not events:
+            return
+        self._unseen_alerts += len(events)
+        self.alerts_button.config(text=f"هشدارها ({self._unseen_alerts})")
+        shown = '، '.join(f"{e['symbol']} ({e['rule']})" for e in events[:5])
+        more = f" و {len(events) - 5} مورد دیگر" if len(events) > 5 else ""
+        self.alert_label.config(text=f"{time.strftime('%H:%M:%S')} هشدار: {shown}{more}")
+        try: self.root.bell()
+        except Exception: pass
 
     def on_tab_changed(self, _=None):
-        idx = self.notebook.index(self.notebook.select())
-        self.current_tree = self.trees[idx] if 0 <= idx < len(self.trees) else None
+        try:
+            idx = self.notebook.index(self.notebook.select())
+        except Exception:
+            idx = -1
+        tree = None
+        if 0 <= idx < len(self.trees):
+            tree = self.trees[idx]
+            if tree is None:
+                try:
+                    tree = self._build_tab(idx)
+                except Exception as e:
+                    messagebox.showerror("خطا در ساخت تب", str(e))
+        self.current_tree = tree
         self._attach_bottom_stats()
+        self._rebind_group_panels()
 
     def _attach_bottom_stats(self):
         if self.bottom_frame:
@@ -121,7 +264,7 @@ class MarketApp:
 
         bottom_cols = settings_store.get('bottom_visible_columns')
         if bottom_cols is None:
-            bottom_cols = list(self.current_tree.df.columns)
+            bottom_cols = list(self.current_tree.base_df.columns)
         if 'ارزش معاملات به میلیارد تومن' not in bottom_cols:
             bottom_cols += ['ارزش معاملات به میلیارد تومن']
 
@@ -140,15 +283,16 @@ class MarketApp:
     def _on_search_change(self):
         term = self.search_var.get().strip()
         if not self.current_tree: return
-        matches = self.current_tree.search_live(term)
+        # پروفایل جستجو فقط این‌جا، پس از debounce تایپ (نه برای هر فراخوانی search_live)
+        with op_profiler.capture('search'):
+            matches = self.current_tree.search_live(term)
         self.search_count_label.config(text=f"({len(matches)})")
         if self.bottom_stats: self.bottom_stats.refresh_debounced()
 
     def search_next(self):
         if not self.current_tree: return
         tree = self.current_tree
-        items = tree.get_children()
-        matches = [i for i in items if 'search_match' in tree.item(i, 'tags')]
+        matches = tree.search_match_iids()
         if not matches: return
         sel = tree.selection()
         cur = matches.index(sel[0]) if sel and sel[0] in matches else -1
@@ -161,13 +305,33 @@ class MarketApp:
             return
         ColumnSettingsDialog(self.root, self.current_tree)
 
+    def open_group_stats(self):
+        if not self.current_tree:
+            messagebox.showwarning("هشدار", "ابتدا داده‌ها را بارگذاری کنید")
+            return
+        self.group_panels.append(GroupStatsPanel(self.root, self.current_tree))
+
+    def _rebind_group_panels(self):
+        """پنل‌های آمار گروهیِ باز مثل BottomStatsTable همراه جدول فعلی می‌مانند."""
+        alive = []
+        for panel in self.group_panels:
+            try:
+                if not panel.winfo_exists():
+                    continue
+            except Exception:
+                continue
+            if self.current_tree is not None:
+                panel.set_tree(self.current_tree)
+            alive.append(panel)
+        self.group_panels = alive
+
     def open_app_settings(self):
         AppSettingsDialog(self.root, self, tree=self.current_tree)
 
     def export_current_view(self):
         if not self.current_tree:
             messagebox.showwarning("هشدار", "تب فعالی وجود ندارد"); return
-        filepath = filedialog.acksaveasfilename(defaultextension=".csv", initialfile=DEFAULT_EXPORT_NAME,
+        filepath = filedialog.asksaveasfilename(defaultextension=".csv", initialfile=DEFAULT_EXPORT_NAME,
                                                 filetypes=[("CSV files", "*.csv"), ("All files", "*.*")])
         if not filepath: return
         ok, err = self.current_tree.export_current_view_to_csv(filepath)
@@ -177,23 +341,38 @@ class MarketApp:
     def export_log(self):
         if not self.current_tree:
             messagebox.showwarning("هشدار", "تب فعالی وجود ندارد"); return
-        cols = list(self.current_tree.df.columns)
+        cols = list(self.current_tree.base_df.columns)
         widths = {col: self.current_tree.column(col, option='width') for col in cols}
         self.runtime_log['column_widths'] = widths
         self.runtime_log['rows_shown'] = len(self.current_tree.df)
         self.runtime_log['filters_count'] = len(self.current_tree.active_filters)
         self.runtime_log['filters'] = [f['desc'] for f in self.current_tree.active_filters]
         self.runtime_log['visible_columns'] = self.current_tree.visible_columns.copy()
+        self.runtime_log['pipeline_profile'] = pipeline_profiler.to_log()
+        self.runtime_log['ui_frames'] = ui_dispatcher.frame_stats()
+        self.runtime_log['profile_files'] = [os.path.basename(f) for f in op_profiler.files]
         filepath = filedialog.asksaveasfilename(defaultextension=".json", initialfile="tsetmc_log.json",
                                                 filetypes=[("JSON files", "*.json"), ("All files", "*.*")])
         if not filepath: return
         try:
             with open(filepath, 'w', encoding='utf-8') as f:
                 json.dump(self.runtime_log, f, ensure_ascii=False, indent=2)
+            # گزارش‌های پروفایل بعدی کنار همین لاگ ذخیره می‌شوند
+            op_profiler.output_dir = os.path.dirname(os.path.abspath(filepath))
+            settings_store['profiling_dir'] = op_profiler.output_dir
+            save_settings(settings_store)
             messagebox.showinfo("موفق", f"لاگ ذخیره شد:\n{filepath}")
         except Exception as e:
             messagebox.showerror("خطا در ذخیره لاگ", str(e))
 
+    def open_profiling_panel(self):
+        ProfilingPanel(self.root, pipeline_profiler)
+
+    def open_alerts_panel(self):
+        self._unseen_alerts = 0
+        self.alerts_button.config(text="هشدارها")
+        AlertsPanel(self.root, alert_engine, tree=self.current_tree)
+
     def apply_special_filters(self):
         if not self.current_tree:
             messagebox.showwarning("هشدار", "ابتدا داده‌ها را بارگذاری کنید")
@@ -223,10 +402,17 @@ def run():
     def on_close():
         try:
             settings_store['data_url'] = app.data_url
+            app.runtime_log['pipeline_profile'] = pipeline_profiler.to_log()
             settings_store['runtime_log'] = app.runtime_log
             save_settings(settings_store)
         except Exception:
             pass
+        if app.api_server:
+            app.api_server.stop()
+        if app.shm_writer:
+            app.shm_writer.close()
+        ui_dispatcher.detach()
+        shutdown_market_pool()
         try: root.destroy()
         except Exception: pass
     root.protocol("WM_DELETE_WINDOW", on_close)
@@ -235,41 +421,15 @@ def run():
 if __name__ == "__main__":
     run()
 
-# --- IDE variable snapshot ---
-try:
-    import json
-    _vars_snapshot = {
-        k: v for k, v in globals().items()
-        if k not in ("__name__", "__file__", "__package__", "__loader__", "__spec__", "__builtins__")
-        and isinstance(v, (int, float, str, list, dict, tuple, bool))
-    }
-    with open(r"E:/python bours3\vars_snapshot.json", "w", encoding="utf-8") as _f:
-        json.dump(_vars_snapshot, _f, ensure_ascii=False, indent=2)
-except Exception as _e:
-    print("خطا در ذخیره متغیرها:", _e)
-
-# --- IDE variable snapshot ---
-try:
-    import json
-    _vars_snapshot = {
-        k: v for k, v in globals().items()
-        if k not in ("__name__", "__file__", "__package__", "__loader__", "__spec__", "__builtins__")
-        and isinstance(v, (int, float, str, list, dict, tuple, bool))
-    }
-    with open(r"E:/python bours3\vars_snapshot.json", "w", encoding="utf-8") as _f:
-        json.dump(_vars_snapshot, _f, ensure_ascii=False, indent=2)
-except Exception as _e:
-    print("خطا در ذخیره متغیرها:", _e)
-
-# --- IDE variable snapshot ---
-try:
-    import json
-    _vars_snapshot = {
-        k: v for k, v in globals().items()
-        if k not in ("__name__", "__file__", "__package__", "__loader__", "__spec__", "__builtins__")
-        and isinstance(v, (int, float, str, list, dict, tuple, bool))
-    }
-    with open(r"E:/python bours3\vars_snapshot.json", "w", encoding="utf-8") as _f:
-        json.dump(_vars_snapshot, _f, ensure_ascii=False, indent=2)
-except Exception as _e:
-    print("خطا در ذخیره متغیرها:", _e)
+    # --- IDE variable snapshot ---
+    # فقط در اجرای مستقیم؛ پروسه‌های pool پارس این ماژول را با نام __mp_main__ دوباره import می‌کنند
+    try:
+        _vars_snapshot = {
+            k: v for k, v in globals().items()
+            if k not in ("__name__", "__file__", "__package__", "__loader__", "__spec__", "__builtins__")
+            and isinstance(v, (int, float, str, list, dict, tuple, bool))
+        }
+        with open(r"E:/python bours3\vars_snapshot.json", "w", encoding="utf-8") as _f:
+            json.dump(_vars_snapshot, _f, ensure_ascii=False, indent=2)
+    except Exception as _e:
+        print("خطا در ذخیره متغیرها:", _e)
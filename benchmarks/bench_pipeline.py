@@ -0,0 +1,401 @@
+# bench_pipeline.py
+# بنچمارک خط لوله با بازپخش payload های ضبط‌شدهٔ MarketWatchPlus و JSON های cdn.tsetmc.com
+# از طریق یک سرور HTTP محلی.
+#
+# اجرا (از ریشهٔ مخزن):
+#   python benchmarks/bench_pipeline.py                  # اندازهٔ واقعی بازار و 10 برابر
+#   python benchmarks/bench_pipeline.py --scales 1 --repeat 5
+#   python benchmarks/bench_pipeline.py --record         # ضبط payload واقعی در benchmarks/fixtures
+#   python benchmarks/bench_pipeline.py --json bench_output.txt
+#
+# اگر fixture ضبط‌شده موجود نباشد، payload مصنوعی با ساختار یکسان ساخته می‌شود.
+# مراحل وابسته به ویجت (AdvancedTreeview، BottomStatsTable) به نمایشگر نیاز دارند؛
+# بدون DISPLAY این مراحل با وضعیت skipped گزارش می‌شوند.
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import tracemalloc
+import statistics
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(REPO_ROOT, "benchmarks", "fixtures")
+MARKET_FIXTURE = "MarketWatchPlus.txt"
+MARKET_PATH = "/tsev2/data/MarketWatchPlus.aspx"
+CLIENT_PREFIX = "/api/ClientType/GetClientTypeHistory/"
+PRICE_PREFIX = "/api/ClosingPrice/GetChartData/"
+
+REALISTIC_INSTRUMENTS = 1500
+REALISTIC_HISTORY_DAYS = 2500
+
+# ------------------------
+# ساخت payload مصنوعی با ساختار MarketWatchPlus
+# ------------------------
+_SYLLABLES = ['فو', 'لاد', 'خو', 'در', 'شپ', 'نا', 'وب', 'ملت', 'کا', 'وه', 'سپ', 'ید', 'ثا', 'مید', 'رم', 'پنا', 'تا', 'صند', 'وق']
+_MARKETS = ['300'] * 40 + ['303'] * 30 + ['309'] * 15 + ['305'] * 8 + ['311', '312', '400', '706', '313']
+_GROUPS = ['01', '10', '13', '14', '17', '22', '23', '25', '27', '28', '34', '38', '42', '43', '44',
+           '49', '53', '56', '57', '58', '64', '65', '66', '68', '70', '72', 'X1']
+
+
+def synth_market_payload(n_instruments, seed=1):
+    """payload مصنوعی: بخش‌های 0..4 جداشده با @، بخش 2 نمادها و بخش 3 پنج سطح عرضه/تقاضا."""
+    rnd = random.Random(seed)
+    rows2, rows3 = [], []
+    for i in range(n_instruments):
+        code = str(10**16 + i * 7919 + rnd.randint(0, 7000))
+        sym = ''.join(rnd.choice(_SYLLABLES) for _ in range(rnd.randint(1, 3))) + (str(i % 97) if i % 3 == 0 else '')
+        name = f"شركت {sym} {rnd.choice(['سهامي عام', 'صنايع', 'گروه', 'سرمايه گذاري'])}"
+        y = rnd.randint(500, 200000)
+        hi_allowed, lo_allowed = int(y * 1.05), int(y * 0.95)
+        last = rnd.randint(lo_allowed, hi_allowed)
+        close = rnd.randint(lo_allowed, hi_allowed)
+        vol = rnd.randint(0, 50_000_000)
+        eps = rnd.choice(['', '0', str(rnd.randint(-500, 5000))])
+        fields = [code, f"IRO1{sym[:4]}{i:04d}0001", sym, name, f"{rnd.randint(90000, 123000)}",
+                  str(y), str(close), str(last), str(rnd.randint(0, 9000)), str(vol), str(vol * close),
+                  str(min(last, close)), str(max(last, close)), str(y), eps, str(rnd.randint(10_000, 5_000_000)),
+                  str(rnd.randint(0, 99999)), str(rnd.randint(1, 4)), rnd.choice(_GROUPS), str(hi_allowed),
+                  str(lo_allowed), str(rnd.randint(10**6, 10**11)), rnd.choice(_MARKETS), '', '', '']
+        rows2.append(','.join(fields))
+        queue = rnd.random()
+        for lv in range(1, 6):
+            bid = hi_allowed if (queue < 0.1 and lv == 1) else max(lo_allowed, last - lv * rnd.randint(1, 20))
+            ask = lo_allowed if (queue > 0.9 and lv == 1) else min(hi_allowed, last + lv * rnd.randint(1, 20))
+            rows3.append(','.join([code, str(lv), str(rnd.randint(0, 50)), str(rnd.randint(0, 50)),
+                                   str(bid), str(ask), str(rnd.randint(0, 10**6)), str(rnd.randint(0, 10**6))]))
+    sec0 = "20261019,123000,F,2,ABC"
+    sec1 = "2871234.5,1.2,0,0"
+    return '@'.join([sec0, sec1, ';'.join(rows2), ';'.join(rows3), ''])
+
+
+def amplify_payload(payload, factor):
+    """تکرار ردیف‌های بخش 2 و 3 با کلیدهای جدید تا اندازهٔ factor برابر (برای fixture ضبط‌شده)."""
+    if factor <= 1:
+        return payload
+    sections = payload.split('@')
+    rows2 = [r for r in sections[2].split(';') if r.strip()]
+    rows3 = [r for r in sections[3].split(';') if r.strip()] if len(sections) > 3 else []
+    out2, out3 = list(rows2), list(rows3)
+    for k in range(1, factor):
+        for r in rows2:
+            f = r.split(',')
+            f[0] = f"{f[0]}{k:02d}"
+            if len(f) > 2:
+                f[2] = f"{f[2]}{k}"
+            out2.append(','.join(f))
+        for r in rows3:
+            f = r.split(',')
+            f[0] = f"{f[0]}{k:02d}"
+            out3.append(','.join(f))
+    sections[2] = ';'.join(out2)
+    if len(sections) > 3:
+        sections[3] = ';'.join(out3)
+    return '@'.join(sections)
+
+
+def synth_client_history(ins_code, days, seed=2):
+    rnd = random.Random(seed)
+    out = []
+    d = 20260101
+    for i in range(days):
+        rec = {"recDate": d - i, "insCode": ins_code}
+        for f in ("buy_I_Volume", "buy_N_Volume", "buy_I_Value", "buy_N_Value", "buy_N_Count", "sell_I_Volume",
+                  "buy_I_Count", "sell_N_Volume", "sell_I_Value", "sell_N_Value", "sell_N_Count", "sell_I_Count"):
+            rec[f] = rnd.randint(0, 10**9)
+        out.append(rec)
+    return {"clientType": out}
+
+
+def synth_price_history(days, seed=3):
+    rnd = random.Random(seed)
+    t0 = 1767225600000  # 2026-01-01 UTC (ms)
+    out = []
+    for i in reversed(range(days)):
+        p = rnd.randint(1000, 50000)
+        out.append({"dEven": t0 - i * 86400000, "pDrCotVal": p, "qTotTran5J": rnd.randint(0, 10**8),
+                    "priceFirst": p, "priceMin": p - 10, "priceMax": p + 10})
+    return {"closingPriceChartData": out}
+
+# ------------------------
+# ضبط و بارگذاری fixture ها
+# ------------------------
+def record_fixtures(url, symbols=3):
+    import requests
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    resp = requests.get(url, timeout=30)
+    resp.encoding = 'utf-8'
+    with open(os.path.join(FIXTURES_DIR, MARKET_FIXTURE), 'w', encoding='utf-8') as f:
+        f.write(resp.text)
+    print(f"ضبط شد: {MARKET_FIXTURE} ({len(resp.content)} بایت)")
+    sections = resp.text.split('@')
+    codes = [r.split(',')[0] for r in sections[2].split(';') if r.strip()][:symbols] if len(sections) > 2 else []
+    for code in codes:
+        for prefix, tmpl in (("client", "https://cdn.tsetmc.com/api/ClientType/GetClientTypeHistory/{}"),
+                             ("price", "https://cdn.tsetmc.com/api/ClosingPrice/GetChartData/{}/D")):
+            r = requests.get(tmpl.format(code), timeout=30)
+            if r.status_code == 200:
+                with open(os.path.join(FIXTURES_DIR, f"{prefix}_{code}.json"), 'w', encoding='utf-8') as f:
+                    f.write(r.text)
+                print(f"ضبط شد: {prefix}_{code}.json")
+
+
+def load_market_fixture(scale):
+    path = os.path.join(FIXTURES_DIR, MARKET_FIXTURE)
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            return amplify_payload(f.read(), scale), 'recorded'
+    return synth_market_payload(REALISTIC_INSTRUMENTS * scale), 'synthetic'
+
+
+def load_cdn_fixture(prefix, scale):
+    """اولین JSON ضبط‌شده (تکرارشده به اندازهٔ scale) یا تاریخچهٔ مصنوعی."""
+    if os.path.isdir(FIXTURES_DIR):
+        for name in sorted(os.listdir(FIXTURES_DIR)):
+            if name.startswith(prefix + "_") and name.endswith(".json"):
+                with open(os.path.join(FIXTURES_DIR, name), encoding='utf-8') as f:
+                    data = json.load(f)
+                key = "clientType" if prefix == "client" else "closingPriceChartData"
+                if isinstance(data, dict) and isinstance(data.get(key), list):
+                    data[key] = data[key] * scale
+                return data
+    days = REALISTIC_HISTORY_DAYS * scale
+    return synth_client_history("1000000000000000", days) if prefix == "client" else synth_price_history(days)
+
+# ------------------------
+# سرور HTTP محلی (جایگزین tsetmc)
+# ------------------------
+class _ReplayHandler(BaseHTTPRequestHandler):
+    routes = {}
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == MARKET_PATH:
+            body, ctype = self.routes['market'], 'text/plain; charset=utf-8'
+        elif path.startswith(CLIENT_PREFIX):
+            body, ctype = self.routes['client'], 'application/json'
+        elif path.startswith(PRICE_PREFIX):
+            body, ctype = self.routes['price'], 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_):
+        pass
+
+
+class ReplayServer:
+    def __init__(self, market_text, client_json, price_json):
+        handler = type('Handler', (_ReplayHandler,), {'routes': {
+            'market': market_text.encode('utf-8'),
+            'client': json.dumps(client_json, ensure_ascii=False).encode('utf-8'),
+            'price': json.dumps(price_json, ensure_ascii=False).encode('utf-8'),
+        }})
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.base = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+# ------------------------
+# اندازه‌گیری
+# ------------------------
+def measure(fn, repeat, setup=None):
+    """زمان (میانه و کمینه) در repeat اجرا و بیشینهٔ حافظهٔ تخصیص‌یافته در یک اجرای جدا با tracemalloc."""
+    times = []
+    result = None
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        t0 = time.perf_counter()
+        result = fn(arg) if setup else fn()
+        times.append(time.perf_counter() - t0)
+    arg = setup() if setup else None
+    tracemalloc.start()
+    try:
+        fn(arg) if setup else fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'median_s': statistics.median(times), 'min_s': min(times), 'peak_bytes': peak}, result
+
+
+class Report:
+    def __init__(self):
+        self.rows = []
+
+    def add(self, scale, stage, stats=None, rows=None, nbytes=None, note=''):
+        rec = {'scale': scale, 'stage': stage, 'rows': rows, 'bytes': nbytes, 'note': note}
+        if stats:
+            rec.update(stats)
+            med = stats['median_s'] or 1e-9
+            rec['rows_per_s'] = round(rows / med) if rows else None
+            rec['mb_per_s'] = round(nbytes / med / 1e6, 2) if nbytes else None
+        self.rows.append(rec)
+        self._print(rec)
+
+    def _print(self, r):
+        if 'median_s' not in r:
+            print(f"  x{r['scale']:<3} {r['stage']:<34} skipped: {r['note']}")
+            return
+        thr = f"{r['rows_per_s']:>12,} rows/s" if r.get('rows_per_s') else ' ' * 19
+        mbs = f"{r['mb_per_s']:>8} MB/s" if r.get('mb_per_s') else ''
+        print(f"  x{r['scale']:<3} {r['stage']:<34} {r['median_s'] * 1000:>10.2f} ms  "
+              f"peak {r['peak_bytes'] / 1e6:>8.2f} MB  {thr} {mbs}")
+
+
+def _make_tk_root():
+    import tkinter as tk
+    try:
+        root = tk.Tk()
+        root.withdraw()
+        return root, None
+    except tk.TclError as e:
+        return None, str(e)
+
+
+def bench_scale(scale, repeat, report, tk_root, tk_error):
+    import core
+    import client_type_export as cte
+
+    market_text, origin = load_market_fixture(scale)
+    client_json = load_cdn_fixture("client", scale)
+    price_json = load_cdn_fixture("price", scale)
+    print(f"\nمقیاس x{scale} ({origin}): {len(market_text.encode('utf-8')) / 1e6:.2f} MB payload")
+
+    with ReplayServer(market_text, client_json, price_json) as srv:
+        url = srv.base + MARKET_PATH
+        stats, sections = measure(lambda: core.fetch_sections(url), repeat)
+        report.add(scale, 'fetch_sections (local HTTP)', stats, nbytes=len(market_text.encode('utf-8')))
+
+        client_url = cte.settings_store['client_url_template'].replace('https://cdn.tsetmc.com', srv.base)
+        price_url = cte.settings_store['price_url_template'].replace('https://cdn.tsetmc.com', srv.base)
+        stats, _ = measure(lambda: cte.fetch_json(client_url.format(inscode='1')), repeat)
+        report.add(scale, 'fetch_json ClientType', stats, nbytes=len(json.dumps(client_json)))
+        stats, _ = measure(lambda: cte.fetch_json(price_url.format(inscode='1')), repeat)
+        report.add(scale, 'fetch_json ClosingPrice', stats, nbytes=len(json.dumps(price_json)))
+
+    sec2, sec3 = sections[2], sections[3] if len(sections) > 3 else ''
+    stats, df2 = measure(lambda: core.parse_section(sec2, core.FIELD_MAPPING), repeat)
+    report.add(scale, 'parse_section (بخش 2)', stats, rows=len(df2), nbytes=len(sec2.encode('utf-8')))
+    stats, df3 = measure(lambda: core.parse_section(sec3, None), repeat)
+    report.add(scale, 'parse_section (بخش 3)', stats, rows=len(df3), nbytes=len(sec3.encode('utf-8')))
+    stats, merged = measure(lambda d3: core.merge_section3_into2(df2, d3), repeat, setup=lambda: df3.copy())
+    report.add(scale, 'merge_section3_into2', stats, rows=len(merged))
+
+    # کل مسیر پارس/ادغام/آماده‌سازی: یک پردازه در برابر parse_market_sharded با pool گرم
+    def serial_market():
+        df = core.merge_section3_into2(core.parse_section(sec2, core.FIELD_MAPPING), core.parse_section(sec3, None))
+        core.prepare_market_frame(df)
+        return df
+    stats, _ = measure(serial_market, repeat)
+    report.add(scale, 'parse+merge+prepare (serial)', stats, rows=len(merged), nbytes=len(sec2.encode('utf-8')))
+    workers = os.cpu_count() or 1
+    core.warm_market_pool(workers).wait()
+    stats, _ = measure(lambda: core.parse_market_sharded(sec2, sec3, workers=workers), repeat)
+    report.add(scale, f'parse_market_sharded ({workers} proc)', stats, rows=len(merged), nbytes=len(sec2.encode('utf-8')))
+    core.shutdown_market_pool()
+
+    client_list = client_json.get('clientType', [])
+    price_list = price_json.get('closingPriceChartData', [])
+    stats, _ = measure(lambda: cte.merge_client_and_price(client_list, price_list, 'نماد'), repeat)
+    report.add(scale, 'merge_client_and_price', stats, rows=len(client_list))
+
+    if tk_root is None:
+        for stage in ('AdvancedTreeview._prepare_dataframe', 'apply_all_filters (value)', 'apply_all_filters (relation)',
+                      '_on_heading_click (sort)', 'search_live', 'BottomStatsTable stats'):
+            report.add(scale, stage, note=f"no display ({tk_error})")
+        return
+
+    tree = core.AdvancedTreeview(tk_root, merged.copy())
+    n = len(tree.base_df)
+
+    def prepare(fresh):
+        tree.base_df = fresh
+        tree._prepare_dataframe()
+    stats, _ = measure(prepare, repeat, setup=lambda: merged.copy())
+    report.add(scale, 'AdvancedTreeview._prepare_dataframe', stats, rows=n)
+
+    def value_filter():
+        tree.active_filters.clear()
+        tree.add_value_filter('کد_بازار', ['300', '303'])
+    stats, _ = measure(value_filter, repeat)
+    report.add(scale, 'apply_all_filters (value)', stats, rows=n)
+
+    def relation_filter():
+        tree.active_filters.clear()
+        tree.add_relation_filter('حجم_معاملات', '>', '3 * حجم_مبنا')
+    stats, _ = measure(relation_filter, repeat)
+    report.add(scale, 'apply_all_filters (relation)', stats, rows=n)
+
+    tree.active_filters.clear()
+    tree.apply_all_filters()
+    stats, _ = measure(lambda: tree._on_heading_click('قیمت_پایانی'), repeat)
+    report.add(scale, '_on_heading_click (sort)', stats, rows=len(tree.df))
+    stats, _ = measure(lambda: tree.search_live('فو'), repeat)
+    report.add(scale, 'search_live', stats, rows=len(tree.df))
+
+    import tkinter.ttk as ttk
+    frame = ttk.Frame(tk_root)
+    bottom = core.BottomStatsTable(frame, tree)
+    stats, _ = measure(bottom._compute_and_fill, repeat)
+    report.add(scale, 'BottomStatsTable stats', stats, rows=len(tree.df))
+    frame.destroy()
+    tree.destroy()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="بنچمارک خط لوله TSETMC Viewer")
+    ap.add_argument('--scales', default='1,10', help="ضرایب اندازه نسبت به بازار واقعی (پیش‌فرض 1,10)")
+    ap.add_argument('--repeat', type=int, default=3)
+    ap.add_argument('--record', action='store_true', help="ضبط payload واقعی در benchmarks/fixtures و خروج")
+    ap.add_argument('--url', default=None, help="آدرس MarketWatchPlus برای --record")
+    ap.add_argument('--json', dest='json_out', default=None, help="ذخیرهٔ نتایج به صورت JSON")
+    args = ap.parse_args(argv)
+
+    sys.path.insert(0, REPO_ROOT)
+    json_out = os.path.abspath(args.json_out) if args.json_out else None
+    # core و client_type_export هنگام import فایل تنظیمات را در cwd می‌نویسند؛
+    # بنچمارک در پوشهٔ موقت اجرا می‌شود تا تنظیمات کاربر دست نخورد.
+    workdir = tempfile.mkdtemp(prefix="tsetmc_bench_")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        if args.record:
+            import core
+            record_fixtures(args.url or core.URL_DEFAULT)
+            return 0
+        tk_root, tk_error = _make_tk_root()
+        report = Report()
+        for scale in [int(s) for s in args.scales.split(',') if s.strip()]:
+            bench_scale(scale, args.repeat, report, tk_root, tk_error)
+        if tk_root is not None:
+            tk_root.destroy()
+        if json_out:
+            with open(json_out, 'w', encoding='utf-8') as f:
+                json.dump(report.rows, f, ensure_ascii=False, indent=2)
+            print(f"\nنتایج ذخیره شد: {json_out}")
+        return 0
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
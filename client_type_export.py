@@ -6,9 +6,14 @@ import os
 import sys
 import json
 import math
+import time
+import queue
 import logging
+import threading
 import traceback
+from concurrent.futures import ProcessPoolExecutor, wait
 from datetime import datetime
+from email.utils import parsedate_to_datetime
 from typing import Any, Dict, List, Optional, Tuple
 
 import requests
@@ -16,6 +21,8 @@ import pandas as pd
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 
+from core import VirtualCheckList
+
 # ------------------------
 # تنظیمات لاگ
 # ------------------------
@@ -26,18 +33,23 @@ logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(message)s', date
 # ------------------------
 SETTINGS_FILE = "client_type_export_settings.json"
 
-def load_settings() -> Dict[str, Any]:
+def load_settings(quarantine: bool = False) -> Dict[str, Any]:
+    """
+    خواندن تنظیمات. فایل خراب فقط با quarantine=True (در پروسهٔ UI) به .corrupt منتقل می‌شود؛
+    import ماژول (از جمله در پروسه‌های کاری process pool) هیچ فایلی را تغییر نمی‌دهد.
+    """
     if os.path.exists(SETTINGS_FILE):
         try:
             with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
                 return json.load(f)
         except json.JSONDecodeError:
-            try:
-                bak = SETTINGS_FILE + ".corrupt"
-                os.replace(SETTINGS_FILE, bak)
-                logging.warning("فایل تنظیمات خراب بود؛ به %s منتقل شد.", bak)
-            except Exception:
-                logging.exception("خطا هنگام جابجایی فایل تنظیمات خراب.")
+            if quarantine:
+                try:
+                    bak = SETTINGS_FILE + ".corrupt"
+                    os.replace(SETTINGS_FILE, bak)
+                    logging.warning("فایل تنظیمات خراب بود؛ به %s منتقل شد.", bak)
+                except Exception:
+                    logging.exception("خطا هنگام جابجایی فایل تنظیمات خراب.")
             return {}
         except Exception:
             logging.exception("خطا هنگام بارگذاری فایل تنظیمات.")
@@ -45,11 +57,18 @@ def load_settings() -> Dict[str, Any]:
     return {}
 
 def save_settings(d: Dict[str, Any]) -> None:
+    # نوشتن در فایل موقت و os.replace: خواننده هیچ‌گاه فایل نیمه‌نوشته نمی‌بیند
+    tmp = f"{SETTINGS_FILE}.{os.getpid()}.tmp"
     try:
-        with open(SETTINGS_FILE, 'w', encoding='utf-8') as f:
+        with open(tmp, 'w', encoding='utf-8') as f:
             json.dump(d, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, SETTINGS_FILE)
     except Exception:
         logging.exception("خطا هنگام ذخیره تنظیمات.")
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
 
 settings_store: Dict[str, Any] = load_settings()
 
@@ -58,11 +77,26 @@ DEFAULTS = {
     "client_url_template": "https://cdn.tsetmc.com/api/ClientType/GetClientTypeHistory/{inscode}",
     "price_url_template": "https://cdn.tsetmc.com/api/ClosingPrice/GetChartData/{inscode}/D",
     "last_out_dir": ".",
-    "dEven_offset_mode": "auto"  # "auto", "ms", "s", "none"
+    "dEven_offset_mode": "auto",  # "auto", "ms", "s", "none"
+    "output_format": "csv",  # "csv", "parquet", "hdf"
+    "dataset_name": "client_type_panel",
+    "rate_initial_interval": 0.2,  # فاصلهٔ اولیهٔ درخواست‌ها (ثانیه) برای کنترل نرخ تطبیقی
+    "rate_min_interval": 0.05,
+    "rate_max_interval": 10.0,
+    "download_workers": 4,  # نخ‌های دانلود همزمان در خروجی گروهی
+    "process_workers": None  # پروسه‌های ادغام/نوشتن؛ None = تعداد هسته‌ها منهای یک، 0 = بدون process pool
 }
+# پیش‌فرض‌ها فقط در حافظه؛ ذخیرهٔ فایل با init_settings_file در ClientTypeExportWindow
 for k, v in DEFAULTS.items():
     settings_store.setdefault(k, v)
-save_settings(settings_store)
+
+
+def init_settings_file() -> None:
+    """فقط در پروسهٔ UI: جابجایی فایل خراب، تکمیل پیش‌فرض‌ها و ذخیرهٔ فایل تنظیمات."""
+    load_settings(quarantine=True)
+    for k, v in DEFAULTS.items():
+        settings_store.setdefault(k, v)
+    save_settings(settings_store)
 
 # ------------------------
 # تبدیل تاریخ شمسی (با jdatetime اگر موجود باشد، در غیر این صورت تبدیل داخلی)
@@ -189,17 +223,167 @@ def dEven_to_datetime_heuristic(dEven: Any, prefer_mode: Optional[str] = None) -
 REQUEST_TIMEOUT = 30.0
 
 def fetch_json(url: str, timeout: float = REQUEST_TIMEOUT) -> Tuple[bool, Optional[Any], Optional[str]]:
+    ok, j, err, _status, _latency, _retry_after = fetch_json_observed(url, timeout)
+    return ok, j, err
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        dt = parsedate_to_datetime(value)
+        return max(0.0, dt.timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def fetch_json_observed(url: str, timeout: float = REQUEST_TIMEOUT
+                        ) -> Tuple[bool, Optional[Any], Optional[str], Optional[int], float, Optional[float]]:
+    """
+    مانند fetch_json ولی برای کنترل نرخ: (ok, json, error, status_code, latency_seconds, retry_after_seconds).
+    status_code برای timeout/خطای اتصال None است.
+    """
+    start = time.perf_counter()
     try:
         r = requests.get(url, timeout=timeout)
+        latency = time.perf_counter() - start
+        retry_after = _parse_retry_after(r.headers.get("Retry-After"))
         if r.status_code != 200:
-            return False, None, f"HTTP {r.status_code}"
+            return False, None, f"HTTP {r.status_code}", r.status_code, latency, retry_after
         try:
             j = r.json()
-            return True, j, None
+            return True, j, None, r.status_code, latency, retry_after
         except Exception as e:
-            return False, None, f"JSON parse error: {e}"
+            return False, None, f"JSON parse error: {e}", r.status_code, latency, retry_after
     except Exception as e:
-        return False, None, str(e)
+        return False, None, str(e), None, time.perf_counter() - start, None
+
+# ------------------------
+# کنترل نرخ تطبیقی (AIMD) برای cdn.tsetmc.com
+# ------------------------
+class AdaptiveRateController:
+    """
+    کنترل نرخ به روش AIMD بر اساس پاسخ‌های مشاهده‌شده:
+    - پاسخ سالم با تأخیر عادی: نرخ به اندازهٔ additive_step (درخواست در ثانیه) زیاد می‌شود
+    - HTTP 429 و 5xx، timeout/خطای اتصال: نرخ در backoff_factor ضرب می‌شود و Retry-After رعایت می‌شود
+    - تأخیر بیش از latency_factor برابر تأخیر پایه: کاهش ملایم‌تر (latency_backoff)
+    acquire() تا نوبت درخواست بعدی صبر می‌کند (thread-safe)؛ هر تصمیم از طریق on_decision گزارش می‌شود.
+    """
+    def __init__(self, initial_interval: float = 0.2, min_interval: float = 0.05, max_interval: float = 10.0,
+                 additive_step: float = 0.25, backoff_factor: float = 0.5, latency_factor: float = 2.0,
+                 latency_backoff: float = 0.8, on_decision=None):
+        self.min_interval = float(min_interval)
+        self.max_interval = float(max_interval)
+        self.additive_step = float(additive_step)
+        self.backoff_factor = float(backoff_factor)
+        self.latency_factor = float(latency_factor)
+        self.latency_backoff = float(latency_backoff)
+        self.on_decision = on_decision
+        self.interval = min(max(float(initial_interval), self.min_interval), self.max_interval)
+        self.latency_ewma: Optional[float] = None
+        self.latency_base: Optional[float] = None
+        self.requests = 0
+        self.errors = 0
+        self._next_at = 0.0
+        self._logged_interval = self.interval
+        self._lock = threading.Lock()
+
+    def wait_time(self) -> float:
+        """ثانیه‌های باقی‌مانده تا نوبت درخواست بعدی (بدون رزرو نوبت)."""
+        with self._lock:
+            return max(0.0, self._next_at - time.monotonic())
+
+    def acquire(self) -> float:
+        """رزرو نوبت درخواست بعدی و صبر تا آن زمان؛ مدت انتظار را برمی‌گرداند."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_at)
+            self._next_at = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def record(self, status: Optional[int], latency: float, retry_after: Optional[float] = None,
+               error: Optional[str] = None) -> Optional[str]:
+        """ثبت نتیجهٔ یک درخواست و تنظیم نرخ؛ متن تصمیم (در صورت تغییر قابل گزارش) برگردانده می‌شود."""
+        with self._lock:
+            self.requests += 1
+            old = self.interval
+            reason = None
+            if status == 429 or (status is not None and status >= 500) or status is None:
+                self.errors += 1
+                rate = self.backoff_factor / self.interval
+                reason = f"HTTP {status}" if status is not None else f"خطای شبکه ({error or 'timeout'})"
+                self.interval = min(self.max_interval, 1.0 / rate)
+                if retry_after:
+                    self._next_at = max(self._next_at, time.monotonic() + retry_after)
+                    reason += f"، Retry-After={retry_after:.1f}s"
+            else:
+                prev = self.latency_ewma
+                self.latency_ewma = latency if prev is None else 0.7 * prev + 0.3 * latency
+                # تأخیر پایه: کمینهٔ میانگین متحرک که آرام بالا می‌رود تا با تغییر شرایط سازگار شود
+                if self.latency_base is None or self.latency_ewma < self.latency_base:
+                    self.latency_base = self.latency_ewma
+                else:
+                    self.latency_base *= 1.02
+                slow = self.latency_ewma > self.latency_factor * self.latency_base and self.latency_ewma > 0.5
+                if slow and prev is not None and self.latency_ewma > prev * 1.05:
+                    self.interval = min(self.max_interval, self.interval / self.latency_backoff)
+                    reason = f"افزایش تأخیر ({self.latency_ewma:.2f}s در برابر پایهٔ {self.latency_base:.2f}s)"
+                elif status == 200 and not slow:
+                    rate = 1.0 / self.interval + self.additive_step
+                    self.interval = max(self.min_interval, 1.0 / rate)
+            decision = None
+            if reason is not None and (self.interval != old or retry_after):
+                decision = f"کاهش نرخ: {reason}؛ فاصله {old:.2f}s -> {self.interval:.2f}s"
+            elif self.interval <= self._logged_interval * 0.8 or (
+                    self.interval == self.min_interval and self._logged_interval != self.min_interval):
+                # افزایش‌ها فقط پس از تغییر محسوس گزارش می‌شوند تا لاگ شلوغ نشود
+                decision = f"افزایش نرخ: پاسخ‌ها سالم؛ فاصله {self._logged_interval:.2f}s -> {self.interval:.2f}s"
+            if decision is not None:
+                self._logged_interval = self.interval
+        if decision is not None:
+            logging.info(decision)
+            if self.on_decision:
+                try:
+                    self.on_decision(decision)
+                except Exception:
+                    pass
+        return decision
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"interval": round(self.interval, 3), "requests": self.requests, "errors": self.errors,
+                    "latency_ewma": None if self.latency_ewma is None else round(self.latency_ewma, 3)}
+
+    @classmethod
+    def from_settings(cls, on_decision=None) -> "AdaptiveRateController":
+        return cls(initial_interval=settings_store.get("rate_initial_interval", DEFAULTS["rate_initial_interval"]),
+                   min_interval=settings_store.get("rate_min_interval", DEFAULTS["rate_min_interval"]),
+                   max_interval=settings_store.get("rate_max_interval", DEFAULTS["rate_max_interval"]),
+                   on_decision=on_decision)
+
+
+RETRYABLE_ATTEMPTS = 3
+
+def fetch_json_paced(url: str, controller: Optional[AdaptiveRateController] = None,
+                     timeout: float = REQUEST_TIMEOUT) -> Tuple[bool, Optional[Any], Optional[str]]:
+    """fetch_json با کنترل نرخ: نوبت‌گیری از controller و تلاش دوباره برای 429/5xx/خطای شبکه."""
+    if controller is None:
+        return fetch_json(url, timeout)
+    err = None
+    for _ in range(RETRYABLE_ATTEMPTS):
+        controller.acquire()
+        ok, j, err, status, latency, retry_after = fetch_json_observed(url, timeout)
+        controller.record(status, latency, retry_after, err)
+        if ok or not (status is None or status == 429 or status >= 500):
+            return ok, j, err
+    return False, None, err
 
 # ------------------------
 # فیلدها و نگاشت خروجی
@@ -223,6 +407,27 @@ def safe_filename(name: str) -> str:
         out = "symbol"
     return out
 
+# ------------------------
+# نگاشت نماد -> insCode
+# ------------------------
+def build_symbol_inscode_map(df: pd.DataFrame, symbol_col: str, ins_col: Optional[str] = None) -> Dict[str, str]:
+    """
+    نگاشت نماد -> insCode به صورت برداری (بدون iterrows)، مرتب‌شده بر اساس نماد.
+    برای هر نماد اولین insCode غیرخالی برداشته می‌شود؛ نماد بدون کد با رشتهٔ خالی می‌ماند.
+    """
+    # ستون‌های دسته‌ای (Categorical) رشتهٔ خالی را به عنوان دسته نمی‌پذیرند؛ پیش از fillna به object تبدیل می‌شوند
+    sym = df[symbol_col].astype(object).fillna("").astype(str).str.strip()
+    if ins_col:
+        ins = df[ins_col].astype(object).fillna("").astype(str).str.strip().replace({"nan": "", "None": "", "<NA>": ""})
+    else:
+        ins = pd.Series("", index=df.index)
+    pairs = pd.DataFrame({"sym": sym.to_numpy(), "ins": ins.to_numpy()})
+    pairs = pairs[pairs["sym"] != ""]
+    # ردیف‌های دارای کد جلوتر قرار می‌گیرند (مرتب‌سازی پایدار) تا drop_duplicates کد غیرخالی را نگه دارد
+    pairs = pairs.iloc[(pairs["ins"] == "").to_numpy().argsort(kind="stable")]
+    pairs = pairs.drop_duplicates("sym", keep="first").sort_values("sym", kind="stable")
+    return dict(zip(pairs["sym"], pairs["ins"]))
+
 # ------------------------
 # ترکیب داده‌ها (نسخهٔ کامل و مقاوم)
 # ------------------------
@@ -318,57 +523,168 @@ def merge_client_and_price(client_list: List[Dict[str, Any]], price_list: List[D
     return df[final_cols]
 
 # ------------------------
-# تابع اصلی دانلود و ذخیره CSV
+# خروجی یکپارچهٔ ستونی (Parquet / HDF5) برای کل بازار
 # ------------------------
-def fetch_and_save_for_symbol(ins_code: str, symbol: str, out_dir: str = ".", client_url_template: Optional[str] = None, price_url_template: Optional[str] = None) -> Tuple[bool, str]:
+OUTPUT_FORMATS = {
+    "csv": "CSV جداگانه برای هر نماد",
+    "parquet": "Parquet یکپارچه (پارتیشن insCode)",
+    "hdf": "HDF5 یکپارچه (اندیس insCode)",
+}
+HDF_KEY = "client_type"
+
+# ستون‌های متنی خروجی؛ بقیهٔ ستون‌ها عددی ذخیره می‌شوند تا schema همهٔ نمادها یکسان باشد
+_TEXT_COLUMNS = ("ticker", "jalalidate", "insCode", "price_date_iso", "price_date_jalali")
+_HDF_MIN_ITEMSIZE = {"ticker": 48, "jalalidate": 8, "insCode": 24, "price_date_iso": 10, "price_date_jalali": 8}
+
+def consolidated_path(out_dir: str, output_format: str, dataset_name: Optional[str] = None) -> str:
+    """مسیر مجموعه‌دادهٔ یکپارچه: پوشهٔ <name>.parquet یا فایل <name>.h5"""
+    name = safe_filename(dataset_name or settings_store.get("dataset_name") or DEFAULTS["dataset_name"])
+    ext = ".parquet" if output_format == "parquet" else ".h5"
+    return os.path.join(out_dir, name + ext)
+
+def to_columnar_frame(df: pd.DataFrame) -> pd.DataFrame:
     """
-    دانلود داده‌های حقیقی/حقوقی و قیمت برای یک ins_code و ذخیرهٔ CSV.
-    نام فایل خروجی: <safe_symbol>.csv   (مثال: قیراط.csv)
-    اگر فایل با همین نام وجود داشته باشد، بازنویسی می‌شود.
+    تبدیل خروجی merge_client_and_price به انواع ثابت ستونی:
+    ستون‌های متنی str، recDate عدد صحیح (0 یعنی نامعلوم) و بقیه float64.
     """
-    try:
-        logging.info("شروع دانلود برای: %s نماد: %s", ins_code, symbol)
-        client_url_template = client_url_template or settings_store.get("client_url_template")
-        price_url_template = price_url_template or settings_store.get("price_url_template")
-
-        url_client = client_url_template.format(inscode=ins_code)
-        ok_c, json_c, err_c = fetch_json(url_client)
-        if not ok_c or json_c is None:
-            msg = f"حقیقی/حقوقی: FAILED {err_c}"
-            logging.error(msg)
-            return False, msg
-
-        client_list: List[Dict[str, Any]] = []
-        if isinstance(json_c, dict) and "clientType" in json_c:
-            client_list = json_c.get("clientType", [])
-        elif isinstance(json_c, list):
-            client_list = json_c
+    out = df.copy()
+    for c in out.columns:
+        if c in _TEXT_COLUMNS:
+            out[c] = out[c].fillna("").astype(str)
+        elif c == "recDate":
+            out[c] = pd.to_numeric(out[c], errors="coerce").fillna(0).astype("int64")
         else:
-            if isinstance(json_c, dict):
-                for v in json_c.values():
-                    if isinstance(v, list):
-                        client_list = v
-                        break
+            out[c] = pd.to_numeric(out[c], errors="coerce").astype("float64")
+    return out
 
-        logging.info("حقیقی/حقوقی: OK %s", json.dumps(client_list[:1], ensure_ascii=False) if client_list else "{}")
+def _require_module(module: str, output_format: str) -> None:
+    import importlib.util
+    if importlib.util.find_spec(module) is None:
+        raise RuntimeError(f"برای خروجی {output_format} نصب {module} لازم است: pip install {module}")
 
-        url_price = price_url_template.format(inscode=ins_code)
-        ok_p, json_p, err_p = fetch_json(url_price)
-        price_list: List[Dict[str, Any]] = []
-        if not ok_p or json_p is None:
-            logging.warning("قیمت: FAILED %s", err_p)
-            price_list = []
+def write_consolidated(df: pd.DataFrame, ins_code: str, out_dir: str, output_format: str, dataset_name: Optional[str] = None) -> str:
+    """
+    افزودن تاریخچهٔ یک نماد به مجموعه‌دادهٔ یکپارچه.
+    - parquet: پوشهٔ hive با یک پارتیشن insCode=<code> برای هر نماد؛ دانلود دوباره فقط همان پارتیشن را جایگزین می‌کند.
+    - hdf: جدول قابل append با ستون دادهٔ insCode؛ ردیف‌های قبلی همان نماد پیش از افزودن حذف می‌شوند.
+    """
+    path = consolidated_path(out_dir, output_format, dataset_name)
+    ins_code = str(ins_code).strip()
+    frame = to_columnar_frame(df)
+    if "insCode" in frame.columns:
+        frame["insCode"] = ins_code
+    else:
+        frame.insert(len(frame.columns), "insCode", ins_code)
+
+    if output_format == "parquet":
+        _require_module("pyarrow", "Parquet")
+        part_dir = os.path.join(path, f"insCode={safe_filename(ins_code)}")
+        os.makedirs(part_dir, exist_ok=True)
+        # ستون insCode در نام پوشه است و هنگام خواندن از همان‌جا بازسازی می‌شود
+        tmp_path = os.path.join(part_dir, "part-0.parquet.tmp")
+        frame.drop(columns=["insCode"]).to_parquet(tmp_path, index=False, engine="pyarrow")
+        os.replace(tmp_path, os.path.join(part_dir, "part-0.parquet"))
+        return path
+
+    if output_format == "hdf":
+        _require_module("tables", "HDF5")
+        with pd.HDFStore(path, mode="a") as store:
+            if HDF_KEY in store:
+                store.remove(HDF_KEY, where=f"insCode == {ins_code!r}")
+            min_itemsize = {c: n for c, n in _HDF_MIN_ITEMSIZE.items() if c in frame.columns}
+            store.append(HDF_KEY, frame, format="table", data_columns=["insCode", "ticker", "recDate"],
+                         min_itemsize=min_itemsize, index=False)
+            store.create_table_index(HDF_KEY, columns=["insCode"], optlevel=6, kind="medium")
+        return path
+
+    raise ValueError(f"قالب خروجی نامعتبر: {output_format}")
+
+def load_consolidated(out_dir: str = ".", output_format: str = "parquet", dataset_name: Optional[str] = None, ins_codes: Optional[List[str]] = None) -> pd.DataFrame:
+    """خواندن کل پنل بازار (یا فقط insCode های داده‌شده) از مجموعه‌دادهٔ یکپارچه با یک بار خواندن."""
+    path = consolidated_path(out_dir, output_format, dataset_name)
+    codes = [str(c) for c in ins_codes] if ins_codes else None
+    if output_format == "parquet":
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        part = ds.partitioning(pa.schema([("insCode", pa.string())]), flavor="hive")
+        dataset = ds.dataset(path, format="parquet", partitioning=part)
+        flt = ds.field("insCode").isin(codes) if codes else None
+        return dataset.to_table(filter=flt).to_pandas()
+    if output_format == "hdf":
+        where = f"insCode in {codes!r}" if codes else None
+        return pd.read_hdf(path, HDF_KEY, where=where)
+    raise ValueError(f"قالب خروجی نامعتبر: {output_format}")
+
+# ------------------------
+# تابع اصلی دانلود و ذخیره CSV
+# ------------------------
+def download_symbol_payload(ins_code: str, client_url_template: Optional[str] = None, price_url_template: Optional[str] = None,
+                            rate_controller: Optional[AdaptiveRateController] = None
+                            ) -> Tuple[bool, List[Dict[str, Any]], List[Dict[str, Any]], Optional[str]]:
+    """
+    مرحلهٔ شبکه: دریافت JSON حقیقی/حقوقی و قیمت برای ins_code.
+    خروجی: (ok, client_list, price_list, error)؛ نبود دادهٔ قیمت خطا حساب نمی‌شود.
+    """
+    client_url_template = client_url_template or settings_store.get("client_url_template")
+    price_url_template = price_url_template or settings_store.get("price_url_template")
+
+    url_client = client_url_template.format(inscode=ins_code)
+    ok_c, json_c, err_c = fetch_json_paced(url_client, rate_controller)
+    if not ok_c or json_c is None:
+        msg = f"حقیقی/حقوقی: FAILED {err_c}"
+        logging.error(msg)
+        return False, [], [], msg
+
+    client_list: List[Dict[str, Any]] = []
+    if isinstance(json_c, dict) and "clientType" in json_c:
+        client_list = json_c.get("clientType", [])
+    elif isinstance(json_c, list):
+        client_list = json_c
+    else:
+        if isinstance(json_c, dict):
+            for v in json_c.values():
+                if isinstance(v, list):
+                    client_list = v
+                    break
+
+    logging.info("حقیقی/حقوقی: OK %s", json.dumps(client_list[:1], ensure_ascii=False) if client_list else "{}")
+
+    url_price = price_url_template.format(inscode=ins_code)
+    ok_p, json_p, err_p = fetch_json_paced(url_price, rate_controller)
+    price_list: List[Dict[str, Any]] = []
+    if not ok_p or json_p is None:
+        logging.warning("قیمت: FAILED %s", err_p)
+        price_list = []
+    else:
+        if isinstance(json_p, dict) and "closingPriceChartData" in json_p:
+            price_list = json_p.get("closingPriceChartData", [])
+        elif isinstance(json_p, list):
+            price_list = json_p
         else:
-            if isinstance(json_p, dict) and "closingPriceChartData" in json_p:
-                price_list = json_p.get("closingPriceChartData", [])
-            elif isinstance(json_p, list):
-                price_list = json_p
-            else:
-                price_list = []
-            logging.info("قیمت: OK %s", json.dumps(price_list[:1], ensure_ascii=False) if price_list else "{}")
+            price_list = []
+        logging.info("قیمت: OK %s", json.dumps(price_list[:1], ensure_ascii=False) if price_list else "{}")
+    return True, client_list, price_list, None
+
 
+def process_symbol_payload(client_list: List[Dict[str, Any]], price_list: List[Dict[str, Any]], ins_code: str, symbol: str,
+                           out_dir: str = ".", output_format: str = "csv", dataset_name: Optional[str] = None,
+                           defer_hdf: bool = False) -> Tuple[bool, str, Optional[pd.DataFrame]]:
+    """
+    مرحلهٔ CPU: ادغام و نوشتن خروجی یک نماد. در سطح ماژول تعریف شده تا در process pool اجرا شود.
+    خروجی: (ok, out_path_or_error, frame)؛ با defer_hdf در قالب hdf فایل نوشته نمی‌شود و
+    frame برای نوشتن در پروسهٔ اصلی برگردانده می‌شود (HDFStore نوشتن چندپروسه‌ای را پشتیبانی نمی‌کند).
+    """
+    try:
         df = merge_client_and_price(client_list, price_list, symbol)
 
+        if output_format == "hdf" and defer_hdf:
+            return True, "", df
+
+        if output_format in ("parquet", "hdf"):
+            out_path = write_consolidated(df, ins_code, out_dir, output_format, dataset_name)
+            logging.info("%s به‌روزرسانی شد: %s (%d ردیف)", output_format, out_path, len(df))
+            return True, out_path, None
+
         # نام فایل خروجی: فقط نماد (safe) + .csv
         safe_sym = safe_filename(symbol)
         filename = f"{safe_sym}.csv"
@@ -377,11 +693,370 @@ def fetch_and_save_for_symbol(ins_code: str, symbol: str, out_dir: str = ".", cl
         # ذخیره CSV با utf-8-sig برای سازگاری با Excel فارسی
         df.to_csv(out_path, index=False, encoding="utf-8-sig")
         logging.info("CSV ذخیره شد: %s", out_path)
-        return True, out_path
+        return True, out_path, None
+    except Exception as e:
+        logging.exception("خطا هنگام ادغام یا ذخیره:")
+        return False, str(e), None
+
+
+def fetch_and_save_for_symbol(ins_code: str, symbol: str, out_dir: str = ".", client_url_template: Optional[str] = None, price_url_template: Optional[str] = None,
+                              output_format: Optional[str] = None, dataset_name: Optional[str] = None,
+                              rate_controller: Optional[AdaptiveRateController] = None) -> Tuple[bool, str]:
+    """
+    دانلود داده‌های حقیقی/حقوقی و قیمت برای یک ins_code و ذخیرهٔ خروجی.
+    در قالب csv نام فایل خروجی: <safe_symbol>.csv   (مثال: قیراط.csv)
+    اگر فایل با همین نام وجود داشته باشد، بازنویسی می‌شود.
+    در قالب parquet/hdf داده به مجموعه‌دادهٔ یکپارچهٔ out_dir افزوده می‌شود (write_consolidated).
+    با rate_controller درخواست‌ها با نرخ تطبیقی و تلاش دوباره ارسال می‌شوند (fetch_json_paced).
+    """
+    try:
+        logging.info("شروع دانلود برای: %s نماد: %s", ins_code, symbol)
+        output_format = output_format or settings_store.get("output_format", "csv")
+        ok, client_list, price_list, err = download_symbol_payload(ins_code, client_url_template, price_url_template, rate_controller)
+        if not ok:
+            return False, err or ""
+        ok, msg, _ = process_symbol_payload(client_list, price_list, ins_code, symbol, out_dir, output_format, dataset_name)
+        return ok, msg
     except Exception as e:
         logging.exception("خطا هنگام دانلود یا ذخیره:")
         return False, str(e)
 
+# ------------------------
+# خط لولهٔ خروجی گروهی: دانلود موازی -> صف محدود -> ادغام/نوشتن در process pool
+# ------------------------
+_DOWNLOADER_DONE = object()
+
+
+class BulkExportPipeline:
+    """
+    خط لولهٔ دو مرحله‌ای برای خروجی گروهی:
+    - download_workers نخ دانلود (با کنترل نرخ مشترک) نتیجه را در صف محدود raw قرار می‌دهند
+    - نخ توزیع‌کننده ادغام و نوشتن را به ProcessPoolExecutor می‌سپارد؛ حداکثر max_in_flight کار
+      همزمان در جریان است، پس اگر پردازش عقب بیفتد صف raw پر می‌شود و دانلودها صبر می‌کنند
+    - خروجی hdf در همین پروسه و به ترتیب نوشته می‌شود
+    - process_workers=0 یعنی پردازش در همان نخ توزیع‌کننده (بدون process pool)
+    رویدادها به صورت (kind, item, data) در events قرار می‌گیرند:
+    started، done (data=(ok, msg))، log (data=متن) و finished (data=cancelled).
+    """
+    def __init__(self, items: List[Dict[str, str]], output_format: str, dataset_name: Optional[str] = None,
+                 client_url_template: Optional[str] = None, price_url_template: Optional[str] = None,
+                 rate_controller: Optional[AdaptiveRateController] = None, download_workers: int = 4,
+                 process_workers: Optional[int] = None, queue_size: int = 16):
+        self.items = list(items)
+        self.output_format = output_format
+        self.dataset_name = dataset_name
+        self.client_url_template = client_url_template
+        self.price_url_template = price_url_template
+        self.events: "queue.Queue[Tuple[str, Optional[Dict[str, str]], Any]]" = queue.Queue()
+        self.rate_controller = rate_controller
+        if rate_controller is not None and rate_controller.on_decision is None:
+            rate_controller.on_decision = lambda msg: self.events.put(("log", None, msg))
+        self.download_workers = max(1, int(download_workers))
+        if process_workers is None:
+            process_workers = max(1, (os.cpu_count() or 2) - 1)
+        self.process_workers = max(0, int(process_workers))
+        self.max_in_flight = max(1, self.process_workers) * 2
+        self._todo: "queue.Queue[Dict[str, str]]" = queue.Queue()
+        for it in self.items:
+            self._todo.put(it)
+        self._raw: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, int(queue_size)))
+        self._slots = threading.Semaphore(self.max_in_flight)
+        self._hdf_lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        if self.process_workers > 0:
+            try:
+                self._executor = ProcessPoolExecutor(max_workers=self.process_workers)
+            except Exception as e:
+                self._executor = None
+                self.events.put(("log", None, f"process pool در دسترس نیست ({e})؛ پردازش در همین پروسه انجام می‌شود."))
+        for i in range(self.download_workers):
+            t = threading.Thread(target=self._download_loop, name=f"export-download-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        t = threading.Thread(target=self._dispatch_loop, name="export-dispatch", daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def shutdown(self) -> None:
+        self._cancel.set()
+        if self._executor is not None:
+            try:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            except Exception:
+                pass
+
+    # ------------------------
+    # مرحلهٔ دانلود
+    # ------------------------
+    def _download_loop(self) -> None:
+        try:
+            while not self._cancel.is_set():
+                try:
+                    item = self._todo.get_nowait()
+                except queue.Empty:
+                    break
+                self.events.put(("started", item, None))
+                try:
+                    payload = (item,) + download_symbol_payload(item["insCode"], self.client_url_template,
+                                                                self.price_url_template, self.rate_controller)
+                except Exception as e:
+                    payload = (item, False, [], [], str(e))
+                # صف محدود: اگر پردازش عقب باشد این‌جا صبر می‌کنیم (با توجه به لغو)
+                while True:
+                    try:
+                        self._raw.put(payload, timeout=0.2)
+                        break
+                    except queue.Full:
+                        if self._cancel.is_set():
+                            # دانلود شده ولی پردازش نشده: در ژورنال ناتمام می‌ماند تا «ادامه» دوباره برش دارد
+                            self.events.put(("cancelled", item, None))
+                            return
+        finally:
+            self._raw.put(_DOWNLOADER_DONE)
+
+    # ------------------------
+    # مرحلهٔ پردازش
+    # ------------------------
+    def _dispatch_loop(self) -> None:
+        finished = 0
+        futures = []
+        defer_hdf = self._executor is not None
+        while finished < self.download_workers:
+            payload = self._raw.get()
+            if payload is _DOWNLOADER_DONE:
+                finished += 1
+                continue
+            item, ok, client_list, price_list, err = payload
+            if not ok:
+                self.events.put(("done", item, (False, err or "")))
+                continue
+            args = (client_list, price_list, item["insCode"], item["symbol"], item.get("out_dir", "."),
+                    self.output_format, self.dataset_name, defer_hdf)
+            if self._executor is None:
+                self._complete(item, process_symbol_payload(*args))
+                continue
+            self._slots.acquire()
+            try:
+                fut = self._executor.submit(process_symbol_payload, *args)
+            except Exception:
+                # pool بسته یا خراب شده: همین‌جا پردازش می‌شود؛ با defer_hdf نوشتن HDF مثل بقیه
+                # از _complete و زیر _hdf_lock انجام می‌شود
+                self._slots.release()
+                self._complete(item, process_symbol_payload(*args))
+                continue
+            fut.add_done_callback(lambda f, it=item: self._on_future_done(it, f))
+            futures.append(fut)
+        if futures:
+            wait(futures)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self.events.put(("finished", None, self._cancel.is_set()))
+
+    def _on_future_done(self, item: Dict[str, str], fut) -> None:
+        self._slots.release()
+        try:
+            result = fut.result()
+        except Exception as e:
+            result = (False, str(e), None)
+        self._complete(item, result)
+
+    def _complete(self, item: Dict[str, str], result: Tuple[bool, str, Optional[pd.DataFrame]]) -> None:
+        ok, msg, frame = result
+        if ok and frame is not None:
+            try:
+                with self._hdf_lock:
+                    msg = write_consolidated(frame, item["insCode"], item.get("out_dir", "."), self.output_format, self.dataset_name)
+            except Exception as e:
+                logging.exception("خطا هنگام نوشتن HDF:")
+                ok, msg = False, str(e)
+        self.events.put(("done", item, (ok, msg)))
+
+# ------------------------
+# ژورنال پایدار کار خروجی گروهی (ادامه پس از لغو/کرش)
+# ------------------------
+JOURNAL_FILE = "client_type_export_job.json"
+JOB_STATUSES = ("pending", "running", "done", "failed")
+
+
+def journal_path(out_dir: str) -> str:
+    return os.path.join(out_dir or ".", JOURNAL_FILE)
+
+
+class ExportJobJournal:
+    """
+    ژورنال یک کار خروجی گروهی در فایل JSON داخل پوشهٔ خروجی.
+    برای هر نماد (کلید insCode): status، attempts، out_path، error، started_at و finished_at.
+    تغییر وضعیت‌های نهایی (done/failed) دسته‌ای و حداکثر هر SAVE_INTERVAL ثانیه یک بار در یک نخ
+    پس‌زمینه ذخیره می‌شوند (نه در نخ UI به ازای هر نماد)؛ save() ذخیرهٔ فوری برای شروع/پایان/لغو است.
+    ذخیره با نوشتن فایل موقت و os.replace انجام می‌شود تا فایل هیچ‌گاه نیمه‌کاره نماند؛ نماد 'running'
+    هنگام ادامه دوباره در صف قرار می‌گیرد.
+    """
+    SAVE_INTERVAL = 1.0
+
+    def __init__(self, path: str, data: Dict[str, Any]):
+        self.path = path
+        self.data = data
+        self._lock = threading.Lock()     # تغییر data و برداشتن snapshot آن
+        self._io_lock = threading.Lock()  # ترتیب نوشتن‌ها: snapshot جدیدتر هیچ‌گاه با قدیمی‌تر بازنویسی نمی‌شود
+        self._timer: Optional[threading.Timer] = None
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    @classmethod
+    def create(cls, out_dir: str, items: List[Dict[str, str]], output_format: str,
+               dataset_name: Optional[str] = None) -> "ExportJobJournal":
+        now = cls._now()
+        data = {
+            "job_id": datetime.now().strftime("%Y%m%d-%H%M%S"),
+            "created_at": now,
+            "updated_at": now,
+            "out_dir": out_dir,
+            "output_format": output_format,
+            "dataset_name": dataset_name,
+            "order": [it["insCode"] for it in items],
+            "symbols": {
+                it["insCode"]: {"symbol": it["symbol"], "status": "pending", "attempts": 0,
+                                "out_path": None, "error": None, "started_at": None, "finished_at": None}
+                for it in items
+            },
+        }
+        journal = cls(journal_path(out_dir), data)
+        journal.save()
+        return journal
+
+    @classmethod
+    def load(cls, out_dir: str) -> Optional["ExportJobJournal"]:
+        path = journal_path(out_dir)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if not isinstance(data.get("symbols"), dict):
+                return None
+            return cls(path, data)
+        except Exception:
+            logging.exception("خطا هنگام خواندن ژورنال کار خروجی.")
+            return None
+
+    def save(self) -> None:
+        with self._io_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                self.data["updated_at"] = self._now()
+                # کپی سطحی رکوردها زیر قفل؛ سریال‌سازی و نوشتن بیرون از آن
+                snapshot = dict(self.data, symbols={k: dict(v) for k, v in self.data["symbols"].items()})
+            tmp = self.path + ".tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(snapshot, f, ensure_ascii=False)
+                os.replace(tmp, self.path)
+            except Exception:
+                logging.exception("خطا هنگام ذخیرهٔ ژورنال کار خروجی.")
+
+    def _request_save(self) -> None:
+        # اگر ذخیره‌ای در راه است همین تغییر را هم می‌برد
+        if self._timer is None:
+            self._timer = threading.Timer(self.SAVE_INTERVAL, self._timed_save)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _timed_save(self) -> None:
+        with self._lock:
+            self._timer = None
+        self.save()
+
+    # ------------------------
+    # تغییر وضعیت نمادها
+    # ------------------------
+    def mark_running(self, ins_code: str) -> None:
+        # فقط در حافظه؛ اگر برنامه وسط کار بسته شود، نماد هنوز ناتمام حساب می‌شود
+        with self._lock:
+            rec = self.data["symbols"].get(ins_code)
+            if rec is not None:
+                rec["status"] = "running"
+                rec["attempts"] = int(rec.get("attempts") or 0) + 1
+                rec["started_at"] = self._now()
+
+    def mark_pending(self, ins_code: str) -> None:
+        """نماد لغوشده پیش از پایان پردازش دوباره ناتمام حساب می‌شود."""
+        with self._lock:
+            rec = self.data["symbols"].get(ins_code)
+            if rec is not None and rec.get("status") == "running":
+                rec["status"] = "pending"
+                self._request_save()
+
+    def mark_done(self, ins_code: str, out_path: str) -> None:
+        self._finish(ins_code, "done", out_path=out_path, error=None)
+
+    def mark_failed(self, ins_code: str, error: str) -> None:
+        self._finish(ins_code, "failed", error=error)
+
+    def _finish(self, ins_code: str, status: str, **fields: Any) -> None:
+        with self._lock:
+            rec = self.data["symbols"].get(ins_code)
+            if rec is None:
+                return
+            rec["status"] = status
+            rec["finished_at"] = self._now()
+            rec.update(fields)
+            self._request_save()
+
+    # ------------------------
+    # پرس‌وجو
+    # ------------------------
+    def items(self, statuses: Tuple[str, ...]) -> List[Dict[str, str]]:
+        """آیتم‌های صف دانلود (به ترتیب اصلی) برای نمادهایی که وضعیتشان در statuses است."""
+        out = []
+        symbols = self.data["symbols"]
+        for ins in self.data.get("order") or list(symbols.keys()):
+            rec = symbols.get(ins)
+            if rec and rec.get("status") in statuses:
+                out.append({"symbol": rec.get("symbol", ""), "insCode": ins,
+                            "out_dir": self.data.get("out_dir", ".")})
+        return out
+
+    def unfinished_items(self) -> List[Dict[str, str]]:
+        return self.items(("pending", "running"))
+
+    def failed_items(self) -> List[Dict[str, str]]:
+        return self.items(("failed",))
+
+    def counts(self) -> Dict[str, int]:
+        out = {s: 0 for s in JOB_STATUSES}
+        for rec in self.data["symbols"].values():
+            out[rec.get("status", "pending")] = out.get(rec.get("status", "pending"), 0) + 1
+        return out
+
+    def summary(self) -> str:
+        c = self.counts()
+        return (f"کار {self.data.get('job_id')}: انجام‌شده {c['done']}، ناموفق {c['failed']}، "
+                f"ناتمام {c['pending'] + c['running']} از {len(self.data['symbols'])}")
+
+    def report_lines(self) -> List[str]:
+        lines = []
+        for ins in self.data.get("order") or list(self.data["symbols"].keys()):
+            rec = self.data["symbols"].get(ins) or {}
+            detail = rec.get("out_path") if rec.get("status") == "done" else (rec.get("error") or "")
+            lines.append(f"{rec.get('symbol', '')} ({ins}): {rec.get('status')} - تلاش {rec.get('attempts', 0)} - {detail}")
+        return lines
+
+
 # ------------------------
 # رابط کاربری Tkinter: ClientTypeExportWindow
 # ------------------------
@@ -395,6 +1070,7 @@ class ClientTypeExportWindow(tk.Toplevel):
     """
     def __init__(self, master=None, current_tree=None, selection_iid=None):
         super().__init__(master)
+        init_settings_file()
         self.title("خروجی حقیقی/حقوقی و قیمت (گروهی)")
         self.geometry("980x720")
         self.resizable(True, True)
@@ -410,13 +1086,19 @@ class ClientTypeExportWindow(tk.Toplevel):
         self._processed_count = 0
         self._cancel_requested = False
         self._after_job = None
+        self._journal: Optional[ExportJobJournal] = None
+        self._job_output_format: Optional[str] = None
+        self._rate: Optional[AdaptiveRateController] = None
+        self._pipeline: Optional[BulkExportPipeline] = None
 
         self._build_ui()
         self._load_settings_into_ui()
+        self._announce_unfinished_job()
 
         # بارگذاری اولیه لیست نمادها بدون نیاز به دکمه
         try:
             self._populate_symbol_list_from_tree()
+            self._announce_selected_symbol()
         except Exception:
             logging.exception("خطا هنگام بارگذاری اولیه لیست نمادها.")
 
@@ -460,15 +1142,10 @@ class ClientTypeExportWindow(tk.Toplevel):
 
         ttk.Label(left_panel, text="نمادهای فیلترشده (انتخاب برای دانلود):", font=("Tahoma", 10, "bold")).pack(anchor="w", pady=(0,4))
 
-        # کانتینر اسکرول‌شونده برای چک‌باکس‌ها
-        self.symbol_canvas = tk.Canvas(left_panel, highlightthickness=0)
-        self.symbol_vscroll = ttk.Scrollbar(left_panel, orient="vertical", command=self.symbol_canvas.yview)
-        self.symbol_canvas.configure(yscrollcommand=self.symbol_vscroll.set)
-        self.symbol_canvas.pack(side="left", fill="both", expand=True)
-        self.symbol_vscroll.pack(side="right", fill="y")
-        self.symbol_inner = ttk.Frame(self.symbol_canvas)
-        self.symbol_canvas.create_window((0,0), window=self.symbol_inner, anchor="nw")
-        self.symbol_inner.bind("<Configure>", lambda e: self.symbol_canvas.configure(scrollregion=self.symbol_canvas.bbox("all")))
+        # لیست مجازی چک‌باکس‌ها: فقط ردیف‌های روی صفحه رسم می‌شوند؛ وضعیت انتخاب در یک آرایه
+        self.symbol_list = VirtualCheckList(left_panel, height=400)
+        self.symbol_list.pack(side="top", fill="both", expand=True)
+        self._ins_by_symbol: Dict[str, str] = {}
 
         # دکمه‌های انتخاب همه / هیچ
         btns = ttk.Frame(left_panel)
@@ -497,6 +1174,12 @@ class ClientTypeExportWindow(tk.Toplevel):
         _bind_copy_paste_text(self.client_url_text)
         _bind_copy_paste_text(self.price_url_text)
 
+        ttk.Label(right_panel, text="قالب خروجی:").pack(anchor="w", pady=(6,0))
+        self.format_var = tk.StringVar()
+        self.format_combo = ttk.Combobox(right_panel, textvariable=self.format_var, state="readonly",
+                                         values=list(OUTPUT_FORMATS.values()))
+        self.format_combo.pack(fill="x", pady=4)
+
         ttk.Separator(right_panel, orient="horizontal").pack(fill="x", pady=8)
         # دکمه دانلود گروهی
         self.download_btn = ttk.Button(right_panel, text="دانلود انتخاب‌شده", command=self._on_download_selected)
@@ -506,6 +1189,13 @@ class ClientTypeExportWindow(tk.Toplevel):
         self.cancel_btn.pack(fill="x", pady=(0,6))
         self.cancel_btn.config(state="disabled")
 
+        # ادامهٔ کار ناتمام / تلاش دوباره فقط برای ناموفق‌ها (از روی ژورنال پوشهٔ خروجی)
+        self.resume_btn = ttk.Button(right_panel, text="ادامهٔ کار ناتمام", command=self._on_resume_job)
+        self.resume_btn.pack(fill="x", pady=(0,6))
+        self.retry_btn = ttk.Button(right_panel, text="تلاش دوباره برای ناموفق‌ها", command=self._on_retry_failed)
+        self.retry_btn.pack(fill="x", pady=(0,6))
+        ttk.Button(right_panel, text="گزارش کار", command=self._on_show_job_report).pack(fill="x", pady=(0,6))
+
         # وضعیت و نوار پیشرفت
         ttk.Label(right_panel, text="وضعیت:").pack(anchor="w", pady=(6,0))
         self.status_label = ttk.Label(right_panel, text="آماده", foreground="green")
@@ -531,9 +1221,8 @@ class ClientTypeExportWindow(tk.Toplevel):
     # مدیریت لیست نمادها (چک‌باکس‌ها)
     # ------------------------
     def _clear_symbol_widgets(self):
-        for w in self.symbol_inner.winfo_children():
-            w.destroy()
-        self._symbol_vars: List[Tuple[str, tk.BooleanVar, str]] = []  # (symbol, var, insCode)
+        self._ins_by_symbol = {}
+        self.symbol_list.set_items([])
 
     def _populate_symbol_list_from_tree(self):
         """
@@ -585,62 +1274,80 @@ class ClientTypeExportWindow(tk.Toplevel):
                 if 'ins' in lc or 'کد' in lc:
                     ins_col = c; break
 
-        # استخراج و مرتب‌سازی یکتا
-        seen = {}
-        for _, row in df.iterrows():
-            sym = str(row.get(symbol_col, '')).strip()
-            if not sym:
-                continue
-            ins = str(row.get(ins_col, '')).strip() if ins_col else ''
-            if sym not in seen:
-                seen[sym] = ins
-        sorted_syms = sorted(seen.items(), key=lambda x: x[0])
+        # استخراج و مرتب‌سازی یکتا (برداری) و نمایش در لیست مجازی (پیش‌فرض تیک‌خورده)
+        self._ins_by_symbol = build_symbol_inscode_map(df, symbol_col, ins_col)
+        syms = list(self._ins_by_symbol.keys())
+        labels = [f"{sym}  [{ins}]" if ins else sym for sym, ins in self._ins_by_symbol.items()]
+        self.symbol_list.set_items(syms, labels, checked=True)
 
-        for sym, ins in sorted_syms:
-            var = tk.BooleanVar(value=True)
-            frame = ttk.Frame(self.symbol_inner)
-            frame.pack(fill="x", pady=1, padx=2)
-            cb = ttk.Checkbutton(frame, text=f"{sym}  [{ins}]" if ins else sym, variable=var)
-            cb.pack(side="left", anchor="w")
-            self._symbol_vars.append((sym, var, ins))
+        self._log(f"{len(syms)} نماد از جدول بارگذاری شد.")
 
-        self._log(f"{len(self._symbol_vars)} نماد از جدول بارگذاری شد.")
+    def _announce_selected_symbol(self):
+        """نماد ردیف انتخاب‌شده در جدول اصلی (از طریق iid -> ردیف base_df) در لیست پررنگ و به آن پیمایش می‌شود."""
+        tree = self.current_tree
+        if not self.selection_iid or tree is None or not hasattr(tree, 'value_at'):
+            return
+        sym = str(tree.value_at(self.selection_iid, 'نماد')).strip()
+        if sym and self.symbol_list.see(sym):
+            self._log(f"نماد انتخاب‌شده در جدول: {sym} [{self._ins_by_symbol.get(sym, '')}]")
 
     def _select_all_symbols(self):
-        for _, var, _ in getattr(self, "_symbol_vars", []):
-            var.set(True)
+        self.symbol_list.set_all_checked(True)
 
     def _deselect_all_symbols(self):
-        for _, var, _ in getattr(self, "_symbol_vars", []):
-            var.set(False)
+        self.symbol_list.set_all_checked(False)
+
+    def _fallback_inscode_map(self) -> Dict[str, str]:
+        df = getattr(self.current_tree, "base_df", None) if self.current_tree else None
+        if df is None or df.empty:
+            return {}
+        out: Dict[str, str] = {}
+        for sym_col in ('نماد', 'symbol'):
+            if sym_col not in df.columns:
+                continue
+            for c in ['insCode', 'کد_داخلی', 'کد داخلی', 'کد']:
+                if c in df.columns:
+                    for sym, ins in build_symbol_inscode_map(df, sym_col, c).items():
+                        if ins and not out.get(sym):
+                            out[sym] = ins
+        return out
 
     # ------------------------
     # دانلود گروهی (صف و پردازش ترتیبی با after)
     # ------------------------
     def _on_download_selected(self):
         # ساخت صف دانلود از نمادهای تیک‌خورده
-        selected = [(sym, ins) for (sym, var, ins) in getattr(self, "_symbol_vars", []) if var.get()]
+        selected = [(sym, self._ins_by_symbol.get(sym, "")) for sym in self.symbol_list.checked_keys()]
         if not selected:
             messagebox.showwarning("هیچ نمادی انتخاب نشده", "لطفاً حداقل یک نماد را برای دانلود انتخاب کنید.")
             return
         out_dir = self.out_entry.get().strip() or "."
+        # کار ناتمام همین پوشه بدون پرسیدن بازنویسی نمی‌شود
+        existing = ExportJobJournal.load(out_dir)
+        if existing is not None and existing.unfinished_items():
+            answer = messagebox.askyesnocancel(
+                "کار ناتمام",
+                f"در این پوشه کار ناتمامی ثبت شده است:\n{existing.summary()}\n\n"
+                "بله: ادامهٔ همان کار\nخیر: شروع کار جدید و جایگزینی ژورنال قبلی")
+            if answer is None:
+                return
+            if answer:
+                self._resume_from_journal(retry_failed=False)
+                return
         settings_store["last_out_dir"] = out_dir
+        settings_store["output_format"] = self._selected_output_format()
         save_settings(settings_store)
 
         # ساخت صف: هر آیتم دیکشنری {insCode, symbol}
         self.download_queue = []
+        fallback = None
         for sym, ins in selected:
             ins_code = ins
-            if not ins_code and self.current_tree and getattr(self.current_tree, "df", None) is not None:
-                df = self.current_tree.df
-                # تلاش برای یافتن insCode متناظر با نماد
-                mask = df.apply(lambda r: str(r.get('نماد', '')).strip() == sym or str(r.get('symbol', '')).strip() == sym, axis=1)
-                if mask.any():
-                    row = df[mask].iloc[0]
-                    for c in ['insCode', 'کد_داخلی', 'کد داخلی', 'کد']:
-                        if c in row and row[c]:
-                            ins_code = str(row[c])
-                            break
+            if not ins_code:
+                # نگاشت جایگزین از کل دادهٔ جدول با ستون‌های کد شناخته‌شده، فقط یک بار ساخته می‌شود
+                if fallback is None:
+                    fallback = self._fallback_inscode_map()
+                ins_code = fallback.get(sym, "")
             if not ins_code:
                 self._log(f"خطا: کد داخلی (insCode) برای نماد {sym} پیدا نشد؛ این نماد نادیده گرفته می‌شود.")
                 continue
@@ -650,7 +1357,57 @@ class ClientTypeExportWindow(tk.Toplevel):
             messagebox.showwarning("هیچ نمادی برای دانلود", "هیچ نمادی با insCode معتبر برای دانلود پیدا نشد.")
             return
 
-        # آماده‌سازی وضعیت و شروع پردازش صف
+        self._journal = ExportJobJournal.create(out_dir, self.download_queue, settings_store["output_format"],
+                                                settings_store.get("dataset_name"))
+        self._job_output_format = settings_store["output_format"]
+        self._start_queue()
+
+    # ------------------------
+    # ادامهٔ کار از روی ژورنال
+    # ------------------------
+    def _announce_unfinished_job(self):
+        journal = ExportJobJournal.load(settings_store.get("last_out_dir", "."))
+        if journal is None:
+            return
+        c = journal.counts()
+        if c["pending"] + c["running"] or c["failed"]:
+            self._log(f"کار ناتمام در پوشهٔ خروجی پیدا شد؛ {journal.summary()}")
+
+    def _resume_from_journal(self, retry_failed: bool):
+        if self._is_downloading:
+            return
+        out_dir = self.out_entry.get().strip() or "."
+        journal = ExportJobJournal.load(out_dir)
+        if journal is None:
+            messagebox.showinfo("ژورنال", "هیچ کار ثبت‌شده‌ای در این پوشه پیدا نشد.")
+            return
+        items = journal.failed_items() if retry_failed else journal.unfinished_items()
+        if not items:
+            messagebox.showinfo("ژورنال", f"چیزی برای {'تلاش دوباره' if retry_failed else 'ادامه'} نیست.\n{journal.summary()}")
+            return
+        self._journal = journal
+        self._job_output_format = journal.data.get("output_format") or self._selected_output_format()
+        self.download_queue = items
+        self._log(f"{'تلاش دوباره برای' if retry_failed else 'ادامهٔ'} {len(items)} نماد از کار {journal.data.get('job_id')}.")
+        self._start_queue()
+
+    def _on_resume_job(self):
+        self._resume_from_journal(retry_failed=False)
+
+    def _on_retry_failed(self):
+        self._resume_from_journal(retry_failed=True)
+
+    def _on_show_job_report(self):
+        journal = self._journal or ExportJobJournal.load(self.out_entry.get().strip() or ".")
+        if journal is None:
+            self._log("هیچ ژورنال کاری برای گزارش وجود ندارد.")
+            return
+        for line in journal.report_lines():
+            self._log(line)
+        self._log(journal.summary())
+
+    def _start_queue(self):
+        # آماده‌سازی وضعیت و شروع خط لولهٔ دانلود/پردازش
         self._is_downloading = True
         self._cancel_requested = False
         self._processed_count = 0
@@ -661,53 +1418,76 @@ class ClientTypeExportWindow(tk.Toplevel):
         self.status_label.config(text=f"در حال دانلود 0/{total}", foreground="orange")
         self.download_btn.config(state="disabled")
         self.cancel_btn.config(state="normal")
-        self._log(f"شروع دانلود گروهی برای {total} نماد.")
-        # شروع اولین آیتم با after
-        self._process_next_in_queue()
-
-    def _process_next_in_queue(self):
-        if self._cancel_requested:
-            self._finish_downloads(cancelled=True)
+        self._rate = AdaptiveRateController.from_settings()
+        self._pipeline = BulkExportPipeline(
+            self.download_queue,
+            output_format=self._job_output_format or settings_store.get("output_format", "csv"),
+            dataset_name=(self._journal.data.get("dataset_name") if self._journal else None),
+            client_url_template=self.client_url_text.get("1.0", "end").strip() or None,
+            price_url_template=self.price_url_text.get("1.0", "end").strip() or None,
+            rate_controller=self._rate,
+            download_workers=settings_store.get("download_workers", DEFAULTS["download_workers"]),
+            process_workers=settings_store.get("process_workers", DEFAULTS["process_workers"]))
+        self._log(f"شروع دانلود گروهی برای {total} نماد "
+                  f"({self._pipeline.download_workers} نخ دانلود، {self._pipeline.process_workers} پروسهٔ پردازش).")
+        self._pipeline.start()
+        self._after_job = self.after(100, self._poll_pipeline)
+
+    def _poll_pipeline(self):
+        """رویدادهای خط لوله را در نخ UI می‌خواند (به‌روزرسانی ژورنال، لاگ و نوار پیشرفت)."""
+        self._after_job = None
+        pipeline = self._pipeline
+        if pipeline is None:
             return
-        if not self.download_queue:
-            self._finish_downloads(cancelled=False)
+        finished = None
+        handled = 0
+        while handled < 500:
+            try:
+                kind, item, data = pipeline.events.get_nowait()
+            except queue.Empty:
+                break
+            handled += 1
+            if kind == "started":
+                self._log(f"در حال دانلود برای {item['symbol']} ({item['insCode']}) ...")
+                if self._journal is not None:
+                    self._journal.mark_running(item["insCode"])
+            elif kind == "done":
+                self._on_item_done(item, *data)
+            elif kind == "cancelled":
+                self._log(f"لغو شد: {item['symbol']} (در ژورنال ناتمام می‌ماند)")
+                if self._journal is not None:
+                    self._journal.mark_pending(item["insCode"])
+            elif kind == "log":
+                self._log(data)
+            elif kind == "finished":
+                finished = data
+        if finished is not None:
+            self._pipeline = None
+            self._finish_downloads(cancelled=bool(finished))
             return
+        self._after_job = self.after(100, self._poll_pipeline)
 
-        item = self.download_queue.pop(0)
-        sym = item["symbol"]
-        ins = item["insCode"]
-        out_dir = item["out_dir"]
-
-        # لاگ شروع
-        self._log(f"در حال دانلود برای {sym} ({ins}) ...")
-        start = datetime.now()
-
-        # فراخوانی تابع دانلود/ذخیره
-        try:
-            ok, msg = fetch_and_save_for_symbol(ins, sym, out_dir=out_dir,
-                                               client_url_template=self.client_url_text.get("1.0", "end").strip() or None,
-                                               price_url_template=self.price_url_text.get("1.0", "end").strip() or None)
-            elapsed = (datetime.now() - start).total_seconds()
-            self._processed_count += 1
-            total_done = self._processed_count
-            # به‌روزرسانی نوار پیشرفت و وضعیت
-            self.progress["value"] = total_done
-            remaining = int(self.progress["maximum"] - total_done)
-            avg = (datetime.now() - self._download_start_time).total_seconds() / total_done if total_done > 0 else 0
-            eta_seconds = int(avg * remaining)
-            eta_text = self._format_eta(eta_seconds)
-            self.status_label.config(text=f"در حال دانلود {total_done}/{int(self.progress['maximum'])}", foreground="orange")
-            self.eta_label.config(text=f"باقی: {remaining}؛ حدوداً {eta_text}")
+    def _on_item_done(self, item: Dict[str, str], ok: bool, msg: str):
+        sym, ins = item["symbol"], item["insCode"]
+        if self._journal is not None:
             if ok:
-                self._log(f"ذخیره شد: {msg} (زمان: {elapsed:.1f}s)")
+                self._journal.mark_done(ins, msg)
             else:
-                self._log(f"خطا برای {sym}: {msg}")
-        except Exception as e:
-            logging.exception("خطا هنگام دانلود گروهی:")
-            self._log(f"خطای داخلی برای {sym}: {e}")
-
-        # زمان‌بندی پردازش آیتم بعدی با یک وقفهٔ کوتاه تا UI فرصت به‌روزرسانی داشته باشد
-        self._after_job = self.after(200, self._process_next_in_queue)
+                self._journal.mark_failed(ins, msg)
+        self._processed_count += 1
+        total_done = self._processed_count
+        # به‌روزرسانی نوار پیشرفت و وضعیت
+        self.progress["value"] = total_done
+        remaining = int(self.progress["maximum"] - total_done)
+        avg = (datetime.now() - self._download_start_time).total_seconds() / total_done if total_done > 0 else 0
+        eta_seconds = int(avg * remaining)
+        eta_text = self._format_eta(eta_seconds)
+        self.status_label.config(text=f"در حال دانلود {total_done}/{int(self.progress['maximum'])}", foreground="orange")
+        self.eta_label.config(text=f"باقی: {remaining}؛ حدوداً {eta_text}")
+        if ok:
+            self._log(f"ذخیره شد: {sym} -> {msg}")
+        else:
+            self._log(f"خطا برای {sym}: {msg}")
 
     def _format_eta(self, seconds: int) -> str:
         if seconds <= 0:
@@ -730,6 +1510,11 @@ class ClientTypeExportWindow(tk.Toplevel):
             self._log(f"دانلود گروهی به پایان رسید. فایل‌های ساخته‌شده: {total_done}.")
             self.status_label.config(text=f"پایان ({total_done}/{total})", foreground="green")
             self.eta_label.config(text="")
+        if self._journal is not None:
+            self._journal.save()
+            self._log(self._journal.summary())
+        if self._rate is not None:
+            self._log(f"کنترل نرخ: {self._rate.snapshot()}")
         self._is_downloading = False
         self.download_btn.config(state="normal")
         self.cancel_btn.config(state="disabled")
@@ -746,6 +1531,8 @@ class ClientTypeExportWindow(tk.Toplevel):
         if not self._is_downloading:
             return
         self._cancel_requested = True
+        if self._pipeline is not None:
+            self._pipeline.cancel()
         self._log("درخواست لغو دریافت شد...")
 
     # ------------------------
@@ -780,14 +1567,25 @@ class ClientTypeExportWindow(tk.Toplevel):
 
             self.out_entry.delete(0, tk.END)
             self.out_entry.insert(0, settings_store.get("last_out_dir", DEFAULTS["last_out_dir"]))
+
+            fmt = settings_store.get("output_format", DEFAULTS["output_format"])
+            self.format_var.set(OUTPUT_FORMATS.get(fmt, OUTPUT_FORMATS["csv"]))
         except Exception:
             logging.exception("خطا هنگام بارگذاری تنظیمات در UI.")
 
+    def _selected_output_format(self) -> str:
+        label = self.format_var.get()
+        for key, text in OUTPUT_FORMATS.items():
+            if text == label:
+                return key
+        return "csv"
+
     def _on_save_settings(self):
         try:
             settings_store["client_url_template"] = self.client_url_text.get("1.0", "end").strip()
             settings_store["price_url_template"] = self.price_url_text.get("1.0", "end").strip()
             settings_store["last_out_dir"] = self.out_entry.get().strip() or "."
+            settings_store["output_format"] = self._selected_output_format()
             save_settings(settings_store)
             self._log("تنظیمات ذخیره شد.")
             messagebox.showinfo("ذخیره تنظیمات", "تنظیمات با موفقیت ذخیره شد.")
@@ -807,6 +1605,11 @@ class ClientTypeExportWindow(tk.Toplevel):
             if not messagebox.askyesno("در حال دانلود", "دانلود در حال انجام است. آیا مطمئنید می‌خواهید پنجره را ببندید و دانلود را لغو کنید؟"):
                 return
             self._request_cancel()
+        if self._pipeline is not None:
+            self._pipeline.shutdown()
+            self._pipeline = None
+            if self._journal is not None:
+                self._journal.save()
         try:
             if self._after_job:
                 try:
@@ -824,7 +1627,10 @@ class ClientTypeExportWindow(tk.Toplevel):
 # ------------------------
 # صادر شده‌ها
 # ------------------------
-__all__ = ["ClientTypeExportWindow", "fetch_and_save_for_symbol", "merge_client_and_price"]
+__all__ = ["ClientTypeExportWindow", "fetch_and_save_for_symbol", "merge_client_and_price",
+           "OUTPUT_FORMATS", "write_consolidated", "load_consolidated", "build_symbol_inscode_map",
+           "ExportJobJournal", "AdaptiveRateController", "fetch_json_observed",
+           "BulkExportPipeline", "download_symbol_payload", "process_symbol_payload"]
 
 # اگر به صورت مستقیم اجرا شد، پنجرهٔ تست را باز کن
 if __name__ == "__main__":
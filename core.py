@@ -6,15 +6,37 @@
 
 import os
 import re
+import sys
+import ast
 import json
+import math
 import time
+import queue
+import threading
+import itertools
+import pstats
+import cProfile
+import functools
 import traceback
+import tracemalloc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque, OrderedDict
+from contextlib import contextmanager
 import requests
+import numpy as np
 import pandas as pd
 import tkinter as tk
 from tkinter import ttk, Menu, messagebox
 from tkinter import font as tkfont
 import webbrowser
+from market_frame import (
+    normalize_text, CATEGORICAL_COLUMNS, map_unique, encode_categorical_columns, numeric_values,
+    INDUSTRY_MAP, FIELD_MAPPING, ORDER_BOOK_LEVELS, ORDER_BOOK_FIELDS, order_book_from_frame,
+    order_book_metrics, prepare_market_frame, _parse_section_rows, _merge_section3_rows,
+    _split_market_rows, _prepare_market_shard, _concat_shards, _warm_worker,
+)
 
 
 # ------------------------
@@ -27,6 +49,9 @@ SETTINGS_FILE = "tsetmc_settings.json"
 # ------------------------
 # بارگذاری و ذخیره تنظیمات (مقاوم در برابر فایل خراب)
 # ------------------------
+# پروسه‌های فرزند (pool پارس، spawn در ویندوز) این ماژول را دوباره import می‌کنند؛ آن‌ها فقط می‌خوانند
+_IN_WORKER = multiprocessing.parent_process() is not None
+
 def load_settings():
     """بارگذاری امن تنظیمات JSON. در صورت خراب بودن فایل، آن را جابجا می‌کند و دیکشنری خالی برمی‌گرداند."""
     if os.path.exists(SETTINGS_FILE):
@@ -34,6 +59,8 @@ def load_settings():
             with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
                 return json.load(f)
         except json.JSONDecodeError:
+            if _IN_WORKER:
+                return {}
             try:
                 bak = SETTINGS_FILE + ".corrupt"
                 os.replace(SETTINGS_FILE, bak)
@@ -45,79 +72,24 @@ def load_settings():
     return {}
 
 def save_settings(d):
+    # نوشتن در فایل موقت و os.replace تا خواننده‌ای هم‌زمان هرگز فایل نیمه‌نوشته نبیند
+    tmp = f"{SETTINGS_FILE}.{os.getpid()}.tmp"
     try:
-        with open(SETTINGS_FILE, 'w', encoding='utf-8') as f:
+        with open(tmp, 'w', encoding='utf-8') as f:
             json.dump(d, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, SETTINGS_FILE)
     except Exception:
         # بی‌صدا شکست می‌خورد تا UI قفل نشود
-        pass
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
 
 settings_store = load_settings()
 
 # ------------------------
-# نرمال‌سازی متن (حروف عربی -> فارسی، ارقام فارسی -> لاتین، حذف نیم‌فاصله)
+# برچسب بازار
 # ------------------------
-ARABIC_TO_PERSIAN = {
-    'ي': 'ی', 'ى': 'ی', 'ك': 'ک', 'ﻻ': 'لا', 'ة': 'ه',
-    'ؤ': 'و', 'إ': 'ا', 'أ': 'ا', 'آ': 'ا',
-    'ئ': 'ی', '\u200c': '', '\u0640': ''
-}
-PERSIAN_DIGITS = str.maketrans('۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩', '01234567890123456789')
-_ar_re = re.compile('|'.join(map(re.escape, ARABIC_TO_PERSIAN.keys())))
-
-def normalize_text(s):
-    """نرمال‌سازی متن فارسی/عربی و ارقام؛ خروجی رشتهٔ تمیز شده."""
-    if s is None:
-        return ''
-    s = str(s)
-    s = _ar_re.sub(lambda m: ARABIC_TO_PERSIAN[m.group(0)], s)
-    s = s.translate(PERSIAN_DIGITS)
-    s = s.replace('\u200c', ' ').strip()
-    s = re.sub(r'\s+', ' ', s)
-    return s
-
-# ------------------------
-# نگاشت صنایع و برچسب بازار
-# ------------------------
-INDUSTRY_MAP_LIST = [
-    ['01', 'زراعت و خدمات وابسته'], ['02', 'جنگلداري و ماهيگيري'],
-    ['10', 'استخراج زغال سنگ'], ['11', 'استخراج نفت گاز و خدمات جنبي جز اکتشاف'],
-    ['13', 'استخراج کانه هاي فلزي'], ['14', 'استخراج ساير معادن'],
-    ['15', 'حذف شده- فرآورده‌هاي غذايي و آشاميدني'], ['17', 'منسوجات'],
-    ['19', 'دباغي، پرداخت چرم و ساخت انواع پاپوش'], ['20', 'محصولات چوبي'],
-    ['21', 'محصولات كاغذي'], ['22', 'انتشار، چاپ و تکثير'],
-    ['23', 'فراورده هاي نفتي، كک و سوخت هسته اي'], ['24', 'حذف شده-مواد و محصولات شيميايي'],
-    ['25', 'لاستيك و پلاستيك'], ['26', 'توليد محصولات كامپيوتري الكترونيكي ونوري'],
-    ['27', 'فلزات اساسي'], ['28', 'ساخت محصولات فلزي'],
-    ['29', 'ماشين آلات و تجهيزات'], ['31', 'ماشين آلات و دستگاه‌هاي برقي'],
-    ['32', 'ساخت دستگاه‌ها و وسايل ارتباطي'], ['33', 'ابزارپزشکي، اپتيکي و اندازه‌گيري'],
-    ['34', 'خودرو و ساخت قطعات'], ['35', 'ساير تجهيزات حمل و نقل'],
-    ['36', 'مبلمان و مصنوعات ديگر'], ['38', 'قند و شكر'],
-    ['39', 'شرکتهاي چند رشته اي صنعتي'], ['40', 'عرضه برق، گاز، بخاروآب گرم'],
-    ['41', 'جمع آوري، تصفيه و توزيع آب'], ['42', 'محصولات غذايي و آشاميدني به جز قند و شكر'],
-    ['43', 'مواد و محصولات دارويي'], ['44', 'محصولات شيميايي'],
-    ['45', 'پيمانكاري صنعتي'], ['46', 'تجارت عمده فروشي به جز وسايل نقليه موتور'],
-    ['47', 'خرده فروشي،باستثناي وسايل نقليه موتوري'], ['49', 'كاشي و سراميك'],
-    ['50', 'تجارت عمده وخرده فروشي وسائط نقليه موتور'], ['51', 'حمل و نقل هوايي'],
-    ['52', 'انبارداري و حمايت از فعاليتهاي حمل و نقل'], ['53', 'سيمان، آهك و گچ'],
-    ['54', 'ساير محصولات كاني غيرفلزي'], ['55', 'هتل و رستوران'],
-    ['56', 'سرمايه گذاريها'], ['57', 'بانكها و موسسات اعتباري'],
-    ['58', 'ساير واسطه گريهاي مالي'], ['59', 'اوراق حق تقدم استفاده از تسهيلات مسكن'],
-    ['60', 'حمل ونقل، انبارداري و ارتباطات'], ['61', 'حمل و نقل آبی'],
-    ['63', 'فعاليت های پشتیبانی و کمکی حمل و نقل'], ['64', 'مخابرات'],
-    ['65', 'واسطه‌گری‌های مالی و پولی'], ['66', 'بیمه وصندوق بازنشستگی به جز تامین اجتماعی'],
-    ['67', 'فعالیت‌هاي کمکی به نهادهای مالی واسط'], ['68', 'صندوق سرمایه گذاری قابل معامله'],
-    ['69', 'اوراق تامین مالی'], ['70', 'انبوه سازی، املاک و مستغلات'],
-    ['71', 'فعالیت مهندسی، تجزیه، تحلیل و آزمایش فنی'], ['72', 'رایانه و فعالیت‌های وابسته به آن'],
-    ['73', 'اطلاعات و ارتباطات'], ['74', 'خدمات فنی و مهندسی'],
-    ['76', 'اوراق بهادار مبتنی بر دارایی فکری'], ['77', 'فعالبت های اجاره و لیزینگ'],
-    ['80', 'تبلیغات و بازارپژوهی'], ['82', 'فعالیت پشتیبانی اجرائی اداری و حمایت کسب'],
-    ['84', 'سلامت انسان و مددکاری اجتماعی'], ['90', 'فعالیت های هنری، سرگرمی و خلاقانه'],
-    ['93', 'فعالیت‌های فرهنگی و ورزشی'], ['98', 'گروه اوراق غیر فعال'],
-    ['X1', 'شاخص']
-]
-INDUSTRY_MAP = {k: v for k, v in INDUSTRY_MAP_LIST}
-
 MARKET_LABELS = {
     '300': 'بورس', '303': 'فرابورس', '309': 'پایه',
     '301': 'مشارکت', '304': 'آتی', '305': 'صندوق', '306': 'مرابحه و اجاره',
@@ -183,83 +155,366 @@ else:
     COLUMN_NAME_MAP = merged
     settings_store['column_name_map'] = COLUMN_NAME_MAP
 
+# ------------------------
+# زمان‌سنجی مراحل خط لوله (دریافت، پارس، ادغام، آماده‌سازی، عرض ستون، پرکردن جدول)
+# ------------------------
+class PipelineProfiler:
+    """
+    ثبت سبک زمان، تعداد ردیف و حجم بایت هر مرحله.
+    مراحلی که بین begin_run و end_run اجرا شوند یک «اجرا» (مثلاً یک refresh) را می‌سازند؛
+    بقیه (مثل اعمال فیلتر) در تاریخچهٔ تعاملی ثبت می‌شوند. هر دو تاریخچه چرخشی و محدودند.
+    """
+    def __init__(self, history_size=50, interactive_size=200):
+        self._lock = threading.Lock()
+        self.runs = deque(maxlen=history_size)
+        self.interactive = deque(maxlen=interactive_size)
+        self.current = None
+        self._run_t0 = None
+
+    def begin_run(self, label='refresh'):
+        with self._lock:
+            self.current = {'label': label, 'started': time.strftime("%Y-%m-%d %H:%M:%S"), 'total_seconds': None, 'stages': []}
+            self._run_t0 = time.perf_counter()
+
+    def end_run(self):
+        with self._lock:
+            run = self.current
+            if run is None:
+                return None
+            run['total_seconds'] = round(time.perf_counter() - self._run_t0, 4)
+            self.runs.append(run)
+            self.current = None
+            return run
+
+    @contextmanager
+    def stage(self, name, rows=None, nbytes=None):
+        """context manager برای یک مرحله؛ rows/bytes را می‌توان داخل بلوک روی رکورد برگشتی تنظیم کرد."""
+        rec = {'stage': name, 'seconds': None, 'rows': rows, 'bytes': nbytes}
+        t0 = time.perf_counter()
+        try:
+            yield rec
+        finally:
+            rec['seconds'] = round(time.perf_counter() - t0, 4)
+            with self._lock:
+                if self.current is not None:
+                    self.current['stages'].append(rec)
+                else:
+                    rec['at'] = time.strftime("%Y-%m-%d %H:%M:%S")
+                    self.interactive.append(rec)
+
+    def timed(self, name, rows=None):
+        """دکوراتور معادل stage؛ rows تابعی (self) -> int است که پس از اجرا تعداد ردیف را می‌دهد."""
+        def deco(fn):
+            @functools.wraps(fn)
+            def wrapper(obj, *args, **kwargs):
+                with self.stage(name) as rec:
+                    result = fn(obj, *args, **kwargs)
+                    if rows is not None:
+                        try:
+                            rec['rows'] = int(rows(obj))
+                        except Exception:
+                            pass
+                    return result
+            return wrapper
+        return deco
+
+    def last_run(self):
+        with self._lock:
+            return self.runs[-1] if self.runs else None
+
+    def summary(self):
+        """آمار هر مرحله روی کل تاریخچه: تعداد، آخرین، میانگین و بیشینهٔ زمان."""
+        with self._lock:
+            recs = [s for r in self.runs for s in r['stages']] + list(self.interactive)
+        out = {}
+        for rec in recs:
+            st = out.setdefault(rec['stage'], {'count': 0, 'last': 0.0, 'mean': 0.0, 'max': 0.0, 'total': 0.0})
+            sec = rec.get('seconds') or 0.0
+            st['count'] += 1
+            st['last'] = sec
+            st['total'] += sec
+            st['max'] = max(st['max'], sec)
+        for st in out.values():
+            st['mean'] = round(st['total'] / st['count'], 4) if st['count'] else 0.0
+            st['total'] = round(st['total'], 4)
+        return out
+
+    def to_log(self):
+        with self._lock:
+            runs = list(self.runs)
+            interactive = list(self.interactive)
+        return {'last_run': runs[-1] if runs else None, 'runs': runs, 'interactive': interactive, 'stage_summary': self.summary()}
+
+    def load(self, data):
+        """بازیابی تاریخچهٔ ذخیره‌شده در runtime_log (خروجی to_log)."""
+        if not isinstance(data, dict):
+            return
+        with self._lock:
+            for run in data.get('runs') or []:
+                if isinstance(run, dict) and isinstance(run.get('stages'), list):
+                    self.runs.append(run)
+            for rec in data.get('interactive') or []:
+                if isinstance(rec, dict) and 'stage' in rec:
+                    self.interactive.append(rec)
+
+pipeline_profiler = PipelineProfiler()
+
+# ------------------------
+# صف مرکزی به‌روزرسانی UI (ادغام درخواست‌های تکراری و سقف زمانی هر فریم)
+# ------------------------
+class UiDispatcher:
+    """
+    کارها از هر رشته‌ای با post در صف امن‌رشته گذاشته می‌شوند و فقط روی رشتهٔ Tk اجرا می‌شوند.
+    کارهای هم‌کلید (key) تا پیش از اجرا در هم ادغام می‌شوند (فقط آخرین نگه داشته می‌شود)؛
+    در هر فریم تا وقتی budget_ms پر نشده کار اجرا می‌شود و بقیه به فریم بعد می‌رود.
+    زمان هر فریم و تأخیر کارها در تاریخچهٔ چرخشی frames ثبت می‌شود.
+    """
+    def __init__(self, budget_ms=12, frame_ms=16, idle_ms=40, history_size=300):
+        self.budget = budget_ms / 1000.0
+        self.frame_ms = frame_ms
+        self.idle_ms = idle_ms
+        self._queue = queue.SimpleQueue()
+        self._pending = OrderedDict()   # key -> (fn, args, زمان post)
+        self._seq = itertools.count()
+        self.frames = deque(maxlen=history_size)
+        self.coalesced = 0
+        self.errors = deque(maxlen=50)
+        self.root = None
+        self._closed = False
+        self._after_id = None
+
+    @property
+    def attached(self):
+        return self.root is not None
+
+    def attach(self, root):
+        """شروع حلقهٔ پمپ روی root (فقط از رشتهٔ Tk فراخوانی شود)."""
+        self.root = root
+        self._closed = False
+        self._schedule(self.frame_ms)
+
+    def detach(self):
+        """توقف پمپ هنگام بستن برنامه؛ postهای بعدی (مثلاً از رشتهٔ بارگذاری) دور ریخته می‌شوند."""
+        root, self.root = self.root, None
+        self._closed = True
+        self._pending.clear()
+        if root is not None and self._after_id:
+            try:
+                root.after_cancel(self._after_id)
+            except Exception:
+                pass
+        self._after_id = None
+
+    def post(self, fn, *args, key=None):
+        """
+        امن‌رشته؛ key=None یعنی بدون ادغام. اگر هرگز attach نشده باشد (اسکریپت/بنچمارک) کار همان‌جا
+        اجرا می‌شود؛ پس از detach کار اجرا نمی‌شود (root دیگر وجود ندارد).
+        """
+        if self._closed:
+            return
+        if self.root is None:
+            fn(*args)
+            return
+        self._queue.put((key, fn, args, time.perf_counter()))
+
+    def _schedule(self, delay):
+        try:
+            self._after_id = self.root.after(delay, self._pump) if self.root is not None else None
+        except Exception:
+            self._after_id = None
+
+    def _drain(self):
+        while True:
+            try:
+                key, fn, args, t = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if key is None:
+                key = ('_', next(self._seq))
+            elif key in self._pending:
+                # ادغام: زمان اولین درخواست برای سنجش تأخیر حفظ می‌شود
+                t = self._pending.pop(key)[2]
+                self.coalesced += 1
+            self._pending[key] = (fn, args, t)
+
+    def _pump(self):
+        self._after_id = None
+        self._drain()
+        if self._pending:
+            t0 = time.perf_counter()
+            ran, lag = 0, 0.0
+            while self._pending:
+                _, (fn, args, t) = self._pending.popitem(last=False)
+                lag = max(lag, t0 - t)
+                try:
+                    fn(*args)
+                except Exception as e:
+                    self.errors.append(f"{getattr(fn, '__qualname__', fn)}: {e}")
+                    # مثل callbackهای خود Tk: traceback از مسیر گزارش خطای root چاپ می‌شود
+                    try:
+                        self.root.report_callback_exception(*sys.exc_info())
+                    except Exception:
+                        traceback.print_exc()
+                ran += 1
+                if time.perf_counter() - t0 >= self.budget:
+                    break
+            self.frames.append({'ms': round((time.perf_counter() - t0) * 1000, 2), 'tasks': ran,
+                                'left': len(self._pending), 'lag_ms': round(lag * 1000, 2)})
+        self._schedule(1 if self._pending else (self.frame_ms if not self._queue.empty() else self.idle_ms))
+
+    def frame_stats(self):
+        """خلاصهٔ فریم‌های اخیر: تعداد، میانگین/p95/بیشینهٔ زمان، فریم‌های بیش از بودجه و بیشینهٔ تأخیر."""
+        frames = list(self.frames)
+        if not frames:
+            return {'frames': 0, 'coalesced': self.coalesced, 'pending': len(self._pending)}
+        ms = np.array([f['ms'] for f in frames])
+        return {'frames': len(frames), 'mean_ms': round(float(ms.mean()), 2),
+                'p95_ms': round(float(np.percentile(ms, 95)), 2), 'max_ms': round(float(ms.max()), 2),
+                'over_budget': int((ms > self.budget * 1000).sum()),
+                'max_lag_ms': max(f['lag_ms'] for f in frames),
+                'coalesced': self.coalesced, 'pending': len(self._pending)}
+
+ui_dispatcher = UiDispatcher()
+
+# ------------------------
+# پروفایل اختیاری عملیات (cProfile + tracemalloc) برای ارسال گزارش کندی
+# ------------------------
+class OperationProfiler:
+    """
+    با enabled=True هر عملیاتی که داخل capture(name) اجرا شود با cProfile و tracemalloc ضبط می‌شود و
+    در output_dir دو فایل می‌سازد: profile_<name>_<زمان>.prof (قابل باز کردن با pstats/snakeviz) و
+    profile_<name>_<زمان>.json (پرهزینه‌ترین توابع و بیشترین محل‌های تخصیص حافظه).
+    captureهای تو در تو فقط در بیرونی‌ترین سطح ضبط می‌شوند. هر عملیات حداکثر یک بار در min_interval
+    ثانیه ضبط می‌شود و در پوشهٔ خروجی فقط max_files گزارش آخر (با فایل .prof آن‌ها) نگه داشته می‌شود.
+    حالت پروفایل فقط برای همان اجرای برنامه روشن می‌ماند (در تنظیمات ذخیره نمی‌شود).
+    """
+    def __init__(self, enabled=False, output_dir=None, top=25, max_files=50, min_interval=2.0):
+        self.enabled = bool(enabled)
+        self.output_dir = output_dir
+        self.top = top
+        self.max_files = max_files
+        self.min_interval = min_interval
+        self.files = deque(maxlen=max_files)
+        self._last = {}  # نام عملیات -> زمان آخرین ضبط
+        self._lock = threading.Lock()
+
+    def _target_dir(self):
+        d = self.output_dir or os.path.join(os.path.dirname(os.path.abspath(SETTINGS_FILE)), 'profiles')
+        os.makedirs(d, exist_ok=True)
+        return d
+
+    @contextmanager
+    def capture(self, name):
+        # فقط یک ضبط همزمان؛ بقیه (تو در تو یا رشتهٔ دیگر) بدون پروفایل اجرا می‌شوند
+        now = time.monotonic()
+        if (not self.enabled or now - self._last.get(name, -math.inf) < self.min_interval
+                or not self._lock.acquire(blocking=False)):
+            yield
+            return
+        self._last[name] = now
+        prof = cProfile.Profile()
+        own_trace = not tracemalloc.is_tracing()
+        t0 = time.perf_counter()
+        try:
+            if own_trace:
+                tracemalloc.start(10)
+            base = tracemalloc.take_snapshot()
+            prof.enable()
+            try:
+                yield
+            finally:
+                prof.disable()
+                seconds = time.perf_counter() - t0
+                snap = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+                if own_trace:
+                    tracemalloc.stop()
+                try:
+                    self._write(name, prof, base, snap, seconds, peak)
+                except Exception:
+                    traceback.print_exc()
+        finally:
+            self._lock.release()
+
+    def profiled(self, name):
+        """دکوراتور معادل capture برای متدها."""
+        def deco(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.capture(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return deco
+
+    def _write(self, name, prof, base, snap, seconds, peak):
+        stamp = time.strftime("%Y%m%d_%H%M%S")
+        stem = os.path.join(self._target_dir(), f"profile_{name}_{stamp}_{int(time.time() * 1000) % 1000:03d}")
+        prof.dump_stats(stem + '.prof')
+        stats = pstats.Stats(prof)
+        hotspots = []
+        for (filename, line, func), (cc, nc, tt, ct, _callers) in stats.stats.items():
+            hotspots.append({'function': f"{os.path.basename(filename)}:{line}({func})", 'calls': nc,
+                             'tottime': round(tt, 6), 'cumtime': round(ct, 6)})
+        hotspots.sort(key=lambda h: -h['tottime'])
+        filt = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, cProfile.__file__))
+        allocations = [{'site': f"{os.path.basename(s.traceback[0].filename)}:{s.traceback[0].lineno}",
+                        'size_kb': round(s.size_diff / 1024, 1), 'count': s.count_diff}
+                       for s in snap.filter_traces(filt).compare_to(base.filter_traces(filt), 'lineno')[:self.top]]
+        report = {'operation': name, 'at': time.strftime("%Y-%m-%d %H:%M:%S"), 'seconds': round(seconds, 4),
+                  'peak_traced_kb': round(peak / 1024, 1), 'hotspots': hotspots[:self.top],
+                  'allocations': allocations, 'prof_file': os.path.basename(stem + '.prof')}
+        with open(stem + '.json', 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        self.files.append(stem + '.json')
+        self._rotate(os.path.dirname(stem))
+
+    def _rotate(self, d):
+        """حذف قدیمی‌ترین گزارش‌ها (json و prof هم‌نام) وقتی تعدادشان از max_files بیشتر شود."""
+        try:
+            stems = sorted((os.path.join(d, f[:-5]) for f in os.listdir(d)
+                            if f.startswith('profile_') and f.endswith('.json')), key=lambda s: os.path.getmtime(s + '.json'))
+        except OSError:
+            return
+        for stem in stems[:max(0, len(stems) - self.max_files)]:
+            for ext in ('.json', '.prof'):
+                try:
+                    os.remove(stem + ext)
+                except OSError:
+                    pass
+
+op_profiler = OperationProfiler(output_dir=settings_store.get('profiling_dir'))
+
 # ------------------------
 # توابع دریافت و پارس اولیه داده‌ها
 # ------------------------
 def fetch_sections(url=URL_DEFAULT, timeout=30):
     """دریافت متن و تقسیم به بخش‌ها بر اساس @"""
-    resp = requests.get(url, timeout=timeout)
-    resp.encoding = 'utf-8'
-    return resp.text.split('@')
+    with pipeline_profiler.stage('fetch') as rec:
+        resp = requests.get(url, timeout=timeout)
+        resp.encoding = 'utf-8'
+        sections = resp.text.split('@')
+        rec['bytes'] = len(resp.content)
+        rec['rows'] = len(sections)
+    return sections
 
 def parse_section(section_text: str, mapping=None) -> pd.DataFrame:
     """
     پارس یک بخش از متن TSETMC که با ; جدا شده است.
     اگر mapping داده شود، ایندکس‌های مشخص را به نام ستون تبدیل می‌کند.
     """
-    rows = [r for r in section_text.split(';') if r.strip()]
-    data = []
-    for i, row in enumerate(rows):
-        fields = row.split(',')
-        rec = {'ردیف': i+1}
-        if mapping:
-            for idx, name in mapping.items():
-                rec[name] = fields[idx] if idx < len(fields) else ''
-        else:
-            for j, val in enumerate(fields):
-                rec[f"ستون{j}"] = val
-        data.append(rec)
-    if not data:
-        return pd.DataFrame()
-    return pd.DataFrame(data)
+    with pipeline_profiler.stage('parse_section', nbytes=len(section_text.encode('utf-8'))) as rec:
+        df = _parse_section_rows(section_text, mapping)
+        rec['rows'] = len(df)
+    return df
 
 def merge_section3_into2(df2: pd.DataFrame, df3: pd.DataFrame) -> pd.DataFrame:
     """
     ادغام اطلاعات بخش 3 (S3) به بخش 2 بر اساس کلید کد.
     خروجی: df2 با ستون‌های اضافی S3_L{1..5}_C{2..7}
     """
-    if df2 is None or df3 is None or df2.empty or df3.empty:
-        return df2.copy() if df2 is not None else pd.DataFrame()
-    key_df3 = 'ستون0'
-    key_df2 = 'کد_داخلی' if 'کد_داخلی' in df2.columns else ('ستون0' if 'ستون0' in df2.columns else None)
-    if key_df2 is None or key_df3 not in df3.columns:
-        return df2.copy()
-    block_cols = [f'ستون{i}' for i in range(2, 8)]
-    for c in block_cols:
-        if c not in df3.columns:
-            df3[c] = ''
-    level_col = 'ستون1'
-    if level_col not in df3.columns:
-        df3[level_col] = ''
-    s3_map = {}
-    for _, row in df3.iterrows():
-        k = str(row.get(key_df3, '')).strip()
-        lv_str = str(row.get(level_col, '')).strip()
-        if not k or not lv_str.isdigit():
-            continue
-        lv = int(lv_str)
-        if lv < 1 or lv > 5:
-            continue
-        vals = [row.get(col, '') for col in block_cols]
-        s3_map.setdefault(k, {})[lv] = vals
-    extra_col_names = []
-    for lv in range(1, 6):
-        for j in range(2, 8):
-            extra_col_names.append(f"S3_L{lv}_C{j}")
-    extra_data = []
-    for _, row in df2.iterrows():
-        k = str(row.get(key_df2, '')).strip()
-        lv_map = s3_map.get(k, {})
-        row_extra = []
-        for lv in range(1, 6):
-            vals = lv_map.get(lv)
-            if vals:
-                row_extra.extend(vals)
-            else:
-                row_extra.extend([''] * 6)
-        extra_data.append(row_extra)
-    extra_df = pd.DataFrame(extra_data, columns=extra_col_names, index=df2.index)
-    merged = pd.concat([df2.reset_index(drop=True), extra_df.reset_index(drop=True)], axis=1)
+    with pipeline_profiler.stage('merge_section3_into2') as rec:
+        merged = _merge_section3_rows(df2, df3)
+        rec['rows'] = len(merged)
     return merged
 
 # ------------------------
@@ -288,6 +543,544 @@ def to_sort_key(s):
         flat.append(t[0]); flat.append(t[1])
     return (1, tuple(flat))
 
+# ------------------------
+# موتور امن عبارت‌های عددی (برای فیلتر رابطه‌ای)
+# ------------------------
+_EXPR_MAX_LEN = 500
+_EXPR_BINOPS = {
+    ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.true_divide,
+    ast.FloorDiv: np.floor_divide, ast.Mod: np.mod, ast.Pow: np.power,
+}
+_EXPR_UNARYOPS = {ast.UAdd: np.positive, ast.USub: np.negative}
+_EXPR_FUNCS = {'abs': (1, np.abs), 'min': (2, np.minimum), 'max': (2, np.maximum)}
+_RELATION_OPS = {
+    '>': np.greater, '<': np.less, '>=': np.greater_equal, '<=': np.less_equal,
+    '==': np.equal, '!=': np.not_equal,
+}
+
+
+class CompiledExpression:
+    """
+    عبارت عددی parse و اعتبارسنجی‌شده.
+    columns: ستون‌هایی که عبارت به آن‌ها نیاز دارد.
+    evaluate(get_column): get_column(col) آرایهٔ float ستون را می‌دهد؛ خروجی آرایه یا عدد float است.
+    """
+    def __init__(self, source, columns, fn):
+        self.source = source
+        self.columns = tuple(columns)
+        self._fn = fn
+
+    def evaluate(self, get_column):
+        with np.errstate(all='ignore'):
+            return self._fn(get_column)
+
+    def __repr__(self):
+        return f"CompiledExpression({self.source!r})"
+
+
+def compile_expression(expr, columns):
+    """
+    عبارتی مثل «3 * حجم_مبنا + 1» را یک بار روی نام ستون‌های معلوم کامپایل می‌کند.
+    فقط عدد، نام ستون، + - * / // % ** ، علامت یکانی، پرانتز و توابع abs/min/max مجازند؛
+    هر چیز دیگر (صفت، اندیس، فراخوانی دلخواه، نام ناشناخته) ValueError می‌دهد و هیچ کدی اجرا نمی‌شود.
+    """
+    text = normalize_text(expr)
+    if not text:
+        raise ValueError("عبارت خالی است")
+    if len(text) > _EXPR_MAX_LEN:
+        raise ValueError("عبارت بیش از حد طولانی است")
+    # نام ستون‌ها (که ممکن است فاصله یا حروف فارسی داشته باشند) با شناسهٔ جایگزین عوض می‌شوند؛ طولانی‌ترها اول
+    placeholders = {}
+    names = sorted({str(c) for c in columns}, key=len, reverse=True)
+    for i, col in enumerate(names):
+        ncol = normalize_text(col)
+        if not ncol or ncol not in text:
+            continue
+        ph = f"__c{i}__"
+        text, hits = re.subn(r'(?<!\w)' + re.escape(ncol) + r'(?!\w)', ph, text)
+        if hits:
+            placeholders[ph] = col
+    try:
+        tree = ast.parse(text, mode='eval')
+    except SyntaxError:
+        raise ValueError(f"عبارت نامعتبر: {expr}")
+    used = []
+
+    def build(node):
+        if isinstance(node, ast.Expression):
+            return build(node.body)
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+            v = float(node.value)
+            return lambda get: v
+        if isinstance(node, ast.Name):
+            col = placeholders.get(node.id)
+            if col is None:
+                raise ValueError(f"ستون ناشناخته: {node.id}")
+            if col not in used:
+                used.append(col)
+            return lambda get: get(col)
+        if isinstance(node, ast.BinOp) and type(node.op) in _EXPR_BINOPS:
+            op = _EXPR_BINOPS[type(node.op)]
+            left, right = build(node.left), build(node.right)
+            return lambda get: op(left(get), right(get))
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _EXPR_UNARYOPS:
+            op = _EXPR_UNARYOPS[type(node.op)]
+            operand = build(node.operand)
+            return lambda get: op(operand(get))
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _EXPR_FUNCS
+                and not node.keywords):
+            arity, fn = _EXPR_FUNCS[node.func.id]
+            if len(node.args) != arity:
+                raise ValueError(f"تعداد آرگومان {node.func.id} باید {arity} باشد")
+            args = [build(a) for a in node.args]
+            return lambda get: fn(*(a(get) for a in args))
+        raise ValueError(f"بخش غیرمجاز در عبارت: {type(node).__name__}")
+
+    fn = build(tree)
+    return CompiledExpression(expr, used, fn)
+
+# ------------------------
+# تاریخچهٔ درون‌روز در حافظه (بافر حلقوی عددی برای هر نماد)
+# ------------------------
+INTRADAY_FIELDS = ('قیمت_آخرین_معامله', 'قیمت_پایانی', 'حجم_معاملات', 'ارزش_معاملات', 'صف خرید', 'صف فروش')
+INTRADAY_WINDOW_SECONDS = 300
+
+
+class IntradayHistory:
+    """
+    بافر حلقوی عددی درون‌روز: آرایهٔ float64 با شکل (نماد، capacity، فیلد) و یک آرایهٔ زمان مشترک.
+    هر refresh یک نمونه برای همهٔ نمادها ثبت می‌کند؛ حافظه ثابت است (فقط capacity نمونهٔ آخر)
+    و هیچ DataFrame کاملی نگه داشته نمی‌شود. نمادی که در یک refresh نباشد برای آن نمونه NaN می‌گیرد.
+    مقدار اولین نمونهٔ هر نماد در روز جاری جداگانه نگه داشته می‌شود (برای «تغییر از بازگشایی»)؛
+    با عوض شدن تاریخ، بافر خالی می‌شود.
+    """
+    def __init__(self, fields=INTRADAY_FIELDS, capacity=128, key='کد_داخلی'):
+        self.fields = tuple(fields)
+        self.capacity = max(2, int(capacity))
+        self.key = key
+        self._keys = pd.Index([], dtype=object)
+        self._values = np.full((0, self.capacity, len(self.fields)), np.nan)
+        self._open = np.full((0, len(self.fields)), np.nan)
+        self._times = np.zeros(self.capacity)
+        self._head = 0
+        self._count = 0
+        self._day = None
+
+    def __len__(self):
+        return self._count
+
+    def reset(self):
+        self._keys = pd.Index([], dtype=object)
+        self._values = np.full((0, self.capacity, len(self.fields)), np.nan)
+        self._open = np.full((0, len(self.fields)), np.nan)
+        self._head = 0
+        self._count = 0
+
+    def _slots_for(self, keys):
+        """موقعیت هر کلید در بافر؛ نمادهای جدید با رشد تکه‌ای آرایه‌ها اضافه می‌شوند."""
+        slots = self._keys.get_indexer(keys)
+        missing = slots < 0
+        if missing.any():
+            new_keys = pd.unique(keys[missing])
+            self._keys = self._keys.append(pd.Index(new_keys, dtype=object))
+            n_new = len(self._keys)
+            if n_new > self._values.shape[0]:
+                grow = max(n_new - self._values.shape[0], self._values.shape[0] // 2, 64)
+                self._values = np.concatenate([self._values, np.full((grow, self.capacity, len(self.fields)), np.nan)])
+                self._open = np.concatenate([self._open, np.full((grow, len(self.fields)), np.nan)])
+            slots = self._keys.get_indexer(keys)
+        return slots
+
+    def _frame_values(self, df):
+        out = np.full((len(df), len(self.fields)), np.nan)
+        for j, f in enumerate(self.fields):
+            if f in df.columns:
+                out[:, j] = pd.to_numeric(df[f], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+        return out
+
+    def record(self, df, ts=None):
+        """ثبت یک نمونه از df (هر ردیف یک نماد با ستون key)."""
+        if df is None or df.empty or self.key not in df.columns:
+            return
+        ts = time.time() if ts is None else float(ts)
+        day = time.strftime('%Y-%m-%d', time.localtime(ts))
+        if day != self._day:
+            self.reset()
+            self._day = day
+        keys = df[self.key].astype(str).to_numpy(dtype=object)
+        slots = self._slots_for(keys)
+        vals = self._frame_values(df)
+        h = self._head
+        self._values[:, h, :] = np.nan
+        self._values[slots, h, :] = vals
+        self._times[h] = ts
+        self._head = (h + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+        first = np.isnan(self._open[slots])
+        self._open[slots] = np.where(first, vals, self._open[slots])
+
+    def _ordered_positions(self):
+        return (self._head - self._count + np.arange(self._count)) % self.capacity
+
+    def window_delta(self, df, field, seconds=INTRADAY_WINDOW_SECONDS):
+        """تغییر field برای ردیف‌های df از آخرین نمونهٔ حداقل seconds ثانیه قبل (یا قدیمی‌ترین نمونه) تا آخرین نمونه."""
+        n = len(df)
+        if self._count == 0 or field not in self.fields or self.key not in df.columns:
+            return np.full(n, np.nan)
+        slots = self._keys.get_indexer(df[self.key].astype(str).to_numpy(dtype=object))
+        order = self._ordered_positions()
+        t = self._times[order]
+        j = max(0, int(np.searchsorted(t, t[-1] - seconds, side='right')) - 1)
+        fi = self.fields.index(field)
+        cur = np.where(slots >= 0, self._values[slots, order[-1], fi], np.nan)
+        old = np.where(slots >= 0, self._values[slots, order[j], fi], np.nan)
+        return cur - old
+
+    def since_open(self, df, field):
+        """تغییر field از اولین نمونهٔ روز تا آخرین نمونه برای ردیف‌های df."""
+        n = len(df)
+        if self._count == 0 or field not in self.fields or self.key not in df.columns:
+            return np.full(n, np.nan)
+        slots = self._keys.get_indexer(df[self.key].astype(str).to_numpy(dtype=object))
+        fi = self.fields.index(field)
+        last = self._ordered_positions()[-1]
+        cur = np.where(slots >= 0, self._values[slots, last, fi], np.nan)
+        opened = np.where(slots >= 0, self._open[slots, fi], np.nan)
+        return cur - opened
+
+    def update_frame(self, df):
+        """
+        ثبت df و افزودن ستون‌های مشتق در جا: حجم 5 دقیقه اخیر، تغییر قیمت 5 دقیقه (%)
+        و تغییر صف خرید/فروش از بازگشایی. برای استفاده به عنوان prepare_hook جدول.
+        """
+        self.record(df)
+        if self._count == 0:
+            return
+        minutes = INTRADAY_WINDOW_SECONDS // 60
+        df[f'حجم {minutes} دقیقه اخیر'] = self.window_delta(df, 'حجم_معاملات')
+        price_delta = self.window_delta(df, 'قیمت_آخرین_معامله')
+        price_now = pd.to_numeric(df.get('قیمت_آخرین_معامله'), errors='coerce') if 'قیمت_آخرین_معامله' in df.columns else np.nan
+        with np.errstate(divide='ignore', invalid='ignore'):
+            base = np.asarray(price_now, dtype=np.float64) - price_delta
+            df[f'تغییر قیمت {minutes} دقیقه (%)'] = np.round(np.where(base > 0, price_delta / base * 100.0, np.nan), 2)
+        df['تغییر صف خرید از بازگشایی'] = self.since_open(df, 'صف خرید')
+        df['تغییر صف فروش از بازگشایی'] = self.since_open(df, 'صف فروش')
+
+
+intraday_history = IntradayHistory(capacity=settings_store.get('intraday_capacity', 128))
+
+# ------------------------
+# تفاوت دو snapshot پیاپی (نمادهای جدید، حذف‌شده و تغییرکرده)
+# ------------------------
+class SnapshotDiff:
+    """
+    نتیجهٔ diff_snapshots.
+    inserted / removed / changed: pd.Index کلیدها (کد_داخلی)
+    changed_mask: DataFrame بولی (ردیف = کلید تغییرکرده، ستون = ستون مشترک) که نشان می‌دهد کدام ستون عوض شده
+    curr_positions: موقعیت ردیف‌های جدید و تغییرکرده در snapshot فعلی (برای کارهای افزایشی)
+    added_columns / removed_columns: ستون‌هایی که فقط در یکی از دو snapshot هستند
+    """
+    def __init__(self, inserted, removed, changed, changed_mask, curr_positions, added_columns=(), removed_columns=()):
+        self.inserted = inserted
+        self.removed = removed
+        self.changed = changed
+        self.changed_mask = changed_mask
+        self.curr_positions = curr_positions
+        self.added_columns = list(added_columns)
+        self.removed_columns = list(removed_columns)
+
+    @property
+    def is_empty(self):
+        return not (len(self.inserted) or len(self.removed) or len(self.changed))
+
+    def columns_for(self, key):
+        """ستون‌های تغییرکردهٔ یک کلید."""
+        if key not in self.changed_mask.index:
+            return []
+        row = self.changed_mask.loc[key]
+        return list(row.index[row.to_numpy(dtype=bool)])
+
+    def changed_by_column(self):
+        """{ستون: Index کلیدهایی که آن ستون‌شان عوض شده} فقط برای ستون‌هایی که تغییری داشته‌اند."""
+        m = self.changed_mask
+        out = {}
+        for c in m.columns:
+            hit = m[c].to_numpy(dtype=bool)
+            if hit.any():
+                out[c] = m.index[hit]
+        return out
+
+    def summary(self):
+        return {'inserted': len(self.inserted), 'removed': len(self.removed), 'changed': len(self.changed),
+                'changed_cells': int(self.changed_mask.to_numpy().sum()) if not self.changed_mask.empty else 0}
+
+    def __repr__(self):
+        return f"SnapshotDiff({self.summary()})"
+
+
+def diff_snapshots(prev: pd.DataFrame, curr: pd.DataFrame, key='کد_داخلی', columns=None) -> SnapshotDiff:
+    """
+    مقایسهٔ دو snapshot آماده‌شده بر اساس key، بدون حلقهٔ پایتونی روی ردیف‌ها:
+    ابتدا hash هر ردیف (pd.util.hash_pandas_object) برای ردیف‌های مشترک مقایسه می‌شود و فقط
+    ردیف‌هایی که hash متفاوت دارند ستون به ستون مقایسه می‌شوند (NaN برابر NaN حساب می‌شود).
+    ستون 'ردیف' (شمارهٔ نمایش) نادیده گرفته می‌شود. کلید تکراری: اولین ردیف معتبر است.
+    """
+    empty_idx = pd.Index([], dtype=object)
+    if curr is None or key not in curr.columns:
+        raise KeyError(key)
+    curr_keys = pd.Index(curr[key].astype(str).to_numpy(dtype=object))
+    if prev is None or prev.empty or key not in prev.columns:
+        return SnapshotDiff(curr_keys.unique(), empty_idx, empty_idx, pd.DataFrame(index=empty_idx),
+                            np.arange(len(curr), dtype=np.int64))
+    prev_keys = pd.Index(prev[key].astype(str).to_numpy(dtype=object))
+    curr_first = ~curr_keys.duplicated()
+    prev_first = ~prev_keys.duplicated()
+    prev_u = prev_keys[prev_first]
+    prev_pos_all = np.flatnonzero(prev_first)
+
+    pos_in_prev = prev_u.get_indexer(curr_keys)
+    pos_in_prev[~curr_first] = -2  # ردیف‌های تکراری snapshot فعلی نادیده گرفته می‌شوند
+    inserted_mask = pos_in_prev == -1
+    inserted = curr_keys[inserted_mask]
+    removed = prev_u[curr_keys.get_indexer(prev_u) < 0] if len(prev_u) else empty_idx
+
+    if columns is None:
+        columns = [c for c in curr.columns if c in prev.columns and c not in (key, 'ردیف')]
+    added_columns = [c for c in curr.columns if c not in prev.columns]
+    removed_columns = [c for c in prev.columns if c not in curr.columns]
+
+    common_curr = np.flatnonzero(pos_in_prev >= 0)
+    common_prev = prev_pos_all[pos_in_prev[common_curr]]
+    if len(common_curr) and columns:
+        c_sub = curr[columns].take(common_curr)
+        p_sub = prev[columns].take(common_prev)
+        h_curr = pd.util.hash_pandas_object(c_sub, index=False).to_numpy()
+        h_prev = pd.util.hash_pandas_object(p_sub, index=False).to_numpy()
+        cand = np.flatnonzero(h_curr != h_prev)
+    else:
+        cand = np.zeros(0, dtype=np.int64)
+
+    mask_cols = {}
+    if len(cand):
+        cc = curr[columns].take(common_curr[cand])
+        pc = prev[columns].take(common_prev[cand])
+        for c in columns:
+            # مقایسهٔ object (دسته‌های Categorical دو snapshot یکی نیستند). == فقط روی جفت‌های بدون مقدار
+            # گمشده اجرا می‌شود تا pd.NA (مثلاً PE صندوق‌ها) خطای «boolean value of NA» ندهد؛ دو گمشده برابرند
+            a = cc[c].to_numpy(dtype=object)
+            b = pc[c].to_numpy(dtype=object)
+            na_a, na_b = pd.isna(a), pd.isna(b)
+            same = na_a & na_b
+            both = ~(na_a | na_b)
+            same[both] = np.asarray(a[both] == b[both], dtype=bool)
+            mask_cols[c] = ~same
+    changed_mask = pd.DataFrame(mask_cols, index=curr_keys[common_curr[cand]], columns=columns)
+    if len(cand):
+        really = changed_mask.to_numpy().any(axis=1)
+        changed_mask = changed_mask[really]
+        cand = cand[really]
+    changed_mask = changed_mask.astype(bool)
+    changed_pos = common_curr[cand]
+    curr_positions = np.sort(np.concatenate([np.flatnonzero(inserted_mask), changed_pos])).astype(np.int64)
+    return SnapshotDiff(inserted, removed, changed_mask.index, changed_mask, curr_positions,
+                        added_columns, removed_columns)
+
+# ------------------------
+# هشدارهای دیدبان (قواعد از جنس payload فیلترها، ارزیابی افزایشی روی ردیف‌های تغییرکرده)
+# ------------------------
+def _text_payload_predicate(payload):
+    """payload نوع value/pattern -> (column, predicate, exclude, desc)؛ predicate روی Series متنی نرمال‌شده اجرا می‌شود."""
+    kind = payload.get('type')
+    column = payload['column']
+    exclude = bool(payload.get('exclude', False))
+    if kind == 'value':
+        values = list(payload.get('values') or [])
+        norm_values = [normalize_text(v) for v in values]
+        desc = f"{column} {'شامل نشود' if exclude else 'شامل شود'}: {', '.join(str(v) for v in values)}"
+        return column, (lambda u: u.isin(norm_values)), exclude, desc
+    mode = payload.get('mode')
+    text = payload.get('text', '')
+    length = payload.get('length')
+    norm_text = normalize_text(text)
+    def predicate(u):
+        if mode == 'start':
+            L = int(length) if length else len(norm_text)
+            return u.str[:L] == norm_text
+        if mode == 'end':
+            L = int(length) if length else len(norm_text)
+            return u.str[-L:] == norm_text
+        return u.str.contains(norm_text, regex=False, na=False)
+    desc = f"{column} {'شامل نشود' if exclude else 'شامل شود'} الگو {mode}='{text}'"
+    return column, predicate, exclude, desc
+
+
+def payload_mask(payload, df: pd.DataFrame):
+    """
+    ماسک بولی یک payload فیلتر (value/pattern/relation) روی df دلخواه، بدون cacheهای AdvancedTreeview.
+    برای زیرمجموعه‌های کوچک (ردیف‌های تغییرکرده) مناسب است. ستون ناموجود: KeyError، عبارت نامعتبر: ValueError.
+    """
+    kind = payload.get('type')
+    if kind in ('value', 'pattern'):
+        column, predicate, exclude, _ = _text_payload_predicate(payload)
+        if column not in df.columns:
+            raise KeyError(column)
+        codes, uniques = pd.factorize(df[column], use_na_sentinel=False)
+        labels = pd.Series(uniques, dtype=object).astype(str).map(normalize_text)
+        m = predicate(labels).to_numpy(dtype=bool, na_value=False)[codes]
+        return ~m if exclude else m
+    if kind == 'relation':
+        if payload['left'] not in df.columns:
+            raise KeyError(payload['left'])
+        compare = _RELATION_OPS.get(payload['op'])
+        if compare is None:
+            raise ValueError(f"عملگر نامعتبر: {payload['op']}")
+        left = compile_expression(payload['left'], df.columns)
+        right = compile_expression(payload['right'], df.columns)
+        cache = {}
+        def get(c):
+            if c not in cache:
+                cache[c] = numeric_values(df[c])
+            return cache[c]
+        L = np.broadcast_to(left.evaluate(get), (len(df),))
+        R = np.broadcast_to(right.evaluate(get), (len(df),))
+        with np.errstate(invalid='ignore'):
+            m = compare(L, R)
+        return m & ~np.isnan(L) & ~np.isnan(R)
+    raise ValueError(f"نوع فیلتر ناشناخته: {kind}")
+
+
+class AlertEngine:
+    """
+    قواعد هشدار: [{'name': ..., 'conditions': [payload, ...], 'enabled': True}, ...]
+    هر قاعده وقتی همهٔ شرط‌هایش برای یک نماد برقرار شود (گذر از «برقرار نبود» به «برقرار شد») یک رویداد می‌دهد.
+    نتیجهٔ هر ردیف فقط به مقادیر همان ردیف وابسته است، پس با SnapshotDiff فقط ردیف‌های جدید/تغییرکرده
+    دوباره ارزیابی می‌شوند و بقیه وضعیت قبلی خود را نگه می‌دارند.
+    """
+    def __init__(self, rules=None, key='کد_داخلی', label_col='نماد', max_events=500):
+        self.key = key
+        self.label_col = label_col
+        self.events = deque(maxlen=max_events)
+        self.errors = {}  # نام قاعده -> آخرین خطا (ستون ناموجود، عبارت نامعتبر)
+        self.set_rules(rules or [])
+
+    def set_rules(self, rules):
+        self.rules = [dict(r) for r in rules]
+        self._active = [set() for _ in self.rules]
+        self._primed = False  # تا ارزیابی کامل بعدی، diff کافی نیست
+
+    def _rule_mask(self, rule, rows):
+        m = np.ones(len(rows), dtype=bool)
+        for payload in rule.get('conditions') or []:
+            m &= payload_mask(payload, rows)
+        return m
+
+    def evaluate(self, snapshot: pd.DataFrame, diff=None):
+        """
+        ارزیابی قواعد روی snapshot؛ اگر diff (SnapshotDiff همین snapshot نسبت به قبلی) داده شود و وضعیت
+        قبلی معتبر باشد فقط diff.curr_positions بررسی می‌شود. خروجی: فهرست رویدادهای جدید.
+        """
+        if snapshot is None or self.key not in snapshot.columns:
+            return []
+        full = diff is None or not self._primed
+        rows = snapshot if full else snapshot.take(diff.curr_positions)
+        keys = rows[self.key].astype(str).to_numpy(dtype=object)
+        labels = rows[self.label_col].astype(str).to_numpy(dtype=object) if self.label_col in rows.columns else keys
+        removed = set() if full else set(diff.removed)
+        evaluated = set(keys)
+        now = time.strftime("%H:%M:%S")
+        new_events = []
+        for i, rule in enumerate(self.rules):
+            if not rule.get('enabled', True) or not rule.get('conditions'):
+                self._active[i] = set()
+                continue
+            name = rule.get('name') or f"قاعده {i + 1}"
+            try:
+                m = self._rule_mask(rule, rows)
+                self.errors.pop(name, None)
+            except (KeyError, ValueError) as e:
+                self.errors[name] = str(e)
+                m = np.zeros(len(rows), dtype=bool)
+            hit = np.flatnonzero(m)
+            matched = set(keys[hit])
+            prev = self._active[i]
+            for j in hit:
+                if keys[j] not in prev:
+                    new_events.append({'time': now, 'rule': name, 'key': keys[j], 'symbol': labels[j]})
+            self._active[i] = matched if full else ((prev - evaluated - removed) | matched)
+        self._primed = True
+        self.events.extend(new_events)
+        return new_events
+
+    def active_counts(self):
+        """{نام قاعده: تعداد نمادهایی که الان شرط را دارند}"""
+        return {(r.get('name') or f"قاعده {i + 1}"): len(a) for i, (r, a) in enumerate(zip(self.rules, self._active))}
+
+
+alert_engine = AlertEngine(settings_store.get('alert_rules', []))
+
+# ------------------------
+# تجمیع گروهی (صنعت / کد بازار) با کدهای گروه ثابت و به‌روزرسانی افزایشی با تغییر نما
+# ------------------------
+GROUP_VALUE_COLUMNS = ('ارزش_معاملات', 'ارزش بازار همت', 'صف خرید', 'صف فروش')
+
+
+class GroupAggregator:
+    """
+    جمع ستون‌های عددی و تعداد ردیف‌ها به تفکیک گروه، روی زیرمجموعهٔ دلخواهی از ردیف‌ها.
+    codes (کد گروه هر ردیف) و labels یک بار در هر بارگذاری ساخته می‌شوند؛ update(rows) فقط اختلاف
+    ردیف‌های جدید با ردیف‌های قبلی را با np.bincount اضافه/کم می‌کند و اگر اختلاف بزرگ باشد از نو می‌سازد.
+    برای هر ستون، تعداد ردیف‌های با مقدار مثبت (مثلاً تعداد نمادهای در صف) هم نگه داشته می‌شود.
+    """
+    def __init__(self, codes, labels, values: dict):
+        self.codes = np.asarray(codes, dtype=np.int64)
+        self.labels = np.asarray(labels, dtype=object)
+        self.n_groups = len(self.labels)
+        self.value_names = list(values)
+        self._weights = {k: np.nan_to_num(np.asarray(v, dtype=np.float64)) for k, v in values.items()}
+        self._positive = {k: (w > 0).astype(np.float64) for k, w in self._weights.items()}
+        self._rows = None
+        self.count = np.zeros(self.n_groups, dtype=np.int64)
+        self.sums = {k: np.zeros(self.n_groups) for k in self.value_names}
+        self.positive_counts = {k: np.zeros(self.n_groups) for k in self.value_names}
+        self.last_update = {'mode': None, 'rows': 0}
+
+    def _accumulate(self, rows, sign):
+        c = self.codes[rows]
+        self.count += sign * np.bincount(c, minlength=self.n_groups)
+        for k in self.value_names:
+            self.sums[k] += sign * np.bincount(c, weights=self._weights[k][rows], minlength=self.n_groups)
+            self.positive_counts[k] += sign * np.bincount(c, weights=self._positive[k][rows], minlength=self.n_groups)
+
+    def update(self, rows):
+        """rows: موقعیت ردیف‌های نمای فعلی (ترتیب مهم نیست)."""
+        rows = np.sort(np.asarray(rows, dtype=np.int64))
+        if self._rows is not None:
+            added = np.setdiff1d(rows, self._rows, assume_unique=True)
+            removed = np.setdiff1d(self._rows, rows, assume_unique=True)
+            if len(added) + len(removed) < len(rows):
+                self._accumulate(added, 1)
+                self._accumulate(removed, -1)
+                self._rows = rows
+                self.last_update = {'mode': 'delta', 'rows': int(len(added) + len(removed))}
+                return self
+        self.count[:] = 0
+        for k in self.value_names:
+            self.sums[k][:] = 0.0
+            self.positive_counts[k][:] = 0.0
+        self._accumulate(rows, 1)
+        self._rows = rows
+        self.last_update = {'mode': 'full', 'rows': int(len(rows))}
+        return self
+
+    def table(self) -> pd.DataFrame:
+        """DataFrame گروه‌های غیرخالی: گروه، تعداد، و برای هر ستون جمع و تعداد مثبت‌ها؛ به ترتیب تعداد نزولی."""
+        nz = np.flatnonzero(self.count > 0)
+        out = {'گروه': self.labels[nz], 'تعداد': self.count[nz]}
+        for k in self.value_names:
+            out[f'جمع {k}'] = self.sums[k][nz]
+            out[f'تعداد {k} > 0'] = np.rint(self.positive_counts[k][nz]).astype(np.int64)
+        return pd.DataFrame(out).sort_values('تعداد', ascending=False, kind='stable').reset_index(drop=True)
+
 # ------------------------
 # کمک‌کننده‌های کوچک و مقداردهی پیش‌فرض تنظیمات
 # ------------------------
@@ -304,7 +1097,7 @@ def _ensure_settings_defaults():
         changed = True
     if 'bottom_visible_columns' not in settings_store:
         settings_store['bottom_visible_columns'] = None
-    if changed:
+    if changed and not _IN_WORKER:
         try:
             save_settings(settings_store)
         except Exception:
@@ -325,47 +1118,111 @@ def get_column_case_insensitive(df: pd.DataFrame, col_name: str):
     return None
 
 # ------------------------
-# FIELD_MAPPING نمونه برای بخش 2
+# پارس و آماده‌سازی موازی دیدبان در ProcessPoolExecutor (ردیف‌ها به چند تکه تقسیم می‌شوند)
 # ------------------------
-FIELD_MAPPING = {
-    0: "کد_داخلی",
-    1: "کد_بین_المللی",
-    2: "نماد",
-    3: "نام_شرکت",
-    4: "زمان_آخرین_معامله",
-    5: "اولین_قیمت",
-    6: "قیمت_پایانی",
-    7: "قیمت_آخرین_معامله",
-    8: "تعداد_معاملات",
-    9: "حجم_معاملات",
-    10: "ارزش_معاملات",
-    11: "کمترین_قیمت",
-    12: "بیشترین_قیمت",
-    13: "قیمت_دیروز",
-    14: "EPS",
-    15: "حجم_مبنا",
-    16: "تعداد_بازدید_کننده",
-    17: "بازار_اصلی",
-    18: "گروه_صنعت",
-    19: "حداکثر_قیمت_مجاز",
-    20: "حداقل_قیمت_مجاز",
-    21: "تعداد_کل_سهام",
-    22: "کد_بازار",
-    23: "NAV",
-    24: "موقعیت_های_باز",
-    25: "دسته_بندی_تخصصی"
-}
+_market_pool = None
+_market_pool_workers = 0
+_market_pool_ready = threading.Event()
+_market_pool_lock = threading.Lock()
+
+def _resolve_workers(workers):
+    return max(1, int(workers or os.cpu_count() or 1))
+
+def warm_market_pool(workers=None):
+    """
+    ساخت pool پایدار بین refreshها و بالا آوردن پروسه‌هایش در یک رشتهٔ پس‌زمینه. شروع پروسه‌ها (به‌ویژه
+    spawn در ویندوز) چند ثانیه طول می‌کشد؛ تا آماده شدن، parse_market_sharded مسیر تک‌پردازه را می‌رود.
+    خروجی: threading.Event که با آماده شدن pool ست می‌شود.
+    """
+    global _market_pool, _market_pool_workers, _market_pool_ready
+    workers = _resolve_workers(workers)
+    with _market_pool_lock:
+        if _market_pool is not None and _market_pool_workers == workers:
+            return _market_pool_ready
+        _shutdown_market_pool_locked()
+        pool = ProcessPoolExecutor(max_workers=workers)
+        ready = threading.Event()
+        _market_pool, _market_pool_workers, _market_pool_ready = pool, workers, ready
+
+    def _warm():
+        try:
+            list(pool.map(_warm_worker, range(workers)))
+        except Exception:
+            return
+        ready.set()
+    threading.Thread(target=_warm, name="market-pool-warmup", daemon=True).start()
+    return ready
+
+def _shutdown_market_pool_locked():
+    global _market_pool, _market_pool_workers
+    if _market_pool is not None:
+        _market_pool.shutdown(wait=False, cancel_futures=True)
+    _market_pool, _market_pool_workers = None, 0
+
+def shutdown_market_pool():
+    with _market_pool_lock:
+        _shutdown_market_pool_locked()
+
+def _ready_market_pool(workers):
+    """pool آماده با همین تعداد پروسه یا None (در این صورت گرم کردن آن شروع می‌شود)."""
+    with _market_pool_lock:
+        if _market_pool is not None and _market_pool_workers == workers:
+            return _market_pool if _market_pool_ready.is_set() else None
+    warm_market_pool(workers)
+    return None
+
+def parse_market_sharded(section2, section3=None, mapping=None, workers=None, min_rows_per_shard=500):
+    """
+    معادل parse_section + merge_section3_into2 + آماده‌سازی AdvancedTreeview، به صورت تکه‌تکه در پردازه‌های جدا
+    (کار هر تکه: market_frame._prepare_market_shard). خروجی (df، دفتر سفارش) برای
+    AdvancedTreeview(..., order_book=book). اگر ردیف‌ها برای بیش از یک تکه کافی نباشند یا pool هنوز
+    آماده نباشد همه چیز در همین پردازه اجرا می‌شود.
+    """
+    mapping = FIELD_MAPPING if mapping is None else mapping
+    workers = _resolve_workers(workers)
+    with pipeline_profiler.stage('parse_sharded', nbytes=len(section2.encode('utf-8'))) as rec:
+        shards = max(1, min(workers, section2.count(';') // max(1, min_rows_per_shard)))
+        # تا وقتی pool گرم نشده (یا خراب شده) همه چیز در همین پردازه و به صورت یک تکه اجرا می‌شود
+        pool = _ready_market_pool(workers) if shards > 1 else None
+        if pool is None:
+            shards = 1
+        with_section3 = bool(section3 and section3.strip())
+        tasks = [(t2, t3, off, mapping, with_section3) for t2, t3, off in _split_market_rows(section2, section3, shards)]
+        results = None
+        if pool is not None:
+            try:
+                results = list(pool.map(_prepare_market_shard, tasks))
+            except BrokenProcessPool:
+                shutdown_market_pool()
+                shards = 1
+                tasks = [(t2, t3, off, mapping, with_section3) for t2, t3, off in _split_market_rows(section2, section3, 1)]
+        if results is None:
+            results = [_prepare_market_shard(t) for t in tasks]
+        df = _concat_shards([r[0] for r in results])
+        books = [r[1] for r in results if len(r[1])]
+        book = np.concatenate(books) if books else np.full((0, ORDER_BOOK_LEVELS, len(ORDER_BOOK_FIELDS)), np.nan)
+        rec['rows'] = len(df)
+        rec['shards'] = shards
+        rec['pool'] = 'ready' if pool is not None else 'serial'
+    return df, book
 
 # ------------------------
 # صادرات نمادها برای استفاده در فایل دوم
 # ------------------------
 __all__ = [
     "URL_DEFAULT", "DEFAULT_EXPORT_NAME", "SETTINGS_FILE",
+    "CATEGORICAL_COLUMNS", "map_unique", "encode_categorical_columns", "numeric_values",
     "load_settings", "save_settings", "settings_store",
     "normalize_text", "INDUSTRY_MAP", "MARKET_LABELS",
     "COLUMN_NAME_MAP", "fetch_sections", "parse_section",
     "merge_section3_into2", "to_sort_key", "FIELD_MAPPING",
-    "get_column_case_insensitive"
+    "get_column_case_insensitive", "PipelineProfiler", "pipeline_profiler",
+    "UiDispatcher", "ui_dispatcher", "OperationProfiler", "op_profiler",
+    "CompiledExpression", "compile_expression", "IntradayHistory", "intraday_history",
+    "SnapshotDiff", "diff_snapshots", "payload_mask", "AlertEngine", "alert_engine",
+    "ORDER_BOOK_LEVELS", "ORDER_BOOK_FIELDS", "order_book_from_frame", "order_book_metrics",
+    "GROUP_VALUE_COLUMNS", "GroupAggregator",
+    "prepare_market_frame", "parse_market_sharded", "warm_market_pool", "shutdown_market_pool"
 ]
 
 # پایان بخش اول
@@ -381,120 +1238,210 @@ __all__ = [
 # ------------------------
 # AdvancedTreeview
 # ------------------------
+# (نام فونت، متن) -> عرض پیکسلی؛ بین همهٔ جدول‌ها مشترک. LRU محدود: متن‌های کاندید با هر refresh عوض
+# می‌شوند و بدون حد، cache در طول یک جلسهٔ معاملاتی بی‌نهایت رشد می‌کرد
+_TEXT_WIDTH_CACHE = OrderedDict()
+_TEXT_WIDTH_CACHE_SIZE = 4096
+
+
 class AdvancedTreeview(ttk.Treeview):
     """
     Treeview پیشرفته با:
-    - نگهداری base_df و df فعلی
+    - یک مخزن دادهٔ واحد (base_df) و نمای فیلتر/مرتب‌شده به صورت آرایهٔ موقعیت ردیف‌ها (_row_index)
     - فیلترها (active_filters)
     - نمایش مقادیر محاسبه‌شده مانند 'ارزش بازار همت' و 'PE'
     - منوی راست کلیک برای کپی و فیلتر سریع
+
+    df داده‌شده بدون کپی به عنوان base_df نگه داشته می‌شود (مالکیت به جدول منتقل می‌شود).
+    self.df نمای فعلی است که فقط هنگام نیاز از روی _row_index ساخته و cache می‌شود؛
+    وقتی فیلتر و مرتب‌سازی فعال نیست، خود base_df برگردانده می‌شود.
+
+    persisted_filters: لیست payloadهای ذخیره‌شده (saved_filters_full)؛ همه با هم روی داده
+    اعمال می‌شوند تا اولین پر شدن جدول همان نمای فیلترشده باشد.
+    prepare_hooks: توابع hook(base_df) که در پایان _prepare_dataframe ستون‌های مشتق را در جا اضافه می‌کنند.
+    order_book: اگر df از قبل با prepare_market_frame/parse_market_sharded آماده شده باشد، دفتر سفارش
+    برگشتی آن؛ در این صورت آماده‌سازی اولیه تکرار نمی‌شود.
     """
-    def __init__(self, parent, df: pd.DataFrame, app_runtime_log: dict = None, **kwargs):
+    def __init__(self, parent, df: pd.DataFrame, app_runtime_log: dict = None, persisted_filters=None,
+                 prepare_hooks=None, order_book=None, **kwargs):
         super().__init__(parent, show="headings", **kwargs)
         self.app_runtime_log = app_runtime_log if app_runtime_log is not None else {}
-        self.base_df = df.copy() if df is not None else pd.DataFrame()
-        self.df = self.base_df.copy()
-        self.norm_df = pd.DataFrame()
-        self.active_filters = []  # list of {'desc':..., 'func':..., 'enabled':True}
-        self.visible_columns = {col: True for col in list(self.df.columns)}
+        if df is None:
+            df = pd.DataFrame()
+        if not (isinstance(df.index, pd.RangeIndex) and df.index.start == 0 and df.index.step == 1):
+            df = df.reset_index(drop=True)
+        self.base_df = df
+        self._row_index = np.arange(len(df), dtype=np.int64)
+        self._df_cache = None
+        self._normalized_cols = set()
+        self._numeric_cache = {}  # col -> آرایهٔ float64 ستون روی base_df (برای عبارت‌های رابطه‌ای)
+        self._codes_cache = {}    # col -> (کدهای ردیف‌ها، مقادیر یکتای نرمال‌شده) برای فیلتر مقدار/الگو و شمارش
+        self._group_cache = {}    # ستون گروه -> GroupAggregator (پنل آمار گروهی)
+        self._row_by_code = None  # Index کد_داخلی -> موقعیت ردیف (row_by_code)
+        self._row_by_code_pos = None
+        self._search_tagged = []  # iid ردیف‌های برچسب‌خورده در آخرین search_live
+        self._search_term = ''    # عبارت آخرین search_live؛ پس از هر بار پر شدن جدول دوباره اعمال می‌شود
+        self._len_cache = {}      # col -> (کد یکتا، طول متن نمایشی، متن‌ها) برای عرض ستون‌ها
+        self._width_state = {}    # col -> متن‌های کاندید آخرین محاسبهٔ عرض
+        self.active_filters = []  # list of {'desc':..., 'func':..., 'enabled':True, 'mask':..., 'payload':...}
+        self.visible_columns = {col: True for col in list(self.base_df.columns)}
         saved_vis = settings_store.get('visible_columns', {})
         for c, v in saved_vis.items():
             self.visible_columns[c] = v
         self.on_update_callbacks = []
         self._sort_state = {}
+        self.prepare_hooks = list(prepare_hooks or [])
+        self._prepared_book = order_book
         # prepare data (compute derived cols) and build UI
         self._prepare_dataframe()
+        if persisted_filters:
+            self._reapply_persisted_filters(persisted_filters, refresh=False)
+            self._set_view(self._filtered_row_index())
         self._setup_columns(auto_optimize=True)
         self._create_context_menu()
         self.tag_configure('search_match', background='yellow')
         self.bind("<Button-3>", self._on_right_click)
         self._load_batch()
 
+    # ------------------------
+    # نمای فعلی روی مخزن base_df
+    # ------------------------
+    @property
+    def df(self):
+        """نمای فیلتر/مرتب‌شدهٔ فعلی؛ با برچسب ایندکس برابر موقعیت ردیف در base_df."""
+        if self._df_cache is None:
+            self._df_cache = self._materialize_view()
+        return self._df_cache
+
+    def _is_identity_view(self):
+        idx = self._row_index
+        n = len(self.base_df)
+        return len(idx) == n and (n == 0 or (idx[0] == 0 and idx[-1] == n - 1 and bool((np.diff(idx) == 1).all())))
+
+    def _materialize_view(self):
+        if self._is_identity_view():
+            return self.base_df
+        view = self.base_df.take(self._row_index)
+        if 'ردیف' in view.columns:
+            view['ردیف'] = np.arange(1, len(view) + 1)
+        return view
+
+    def _set_view(self, row_index):
+        self._row_index = np.asarray(row_index, dtype=np.int64)
+        self._df_cache = None
+
+    def _reset_view(self):
+        self._set_view(np.arange(len(self.base_df), dtype=np.int64))
+
+    def view_column(self, col):
+        """ستون col فقط برای ردیف‌های نمای فعلی (بدون ساختن کل نما)."""
+        s = self.base_df[col]
+        return s if self._is_identity_view() else s.take(self._row_index)
+
+    def numeric_column(self, col):
+        """ستون col روی کل base_df به صورت آرایهٔ float64 (NaN برای مقادیر غیرعددی)؛ یک بار در هر بارگذاری."""
+        arr = self._numeric_cache.get(col)
+        if arr is None:
+            arr = numeric_values(self.base_df[col])
+            self._numeric_cache[col] = arr
+        return arr
+
+    def _column_codes(self, col):
+        """
+        (codes, labels) ستون col روی کل base_df: labels مقادیر یکتای نرمال‌شده (Series متنی) و
+        codes موقعیت هر ردیف در labels. یک بار در هر بارگذاری داده محاسبه می‌شود.
+        """
+        hit = self._codes_cache.get(col)
+        if hit is None:
+            codes, uniques = pd.factorize(self.base_df[col], use_na_sentinel=False)
+            u = pd.Series(uniques, dtype=object).astype(str)
+            if col not in self._normalized_cols:
+                # چند مقدار خام ممکن است به یک مقدار نرمال‌شده برسند؛ دوباره روی یکتاها factorize می‌شود
+                ucodes, labels = pd.factorize(u.map(normalize_text))
+                codes = ucodes[codes]
+                u = pd.Series(labels, dtype=object)
+            hit = (np.asarray(codes, dtype=np.int64), u)
+            self._codes_cache[col] = hit
+        return hit
+
+    def column_value_counts(self, col):
+        """(labels, counts) مقادیر نرمال‌شدهٔ ستون col در نمای فعلی؛ فقط مقادیر با فراوانی غیرصفر."""
+        codes, labels = self._column_codes(col)
+        view_codes = codes if self._is_identity_view() else codes[self._row_index]
+        counts = np.bincount(view_codes, minlength=len(labels))
+        nz = np.flatnonzero(counts)
+        return labels.to_numpy(dtype=object)[nz], counts[nz]
+
+    def group_aggregates(self, group_col, value_cols=GROUP_VALUE_COLUMNS):
+        """
+        GroupAggregator ستون group_col به‌روزشده با نمای فعلی. کدهای گروه از _column_codes و ستون‌های
+        عددی از numeric_column می‌آیند؛ تغییر فیلتر فقط اختلاف ردیف‌ها را به جمع‌ها اعمال می‌کند.
+        """
+        agg = self._group_cache.get(group_col)
+        if agg is None:
+            codes, labels = self._column_codes(group_col)
+            values = {c: self.numeric_column(c) for c in value_cols if c in self.base_df.columns}
+            agg = GroupAggregator(codes, labels, values)
+            self._group_cache[group_col] = agg
+        return agg.update(self._row_index)
+
+    def rename_column(self, frm, to):
+        self.base_df.rename(columns={frm: to}, inplace=True)
+        if frm in self._numeric_cache:
+            self._numeric_cache[to] = self._numeric_cache.pop(frm)
+        if frm in self._codes_cache:
+            self._codes_cache[to] = self._codes_cache.pop(frm)
+        for cache in (self._len_cache, self._width_state):
+            if frm in cache:
+                cache[to] = cache.pop(frm)
+        self._group_cache.clear()
+        if frm in self._normalized_cols:
+            self._normalized_cols.discard(frm)
+            self._normalized_cols.add(to)
+        if frm in self.visible_columns:
+            self.visible_columns[to] = self.visible_columns.pop(frm)
+        self._df_cache = None
+
+    @pipeline_profiler.timed('_prepare_dataframe', rows=lambda self: len(self.base_df))
     def _prepare_dataframe(self):
-        """Normalize text columns and compute derived columns."""
-        for col in list(self.base_df.columns):
-            s = self.base_df[col].astype(str).fillna('')
-            s_norm = s.map(normalize_text)
-            self.base_df[col] = s_norm
-
-        # ارزش بازار همت = قیمت_پایانی * تعداد_کل_سهام / 1e13
-        if 'قیمت_پایانی' in self.base_df.columns and 'تعداد_کل_سهام' in self.base_df.columns:
+        """Normalize text columns in place and compute derived columns."""
+        self._numeric_cache = {}
+        self._codes_cache = {}
+        self._group_cache = {}
+        self._row_by_code = None
+        self._len_cache = {}
+        self._width_state = {}
+        # df آماده‌شده با parse_market_sharded دوباره نرمال نمی‌شود؛ فقط دفتر سفارشش تحویل گرفته می‌شود
+        book, self._prepared_book = self._prepared_book, None
+        if book is None or len(book) != len(self.base_df):
+            book = prepare_market_frame(self.base_df)
+        self._normalized_cols = {c for c in self.base_df.columns if c != 'ردیف'}
+        self._seed_order_book(book)
+
+        # ستون‌های مشتق بیرونی (مثلاً تاریخچهٔ درون‌روز)
+        for hook in self.prepare_hooks:
             try:
-                num_price = pd.to_numeric(self.base_df['قیمت_پایانی'], errors='coerce')
-                num_shares = pd.to_numeric(self.base_df['تعداد_کل_سهام'], errors='coerce')
-                mv = (num_price * num_shares) / 1e13
-                self.base_df['ارزش بازار همت'] = mv
+                hook(self.base_df)
             except Exception:
-                self.base_df['ارزش بازار همت'] = pd.NA
-
-        # PE = قیمت_آخرین_معامله / EPS
-        if 'قیمت_آخرین_معامله' in self.base_df.columns and 'EPS' in self.base_df.columns:
-            try:
-                num_last = pd.to_numeric(self.base_df['قیمت_آخرین_معامله'], errors='coerce')
-                num_eps = pd.to_numeric(self.base_df['EPS'], errors='coerce')
-                pe = num_last / num_eps.replace({0: pd.NA})
-                self.base_df['PE'] = pe
-            except Exception:
-                self.base_df['PE'] = pd.NA
-
-        # نوع_صنعت از گروه_صنعت
-        if 'گروه_صنعت' in self.base_df.columns:
-            def map_industry(x):
-                k = normalize_text(str(x)).strip()
-                if not k:
-                    return ''
-                m = re.match(r'^([A-Za-z0-9Xx]+)', k)
-                key = m.group(1) if m else k
-                key = key.strip()
-                if key.isdigit() and len(key) == 1:
-                    key = key.zfill(2)
-                return INDUSTRY_MAP.get(key, INDUSTRY_MAP.get(key.zfill(2), ''))
-            self.base_df['نوع_صنعت'] = self.base_df['گروه_صنعت'].apply(map_industry)
-
-        # صف خرید / صف فروش بر اساس S3 سطح 1 (محاسبه محافظه‌کارانه)
-        self.base_df['صف خرید'] = 0.0
-        self.base_df['صف فروش'] = 0.0
-
-        def get_s3_numeric(idx_name):
-            if idx_name in self.base_df.columns:
-                return pd.to_numeric(self.base_df[idx_name], errors='coerce')
-            for c in self.base_df.columns:
-                if c.lower() == idx_name.lower():
-                    return pd.to_numeric(self.base_df[c], errors='coerce')
-            return pd.Series([pd.NA] * len(self.base_df), index=self.base_df.index)
-
-        s_price_buyer_l1 = get_s3_numeric('S3_L1_C4')
-        s_price_seller_l1 = get_s3_numeric('S3_L1_C5')
-        s_vol_buyer_l1 = get_s3_numeric('S3_L1_C6')
-        s_vol_seller_l1 = get_s3_numeric('S3_L1_C7')
-
-        max_allowed = pd.to_numeric(self.base_df.get('حداکثر_قیمت_مجاز', pd.Series([pd.NA] * len(self.base_df))), errors='coerce')
-        min_allowed = pd.to_numeric(self.base_df.get('حداقل_قیمت_مجاز', pd.Series([pd.NA] * len(self.base_df))), errors='coerce')
-
-        try:
-            buy_series = pd.Series(0.0, index=self.base_df.index)
-            sell_series = pd.Series(0.0, index=self.base_df.index)
-            cond_buy = (s_price_buyer_l1.notna()) & (max_allowed.notna()) & (s_price_buyer_l1 == max_allowed)
-            buy_series.loc[cond_buy] = (s_vol_buyer_l1.loc[cond_buy].fillna(0).astype(float) * s_price_buyer_l1.loc[cond_buy].astype(float)).fillna(0)
-            cond_sell = (s_price_seller_l1.notna()) & (min_allowed.notna()) & (s_price_seller_l1 == min_allowed)
-            sell_series.loc[cond_sell] = (s_vol_seller_l1.loc[cond_sell].fillna(0).astype(float) * s_price_seller_l1.loc[cond_sell].astype(float)).fillna(0)
-            self.base_df['صف خرید'] = buy_series.fillna(0)
-            self.base_df['صف فروش'] = sell_series.fillna(0)
-        except Exception:
-            self.base_df['صف خرید'] = self.base_df['صف خرید'].fillna(0)
-            self.base_df['صف فروش'] = self.base_df['صف فروش'].fillna(0)
+                pass
 
-        # set df and normalized df
-        self.df = self.base_df.copy()
-        self.norm_df = self._build_normalized_df(self.df)
+        # نمای اولیه: همهٔ ردیف‌ها به ترتیب اصلی
+        self._reset_view()
 
-    def _build_normalized_df(self, df):
-        if df is None or df.empty:
-            return pd.DataFrame()
-        norm = pd.DataFrame(index=df.index)
-        for col in df.columns:
-            norm[col] = df[col].astype(str).fillna('').apply(normalize_text)
-        return norm
+    def _seed_order_book(self, book):
+        """
+        self.order_book همان آرایهٔ دفتر سفارش prepare_market_frame است؛ مقادیر عددی S3 همین حالا
+        در دست است و cache ستون‌های عددی از آن پر می‌شود.
+        """
+        self.order_book = book
+        if not any(str(c).lower().startswith('s3_l') for c in self.base_df.columns):
+            return
+        lower = {str(c).lower(): c for c in self.base_df.columns}
+        for lv in range(ORDER_BOOK_LEVELS):
+            for f in range(len(ORDER_BOOK_FIELDS)):
+                col = lower.get(f"s3_l{lv + 1}_c{f + 2}")
+                if col is not None:
+                    self._numeric_cache[col] = book[:, lv, f].copy()
 
     def _format_value_for_display(self, col, val):
         """فرمت نمایش برای ستون‌های خاص"""
@@ -526,24 +1473,71 @@ class AdvancedTreeview(ttk.Treeview):
                 return str(val)
         return '' if pd.isna(val) else str(val)
 
-    def _compute_optimal_widths(self, sample_rows=200, char_width=7, padding=20, max_width=600):
-        widths = {}
-        if self.df is None or self.df.empty:
-            return widths
-        sample = self.df.head(sample_rows).astype(str).fillna('')
-        for col in self.df.columns:
-            header_len = len(COLUMN_NAME_MAP.get(col, col))
+    def _display_lengths(self, col):
+        """
+        (codes, lengths, texts) ستون col روی کل base_df: متن نمایشی هر مقدار یکتا (همان قالب _load_batch)،
+        طول آن و کد یکتای هر ردیف. یک بار در هر بارگذاری ساخته می‌شود.
+        """
+        hit = self._len_cache.get(col)
+        if hit is None:
+            codes, uniques = pd.factorize(self.base_df[col], use_na_sentinel=False)
             if col in ('ارزش بازار همت', 'PE', 'صف خرید', 'صف فروش'):
-                sample_col = self.df[col].apply(lambda x: self._format_value_for_display(col, x)).astype(str)
+                texts = [self._format_value_for_display(col, v) for v in uniques]
             else:
-                sample_col = sample[col]
-            max_cell_len = sample_col.map(len).max() if not sample_col.empty else 0
-            est_chars = max(header_len, max_cell_len)
-            widths[col] = int(min(max(80, est_chars * char_width + padding), max_width))
+                texts = ['' if pd.isna(v) else str(v) for v in uniques]
+            lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+            hit = (np.asarray(codes, dtype=np.int64), lengths, texts)
+            self._len_cache[col] = hit
+        return hit
+
+    def _width_candidates(self, col, k=3):
+        """k متن بلندتر (بر حسب تعداد نویسه) در نمای فعلی؛ برای اندازه‌گیری واقعی با فونت."""
+        if col == 'ردیف':
+            return (str(len(self._row_index)),)
+        codes, lengths, texts = self._display_lengths(col)
+        if not len(lengths) or not len(self._row_index):
+            return ()
+        view_codes = codes if self._is_identity_view() else codes[self._row_index]
+        present = np.flatnonzero(np.bincount(view_codes, minlength=len(lengths)))
+        if len(present) > k:
+            present = present[np.argpartition(-lengths[present], k - 1)[:k]]
+        return tuple(sorted(texts[i] for i in present))
+
+    def _text_width(self, text, font_name="TkDefaultFont", char_width=7):
+        """عرض پیکسلی text با فونت font_name؛ نتیجه در _TEXT_WIDTH_CACHE نگه داشته می‌شود."""
+        key = (font_name, text)
+        w = _TEXT_WIDTH_CACHE.get(key)
+        if w is not None:
+            _TEXT_WIDTH_CACHE.move_to_end(key)
+            return w
+        try:
+            w = tkfont.nametofont(font_name).measure(text)
+        except Exception:
+            w = len(text) * char_width
+        _TEXT_WIDTH_CACHE[key] = w
+        if len(_TEXT_WIDTH_CACHE) > _TEXT_WIDTH_CACHE_SIZE:
+            _TEXT_WIDTH_CACHE.popitem(last=False)
+        return w
+
+    @pipeline_profiler.timed('_compute_optimal_widths', rows=lambda self: len(self._row_index))
+    def _compute_optimal_widths(self, padding=20, min_width=80, max_width=600, only_changed=False):
+        """
+        عرض ستون‌ها از روی چند متن بلند هر ستون (cache طول‌ها) و اندازه‌گیری واقعی فونت.
+        only_changed=True: فقط ستون‌هایی که متن‌های کاندیدشان نسبت به آخرین محاسبه عوض شده برگردانده می‌شوند.
+        """
+        widths = {}
+        for col in self.base_df.columns:
+            cands = self._width_candidates(col)
+            if only_changed and self._width_state.get(col) == cands:
+                continue
+            self._width_state[col] = cands
+            header = COLUMN_NAME_MAP.get(col, COLUMN_NAME_MAP.get(str(col).lower(), col))
+            w = max([self._text_width(str(header), "TkHeadingFont")] + [self._text_width(t) for t in cands])
+            widths[col] = int(min(max(min_width, w + padding), max_width))
         return widths
 
     def _setup_columns(self, auto_optimize=False):
-        cols = list(self.df.columns)
+        cols = list(self.base_df.columns)
         self["columns"] = cols
         if auto_optimize:
             widths = self._compute_optimal_widths()
@@ -557,36 +1551,91 @@ class AdvancedTreeview(ttk.Treeview):
             self.heading(col, text=header_text, command=lambda c=col: self._on_heading_click(c))
             self.column(col, width=widths.get(col, 120), anchor="center", stretch=False)
 
+    @op_profiler.profiled('sort')
     def _on_heading_click(self, col):
         asc = self._sort_state.get(col, True)
         self._sort_state[col] = not asc
+        values = self.view_column(col).reset_index(drop=True)
         try:
-            key_series = self.df[col].astype(str).apply(to_sort_key)
-            self.df = self.df.assign(_sort_col=key_series)
+            keys = values.astype(str).apply(to_sort_key)
+            order = keys.sort_values(ascending=asc, na_position='last', kind='mergesort').index.to_numpy()
         except Exception:
-            self.df = self.df.assign(_sort_col=self.df[col].astype(str).apply(normalize_text))
-        self.df = self.df.sort_values(by='_sort_col', ascending=asc, na_position='last').drop(columns=['_sort_col']).reset_index(drop=True)
-        if 'ردیف' in self.df.columns:
-            self.df['ردیف'] = range(1, len(self.df) + 1)
-        self.norm_df = self._build_normalized_df(self.df)
+            keys = values.astype(str).apply(normalize_text)
+            order = keys.sort_values(ascending=asc, na_position='last', kind='mergesort').index.to_numpy()
+        self._set_view(self._row_index[order])
         self._load_batch()
 
+    @pipeline_profiler.timed('_load_batch', rows=lambda self: len(self._row_index))
     def _load_batch(self):
         self.delete(*self.get_children())
-        if self.df is None or self.df.empty:
+        self._search_tagged = []
+        n = len(self._row_index)
+        if n == 0 or self.base_df.empty:
             return
-        cols = list(self.df.columns)
+        # ساخت مقادیر نمایشی ستون به ستون مستقیماً از base_df (بدون iterrows و بدون کپی نما)
+        col_values = []
+        for col in self.base_df.columns:
+            if col == 'ردیف':
+                col_values.append([str(i) for i in range(1, n + 1)])
+                continue
+            vals = self.base_df[col].to_numpy()[self._row_index]
+            if col in ('ارزش بازار همت', 'PE', 'صف خرید', 'صف فروش'):
+                col_values.append([self._format_value_for_display(col, v) for v in vals])
+            else:
+                col_values.append(['' if pd.isna(v) else str(v) for v in vals])
+        # iid هر ردیف = موقعیت آن در base_df (شناسهٔ پایدار در طول یک بارگذاری)
+        iids = self._row_index.astype(str).tolist()
         chunk = 500
-        rows = []
-        for _, row in self.df.iterrows():
-            display_row = []
-            for col in cols:
-                display_row.append(self._format_value_for_display(col, row[col]) if col in ('ارزش بازار همت','PE','صف خرید','صف فروش') else ('' if pd.isna(row[col]) else str(row[col])))
-            rows.append(tuple(display_row))
+        rows = list(zip(*col_values))
         for i in range(0, len(rows), chunk):
-            for r in rows[i:i+chunk]:
-                self.insert("", tk.END, values=r)
+            for iid, r in zip(iids[i:i+chunk], rows[i:i+chunk]):
+                self.insert("", tk.END, iid=iid, values=r)
             self.update_idletasks()
+        # برچسب جستجو روی ردیف‌های نمای تازه (پس از فیلتر/مرتب‌سازی) و به ترتیب همین نما
+        if self._search_term:
+            self._tag_search_matches(self._search_term)
+
+    # ------------------------
+    # نگاشت iid / کد_داخلی -> ردیف base_df
+    # ------------------------
+    def row_id(self, iid):
+        """موقعیت ردیف base_df برای iid جدول (None اگر iid از این بارگذاری نباشد)."""
+        try:
+            pos = int(iid)
+        except (TypeError, ValueError):
+            return None
+        return pos if 0 <= pos < len(self.base_df) else None
+
+    def selected_row_ids(self):
+        """موقعیت ردیف‌های انتخاب‌شده در base_df به ترتیب انتخاب."""
+        ids = (self.row_id(i) for i in self.selection())
+        return [i for i in ids if i is not None]
+
+    def value_at(self, iid, col, default=''):
+        """مقدار خام ستون col برای ردیف iid مستقیماً از base_df (مستقل از ستون‌های نمایشی و ردیف‌های بارشده)."""
+        pos = self.row_id(iid)
+        if pos is None or col not in self.base_df.columns:
+            return default
+        v = self.base_df[col].iat[pos]
+        return default if pd.isna(v) else v
+
+    def row_by_code(self, code):
+        """موقعیت ردیف با کد_داخلی برابر code (اولین مورد) یا None؛ نگاشت یک بار در هر بارگذاری ساخته می‌شود."""
+        if self._row_by_code is None:
+            if 'کد_داخلی' not in self.base_df.columns:
+                return None
+            keys = pd.Index(self.base_df['کد_داخلی'].astype(str).to_numpy(dtype=object))
+            self._row_by_code = keys[~keys.duplicated()]
+            self._row_by_code_pos = np.flatnonzero(~keys.duplicated())
+        loc = self._row_by_code.get_indexer([str(code).strip()])[0]
+        return None if loc < 0 else int(self._row_by_code_pos[loc])
+
+    def iid_for_code(self, code):
+        """iid ردیف کد_داخلی اگر در نمای فعلی بارگذاری شده باشد، وگرنه None."""
+        pos = self.row_by_code(code)
+        if pos is None or not self.exists(str(pos)):
+            return None
+        return str(pos)
 
     # ------------------------
     # Context menu and clipboard helpers
@@ -631,13 +1680,9 @@ class AdvancedTreeview(ttk.Treeview):
             pass
 
     def open_symbol_page(self):
-        sel = self.selection()
-        if not sel:
-            return
-        if "کد_داخلی" in self.df.columns:
-            vals = self.item(sel[0], 'values')
-            idx = list(self.df.columns).index("کد_داخلی")
-            code = vals[idx]
+        # چند ردیف انتخاب‌شده: صفحهٔ هر نماد (حداکثر 10 تا)
+        for pos in self.selected_row_ids()[:10]:
+            code = str(self.value_at(str(pos), 'کد_داخلی')).strip()
             if code:
                 webbrowser.open(f"https://www.tsetmc.com/instInfo/{code}")
 
@@ -645,14 +1690,10 @@ class AdvancedTreeview(ttk.Treeview):
         sel = self.selection()
         if not sel:
             return
-        vals = self.item(sel[0], 'values')
-        cols = list(self.df.columns)
-        if 'گروه_صنعت' not in cols or 'کد_بازار' not in cols:
+        if 'گروه_صنعت' not in self.base_df.columns or 'کد_بازار' not in self.base_df.columns:
             return
-        industry_idx = cols.index('گروه_صنعت')
-        market_idx = cols.index('کد_بازار')
-        industry_val = vals[industry_idx]
-        market_val = vals[market_idx]
+        industry_val = str(self.value_at(sel[0], 'گروه_صنعت'))
+        market_val = str(self.value_at(sel[0], 'کد_بازار'))
         try:
             market_num = int(str(market_val))
         except:
@@ -674,110 +1715,163 @@ class AdvancedTreeview(ttk.Treeview):
     # ------------------------
     # Filter management
     # ------------------------
-    def add_filter_record(self, desc, func, enabled=True, persist_payload=None, persist=True):
+    def add_filter_record(self, desc, func, enabled=True, persist_payload=None, persist=True, mask=None):
         """
         اضافه کردن فیلتر به لیست و در صورت نیاز ذخیرهٔ payload در settings_store
+        mask: تابع اختیاری mask(df) -> آرایهٔ بولی؛ فیلترهای ماسکی در یک گذر با هم ترکیب می‌شوند.
         """
-        self.active_filters.append({'desc': desc, 'func': func, 'enabled': bool(enabled)})
+        if func is None and mask is not None:
+            func = self._mask_to_func(mask)
+        self.active_filters.append({'desc': desc, 'func': func, 'enabled': bool(enabled),
+                                    'mask': mask, 'payload': persist_payload})
         if persist and persist_payload is not None:
             settings_store.setdefault('saved_filters_full', [])
             settings_store['saved_filters_full'].append(persist_payload)
             save_settings(settings_store)
         self.apply_all_filters()
 
-    def apply_all_filters(self):
-        df = self.base_df.copy()
+    def _reapply_persisted_filters(self, payloads, refresh=True):
+        """
+        بازسازی فیلترهای ذخیره‌شده: همهٔ payloadها یکجا کامپایل و به active_filters اضافه می‌شوند
+        (بدون ذخیرهٔ دوباره و بدون پر کردن جدول برای هر فیلتر). payload نامعتبر نادیده گرفته می‌شود
+        ولی در تنظیمات باقی می‌ماند.
+        """
+        for payload in payloads or []:
+            try:
+                desc, mask = self._compile_filter(payload)
+            except Exception:
+                continue
+            self.active_filters.append({'desc': desc, 'func': self._mask_to_func(mask), 'enabled': True,
+                                        'mask': mask, 'payload': payload})
+        if refresh:
+            self.apply_all_filters()
+
+    @staticmethod
+    def _mask_to_func(mask):
+        return lambda df: df[mask(df)]
+
+    def _filtered_row_index(self):
+        """
+        موقعیت ردیف‌های باقی‌مانده پس از همهٔ فیلترهای فعال.
+        ماسک‌ها روی base_df (بدون کپی) با AND ترکیب می‌شوند و فقط یک بار برش زده می‌شود؛
+        فیلترهای قدیمی تابعی (بدون mask) پس از آن روی نتیجه اجرا می‌شوند.
+        """
+        base = self.base_df
+        keep = np.ones(len(base), dtype=bool)
+        funcs = []
         for f in self.active_filters:
             if not f.get('enabled', True):
                 continue
+            mask = f.get('mask')
+            if mask is None:
+                funcs.append(f['func'])
+                continue
             try:
-                df = f['func'](df)
+                keep &= mask(base)
             except Exception:
                 pass
-        self.df = df.reset_index(drop=True)
-        if 'ردیف' in self.df.columns:
-            self.df['ردیف'] = range(1, len(self.df) + 1)
-        else:
-            self.df.insert(0, 'ردیف', range(1, len(self.df) + 1))
-        self.norm_df = self._build_normalized_df(self.df)
-        widths = self._compute_optimal_widths()
-        self.app_runtime_log.setdefault('column_widths', {}).update(widths)
+        df = base if keep.all() else base[keep]
+        for func in funcs:
+            try:
+                df = func(df)
+            except Exception:
+                pass
+        return df.index.to_numpy(dtype=np.int64)
+
+    @op_profiler.profiled('filter')
+    def apply_all_filters(self):
+        # فیلترها روی خود base_df (بدون کپی) اجرا می‌شوند؛ برچسب ایندکس خروجی همان موقعیت ردیف است
+        self._set_view(self._filtered_row_index())
+        # فقط ستون‌هایی که بلندترین متن‌هایشان با فیلتر عوض شده عرض تازه می‌گیرند
+        widths = self._compute_optimal_widths(only_changed=True)
+        if widths:
+            self.app_runtime_log.setdefault('column_widths', {}).update(widths)
         for col, w in widths.items():
             try:
                 self.column(col, width=int(w))
             except Exception:
                 pass
         self._load_batch()
+        # callbackها (آمار پایین، پنل گروهی، ...) از صف UI و ادغام‌شده اجرا می‌شوند؛
+        # چند تغییر فیلتر پشت سر هم فقط یک بار هر callback را اجرا می‌کند
         for cb in getattr(self, 'on_update_callbacks', []):
             try:
-                cb()
+                ui_dispatcher.post(cb, key=('tree_update', id(self), cb))
             except Exception:
                 pass
 
-    def add_value_filter(self, column, values, exclude=False):
-        if column not in self.base_df.columns:
+    def request_apply_filters(self):
+        """اعمال فیلترها در فریم بعدی UI؛ درخواست‌های پیاپی به یک بار پر کردن جدول ادغام می‌شوند."""
+        ui_dispatcher.post(self.apply_all_filters, key=('apply_filters', id(self)))
+
+    # ------------------------
+    # کامپایل payload فیلتر به تابع ماسک
+    # ------------------------
+    def _text_mask(self, df, col, predicate):
+        """
+        predicate فقط روی مقادیر یکتای نرمال‌شدهٔ ستون (از _column_codes) اجرا و نتیجه با کدها
+        به ردیف‌های df پخش می‌شود؛ برای ستون‌های کم‌تنوع مثل کد_بازار بسیار ارزان‌تر است.
+        """
+        codes, labels = self._column_codes(col)
+        hit = predicate(labels).to_numpy(dtype=bool, na_value=False)
+        if df is self.base_df:
+            return hit[codes]
+        return hit[codes[df.index.to_numpy(dtype=np.int64)]]
+
+    def _compile_filter(self, payload):
+        """payload ذخیره‌شده -> (desc, mask) که mask(df) آرایهٔ بولی هم‌طول df برمی‌گرداند."""
+        kind = payload.get('type')
+        if kind in ('value', 'pattern'):
+            column, predicate, exclude, desc = _text_payload_predicate(payload)
+            if column not in self.base_df.columns:
+                raise KeyError(column)
+            def mask(df):
+                m = self._text_mask(df, column, predicate)
+                return ~m if exclude else m
+            return desc, mask
+        if kind == 'relation':
+            left_col = payload['left']
+            op = payload['op']
+            right_expr = payload['right']
+            if left_col not in self.base_df.columns:
+                raise KeyError(left_col)
+            compare = _RELATION_OPS.get(op)
+            if compare is None:
+                raise ValueError(f"عملگر نامعتبر: {op}")
+            # هر دو طرف یک بار کامپایل می‌شوند؛ ستون‌های عددی از cache درخت خوانده می‌شوند
+            left = compile_expression(left_col, self.base_df.columns)
+            right = compile_expression(right_expr, self.base_df.columns)
+            def mask(df):
+                if df is self.base_df:
+                    get = self.numeric_column
+                else:
+                    pos = df.index.to_numpy(dtype=np.int64)
+                    get = lambda c: self.numeric_column(c)[pos]
+                L = np.broadcast_to(left.evaluate(get), (len(df),))
+                R = np.broadcast_to(right.evaluate(get), (len(df),))
+                with np.errstate(invalid='ignore'):
+                    m = compare(L, R)
+                return m & ~np.isnan(L) & ~np.isnan(R)
+            return f"رابطه: {left_col} {op} {right_expr}", mask
+        raise ValueError(f"نوع فیلتر ناشناخته: {kind}")
+
+    def _add_payload_filter(self, payload):
+        # ستون ناموجود نادیده گرفته می‌شود؛ عبارت نامعتبر (ValueError) به فراخواننده می‌رسد
+        try:
+            desc, mask = self._compile_filter(payload)
+        except KeyError:
             return
-        norm_values = [normalize_text(v) for v in values]
-        def func(df):
-            s = df[column].astype(str).apply(normalize_text)
-            mask = s.isin(norm_values)
-            return df[~mask] if exclude else df[mask]
-        desc = f"{column} {'شامل نشود' if exclude else 'شامل شود'}: {', '.join(values)}"
-        payload = {'type': 'value', 'column': column, 'values': values, 'exclude': bool(exclude)}
-        self.add_filter_record(desc, func, enabled=True, persist_payload=payload)
+        self.add_filter_record(desc, None, enabled=True, persist_payload=payload, mask=mask)
+
+    def add_value_filter(self, column, values, exclude=False):
+        self._add_payload_filter({'type': 'value', 'column': column, 'values': values, 'exclude': bool(exclude)})
 
     def add_pattern_filter(self, column, mode, text, length=None, exclude=False):
-        if column not in self.base_df.columns:
-            return
-        norm_text = normalize_text(text)
-        def func(df):
-            s = df[column].astype(str).apply(normalize_text)
-            if mode == 'start':
-                L = int(length) if length else len(norm_text)
-                mask = s.str[:L] == norm_text
-            elif mode == 'end':
-                L = int(length) if length else len(norm_text)
-                mask = s.str[-L:] == norm_text
-            else:
-                mask = s.str.contains(norm_text, na=False)
-            return df[~mask] if exclude else df[mask]
-        desc = f"{column} {'شامل نشود' if exclude else 'شامل شود'} الگو {mode}='{text}'"
-        payload = {'type': 'pattern', 'column': column, 'mode': mode, 'text': text, 'length': length, 'exclude': bool(exclude)}
-        self.add_filter_record(desc, func, enabled=True, persist_payload=payload)
+        self._add_payload_filter({'type': 'pattern', 'column': column, 'mode': mode, 'text': text, 'length': length, 'exclude': bool(exclude)})
 
     def add_relation_filter(self, left_col, op, right_expr):
-        def func(df):
-            L = pd.to_numeric(df[left_col], errors='coerce')
-            expr = right_expr
-            for c in df.columns:
-                expr = re.sub(r'\b' + re.escape(c) + r'\b', f"df['{c}']", expr)
-            try:
-                R = pd.eval(expr, engine='python')
-                R = pd.to_numeric(R, errors='coerce')
-            except Exception:
-                try:
-                    R = float(right_expr)
-                    R = pd.Series(R, index=df.index)
-                except Exception:
-                    R = pd.Series(pd.NA, index=df.index)
-            if op == '>':
-                mask = L > R
-            elif op == '<':
-                mask = L < R
-            elif op == '>=':
-                mask = L >= R
-            elif op == '<=':
-                mask = L <= R
-            elif op == '==':
-                mask = L == R
-            elif op == '!=':
-                mask = L != R
-            else:
-                mask = pd.Series(True, index=df.index)
-            return df[mask.fillna(False)]
-        desc = f"رابطه: {left_col} {op} {right_expr}"
-        payload = {'type': 'relation', 'left': left_col, 'op': op, 'right': right_expr}
-        self.add_filter_record(desc, func, enabled=True, persist_payload=payload)
+        """right_expr با compile_expression کامپایل می‌شود؛ در صورت نامعتبر بودن ValueError."""
+        self._add_payload_filter({'type': 'relation', 'left': left_col, 'op': op, 'right': right_expr})
 
     def clear_all_filters(self):
         self.active_filters.clear()
@@ -789,31 +1883,45 @@ class AdvancedTreeview(ttk.Treeview):
     # Search helper
     # ------------------------
     def search_live(self, term):
-        for iid in self.get_children():
-            self.item(iid, tags=())
+        self._search_term = term or ''
+        return self._tag_search_matches(self._search_term)
+
+    def _tag_search_matches(self, term):
+        # فقط ردیف‌هایی که در جستجوی قبلی برچسب خورده‌اند پاک می‌شوند (نه همهٔ ردیف‌های جدول)
+        for iid in self._search_tagged:
+            if self.exists(iid):
+                self.item(iid, tags=())
+        self._search_tagged = []
         if not term:
             return []
         t = normalize_text(term)
-        mask = pd.Series(False, index=self.norm_df.index)
-        for col in self.norm_df.columns:
-            try:
-                mask = mask | self.norm_df[col].astype(str).str.contains(t, na=False)
-            except Exception:
+        # همهٔ ستون‌ها (عددی و ستون‌های prepare_hooks هم) از روی متن مقادیر یکتای _column_codes جستجو
+        # می‌شوند؛ contains فقط روی یکتاها اجرا و با کدها به ردیف‌های نمای فعلی پخش می‌شود
+        mask = np.zeros(len(self._row_index), dtype=bool)
+        for col in self.base_df.columns:
+            if col == 'ردیف':
                 continue
-        matches = list(mask[mask].index)
-        items = self.get_children()
-        for i, iid in enumerate(items):
-            if i in matches:
+            codes, labels = self._column_codes(col)
+            hit = labels.str.contains(t, regex=False).to_numpy(dtype=bool)
+            if hit.any():
+                mask |= hit[codes if self._is_identity_view() else codes[self._row_index]]
+        matches = np.flatnonzero(mask).tolist()
+        for i in matches:
+            iid = str(self._row_index[i])
+            if self.exists(iid):
                 self.item(iid, tags=('search_match',))
+                self._search_tagged.append(iid)
         return matches
 
+    def search_match_iids(self):
+        """iid ردیف‌های بارشدهٔ منطبق با آخرین search_live به ترتیب نمای فعلی (فقط ردیف‌های موجود)."""
+        return [iid for iid in self._search_tagged if self.exists(iid)]
+
+    @op_profiler.profiled('export')
     def export_current_view_to_csv(self, filepath):
         try:
-            visible_cols = [c for c, v in self.visible_columns.items() if v]
-            export_df = self.df.copy()
-            for col in ('ارزش بازار همت', 'PE', 'صف خرید', 'صف فروش'):
-                if col in self.base_df.columns and col in export_df.columns:
-                    export_df[col] = self.base_df.loc[export_df.index, col]
+            visible_cols = [c for c, v in self.visible_columns.items() if v and c in self.base_df.columns]
+            export_df = self.df
             if visible_cols:
                 export_df.to_csv(filepath, index=False, encoding='utf-8-sig', columns=visible_cols)
             else:
@@ -833,7 +1941,7 @@ class BottomStatsTable(ttk.Treeview):
     با محافظت در برابر callback های after وقتی ویجت نابود شده باشد.
     """
     def __init__(self, parent, tree: AdvancedTreeview, visible_cols_for_bottom=None, **kwargs):
-        cols = ['متریک'] + (visible_cols_for_bottom if visible_cols_for_bottom is not None else list(tree.df.columns))
+        cols = ['متریک'] + (visible_cols_for_bottom if visible_cols_for_bottom is not None else list(tree.base_df.columns))
         super().__init__(parent, columns=cols, show='headings', **kwargs)
         self.tree = tree
         self.visible_cols_for_bottom = cols[1:]
@@ -867,6 +1975,10 @@ class BottomStatsTable(ttk.Treeview):
                 pass
 
     def refresh_debounced(self, delay=300):
+        # با صف UI فعال، درخواست‌های پیاپی همان‌جا ادغام می‌شوند و تأخیر ثابت لازم نیست
+        if ui_dispatcher.attached:
+            ui_dispatcher.post(self._compute_and_fill, key=('bottom_stats', id(self)))
+            return
         # لغو هر after قبلی و زمان‌بندی جدید
         try:
             if self._after_id:
@@ -1038,6 +2150,173 @@ class ScrollableToplevel(tk.Toplevel):
             self.canvas.yview_scroll(3, "units")
 
 
+# ------------------------
+# VirtualCheckList (لیست چک‌باکس مجازی با جستجوی لحظه‌ای)
+# ------------------------
+class VirtualCheckList(ttk.Frame):
+    """
+    لیست چک‌باکس روی یک Canvas که فقط ردیف‌های قابل مشاهده را رسم می‌کند؛ هزاران مقدار
+    بدون ساختن هزاران ویجت نمایش داده می‌شوند. کادر جستجو با هر کلید لیست را محدود می‌کند
+    و وضعیت انتخاب (آرایهٔ بولی) با محدودسازی از بین نمی‌رود.
+    """
+    def __init__(self, parent, height=400, on_change=None, **kwargs):
+        super().__init__(parent, **kwargs)
+        self.on_change = on_change
+        self._keys = []
+        self._key_series = pd.Series([], dtype=object)
+        self._labels = []
+        self._search = pd.Series([], dtype=object)
+        self._bold = np.zeros(0, dtype=bool)
+        self._checked = np.zeros(0, dtype=bool)
+        self._visible = np.zeros(0, dtype=np.int64)
+        self._top = 0
+        self.font = tkfont.nametofont("TkDefaultFont")
+        self.bold_font = self.font.copy(); self.bold_font.configure(weight="bold")
+        self.row_height = self.font.metrics('linespace') + 6
+
+        self.filter_var = tk.StringVar()
+        top = ttk.Frame(self); top.pack(fill='x', pady=(0, 4))
+        ttk.Label(top, text="جستجو:").pack(side='left')
+        self.filter_entry = ttk.Entry(top, textvariable=self.filter_var)
+        self.filter_entry.pack(side='left', fill='x', expand=True, padx=4)
+        ttk.Button(top, text="همه", width=6, command=lambda: self.set_visible_checked(True)).pack(side='left', padx=2)
+        ttk.Button(top, text="هیچ", width=6, command=lambda: self.set_visible_checked(False)).pack(side='left', padx=2)
+        self.count_label = ttk.Label(top, text="")
+        self.count_label.pack(side='right', padx=4)
+
+        body = ttk.Frame(self); body.pack(fill='both', expand=True)
+        self.canvas = tk.Canvas(body, height=height, highlightthickness=0, background='white')
+        self.vscroll = ttk.Scrollbar(body, orient='vertical', command=self._yview)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.vscroll.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.filter_var.trace_add('write', lambda *_: self._apply_filter())
+        self.canvas.bind("<Configure>", lambda e: self._redraw())
+        self.canvas.bind("<Button-1>", self._on_click)
+        self.canvas.bind("<MouseWheel>", self._on_wheel)
+        self.canvas.bind("<Button-4>", self._on_wheel)
+        self.canvas.bind("<Button-5>", self._on_wheel)
+
+    # ------------------------
+    # داده و انتخاب
+    # ------------------------
+    def set_items(self, keys, labels=None, bold=None, checked=False):
+        """
+        keys: مقادیر برگشتی checked_keys؛ labels: متن نمایشی (پیش‌فرض همان keys)؛
+        bold: ماسک بولی اختیاری؛ checked: وضعیت اولیهٔ همهٔ ردیف‌ها.
+        """
+        self._keys = list(keys)
+        self._key_series = pd.Series(self._keys, dtype=object)
+        self._labels = [str(x) for x in (labels if labels is not None else self._keys)]
+        self._search = pd.Series(self._labels, dtype=object).map(normalize_text).str.lower()
+        n = len(self._keys)
+        self._bold = np.zeros(n, dtype=bool) if bold is None else np.asarray(bold, dtype=bool)
+        self._checked = np.full(n, bool(checked), dtype=bool)
+        self._apply_filter()
+
+    def checked_keys(self):
+        return [self._keys[i] for i in np.flatnonzero(self._checked)]
+
+    def set_checked(self, keys, value=True):
+        self._checked[self._key_series.isin(list(keys)).to_numpy(dtype=bool)] = bool(value)
+        self._changed()
+
+    def set_all_checked(self, value=True):
+        self._checked[:] = bool(value)
+        self._changed()
+
+    def set_visible_checked(self, value=True):
+        """انتخاب/لغو انتخاب فقط ردیف‌هایی که با جستجوی فعلی دیده می‌شوند."""
+        self._checked[self._visible] = bool(value)
+        self._changed()
+
+    def see(self, key, emphasize=True):
+        """پیمایش لیست تا ردیف key (در نمای جستجوی فعلی) وسط دید باشد؛ emphasize آن را پررنگ می‌کند."""
+        hit = np.flatnonzero(self._key_series.eq(key).to_numpy(dtype=bool))
+        if not len(hit):
+            return False
+        pos = hit[0]
+        if emphasize:
+            self._bold[pos] = True
+        r = np.flatnonzero(self._visible == pos)
+        if len(r):
+            self._top = int(r[0]) - self._rows_on_screen() // 2
+        self._redraw()
+        return True
+
+    def _changed(self):
+        self._redraw()
+        if self.on_change:
+            try:
+                self.on_change()
+            except Exception:
+                pass
+
+    def _apply_filter(self):
+        term = normalize_text(self.filter_var.get()).lower()
+        if term:
+            hit = self._search.str.contains(term, regex=False, na=False).to_numpy(dtype=bool)
+            self._visible = np.flatnonzero(hit)
+        else:
+            self._visible = np.arange(len(self._keys), dtype=np.int64)
+        self._top = 0
+        self._redraw()
+
+    # ------------------------
+    # رسم و پیمایش
+    # ------------------------
+    def _rows_on_screen(self):
+        return max(1, self.canvas.winfo_height() // self.row_height)
+
+    def _redraw(self):
+        c = self.canvas
+        c.delete('all')
+        n = len(self._visible)
+        rows = self._rows_on_screen()
+        self._top = max(0, min(self._top, n - rows))
+        rh = self.row_height
+        size = rh - 10
+        for r, pos in enumerate(self._visible[self._top:self._top + rows + 1]):
+            y = r * rh + 5
+            c.create_rectangle(4, y, 4 + size, y + size, outline='#555555')
+            if self._checked[pos]:
+                c.create_line(6, y + size // 2, 4 + size // 2, y + size - 2, 2 + size, y + 2, width=2)
+            c.create_text(size + 12, y + size // 2, text=self._labels[pos], anchor='w',
+                          font=self.bold_font if self._bold[pos] else self.font)
+        if n:
+            self.vscroll.set(self._top / n, min(1.0, (self._top + rows) / n))
+        else:
+            self.vscroll.set(0.0, 1.0)
+        self.count_label.config(text=f"{int(self._checked.sum())} انتخاب / {n}")
+
+    def _yview(self, *args):
+        if not args:
+            return
+        if args[0] == 'moveto':
+            self._top = int(float(args[1]) * len(self._visible))
+        elif args[0] == 'scroll':
+            step = int(args[1])
+            self._top += step * self._rows_on_screen() if args[2] == 'pages' else step
+        self._redraw()
+
+    def _on_wheel(self, event):
+        if getattr(event, 'num', None) == 4:
+            self._top -= 3
+        elif getattr(event, 'num', None) == 5:
+            self._top += 3
+        elif event.delta:
+            self._top -= 3 * int(event.delta / 120)
+        self._redraw()
+        return "break"
+
+    def _on_click(self, event):
+        r = self._top + int(event.y // self.row_height)
+        if 0 <= r < len(self._visible):
+            pos = self._visible[r]
+            self._checked[pos] = not self._checked[pos]
+            self._changed()
+
+
 # ------------------------
 # ColumnSettingsDialog (فیلترها و تغییر نام ستون)
 # ------------------------
@@ -1050,7 +2329,6 @@ class ColumnSettingsDialog(ScrollableToplevel):
         super().__init__(parent, title="فیلترها", width=1400, height=900)
         self.parent = parent
         self.tree = tree
-        self.value_vars = []
         self.mode_var = tk.StringVar(value="include")
         self.pattern_text = tk.StringVar()
         self.pattern_mode = tk.StringVar(value="contains")
@@ -1077,25 +2355,15 @@ class ColumnSettingsDialog(ScrollableToplevel):
         self.col_listbox = tk.Listbox(left, exportselection=False, height=40, width=48)
         self.col_listbox.pack(fill='y', expand=True)
         self.col_index_to_key = []
-        for c in self.tree.df.columns:
+        for c in self.tree.base_df.columns:
             display = COLUMN_NAME_MAP.get(c, COLUMN_NAME_MAP.get(c.lower(), c))
             self.col_listbox.insert(tk.END, f"{display}  [{c}]")
             self.col_index_to_key.append(c)
         self.col_listbox.bind("<<ListboxSelect>>", self.on_col_select)
 
         ttk.Label(mid, text="مقادیر ستون (فراوانی)", font=("Tahoma", 11, "bold")).pack(anchor='w')
-        val_container = ttk.Frame(mid)
-        val_container.pack(fill='both', expand=True)
-        self.val_canvas = tk.Canvas(val_container, highlightthickness=0)
-        self.val_vscroll = ttk.Scrollbar(val_container, orient='vertical', command=self.val_canvas.yview)
-        self.val_canvas.configure(yscrollcommand=self.val_vscroll.set)
-        self.val_canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        self.val_vscroll.pack(side=tk.RIGHT, fill=tk.Y)
-        self.val_inner = ttk.Frame(self.val_canvas)
-        self.val_canvas.create_window((0,0), window=self.val_inner, anchor='nw')
-        self.val_inner.bind("<Configure>", lambda e: self.val_canvas.configure(scrollregion=self.val_canvas.bbox("all")))
-        self.val_canvas.bind("<Enter>", lambda e: self._bind_mousewheel(self.val_canvas))
-        self.val_canvas.bind("<Leave>", lambda e: self._unbind_mousewheel(self.val_canvas))
+        self.value_list = VirtualCheckList(mid, height=600)
+        self.value_list.pack(fill='both', expand=True)
 
         btn_frame = ttk.Frame(mid); btn_frame.pack(fill='x', pady=6)
         ttk.Radiobutton(btn_frame, text="Include", variable=self.mode_var, value="include").pack(side='left', padx=6)
@@ -1191,46 +2459,34 @@ class ColumnSettingsDialog(ScrollableToplevel):
         self.rename_from.insert(0, col)
 
     def _rebuild_values_list(self):
-        for w in self.val_inner.winfo_children():
-            w.destroy()
-        self.value_vars.clear()
         col = self.selected_column
-        if not col or col not in self.tree.df.columns:
+        if not col or col not in self.tree.base_df.columns:
+            self.value_list.set_items([])
             return
-        counts = self.tree.df[col].astype(str).map(normalize_text).value_counts(dropna=False)
-        items = list(counts.items())
+        # شمارش‌ها از کدهای cache شدهٔ جدول (یک factorize در هر بارگذاری) و bincount روی نمای فعلی
+        labels, counts = self.tree.column_value_counts(col)
         if self.sort_mode.get() == 'value':
-            def key_fn(x):
-                v = x[0]
-                try:
-                    return (0, float(v))
-                except:
-                    return (1, str(v))
-            items.sort(key=key_fn)
+            nums = pd.to_numeric(pd.Series(labels, dtype=object), errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+            is_text = np.isnan(nums)
+            order = np.lexsort((labels.astype(str), np.where(is_text, 0.0, nums), is_text))
         else:
-            items.sort(key=lambda x: (-x[1], str(x[0])))
-        default_font = tkfont.nametofont("TkDefaultFont")
-        bold_font = default_font.copy(); bold_font.configure(weight="bold")
-        for val, cnt in items:
-            label = "" if pd.isna(val) else str(val)
+            order = np.lexsort((labels.astype(str), -counts))
+        labels, counts = labels[order], counts[order]
+        is_market = (col == 'کد_بازار' or col.lower() == 'کد_بازار')
+        texts = []
+        for label, cnt in zip(labels, counts):
             display_label = label
-            if col == 'کد_بازار' or col.lower() == 'کد_بازار':
+            if is_market:
                 lbl = MARKET_LABELS.get(str(label), '')
                 display_label = f"{label} {lbl}" if lbl else label
-            var = tk.BooleanVar(value=False)
-            if col == 'کد_بازار' and str(label) in ('300', '303', '309', '313'):
-                cb_widget = tk.Checkbutton(self.val_inner, text=f"{display_label} ({cnt})", variable=var, font=bold_font, anchor='w')
-                cb_widget.pack(anchor='w', fill='x', padx=4, pady=1)
-                self.value_vars.append((label, var))
-            else:
-                cb = ttk.Checkbutton(self.val_inner, text=f"{display_label} ({cnt})", variable=var)
-                cb.pack(anchor='w', fill='x', padx=4, pady=1)
-                self.value_vars.append((label, var))
+            texts.append(f"{display_label} ({cnt})")
+        bold = np.isin(labels, ['300', '303', '309', '313']) if col == 'کد_بازار' else None
+        self.value_list.set_items(list(labels), texts, bold=bold)
 
     def apply_selected_values(self):
         if not self.selected_column:
             return
-        chosen = [val for (val, var) in self.value_vars if var.get()]
+        chosen = self.value_list.checked_keys()
         if not chosen:
             return
         exclude = (self.mode_var.get() == "exclude")
@@ -1258,7 +2514,11 @@ class ColumnSettingsDialog(ScrollableToplevel):
         right = self.right_expr_entry.get().strip()
         if not left or not op or not right:
             return
-        self.tree.add_relation_filter(left, op, right)
+        try:
+            self.tree.add_relation_filter(left, op, right)
+        except ValueError as e:
+            messagebox.showerror("عبارت نامعتبر", str(e), parent=self)
+            return
         self._refresh_filters_list()
 
     def apply_rename(self):
@@ -1268,14 +2528,10 @@ class ColumnSettingsDialog(ScrollableToplevel):
             return
         if frm in self.tree.base_df.columns:
             try:
-                # rename in base and current df
-                self.tree.base_df.rename(columns={frm: to}, inplace=True)
-                self.tree.df.rename(columns={frm: to}, inplace=True)
+                # rename in the shared base store (the view is rebuilt lazily); moves visibility flag too
+                self.tree.rename_column(frm, to)
             except Exception:
                 pass
-            # transfer visibility flag if present
-            if frm in self.tree.visible_columns:
-                self.tree.visible_columns[to] = self.tree.visible_columns.pop(frm)
             # update COLUMN_NAME_MAP and persist
             COLUMN_NAME_MAP[frm] = to
             settings_store['column_name_map'] = COLUMN_NAME_MAP
@@ -1283,7 +2539,7 @@ class ColumnSettingsDialog(ScrollableToplevel):
             # rebuild column listbox
             self.col_listbox.delete(0, tk.END)
             self.col_index_to_key.clear()
-            for c in self.tree.df.columns:
+            for c in self.tree.base_df.columns:
                 display = COLUMN_NAME_MAP.get(c, COLUMN_NAME_MAP.get(c.lower(), c))
                 self.col_listbox.insert(tk.END, f"{display}  [{c}]")
                 self.col_index_to_key.append(c)
@@ -1315,20 +2571,26 @@ class ColumnSettingsDialog(ScrollableToplevel):
     def _toggle_filter(self, index, enabled):
         if 0 <= index < len(self.tree.active_filters):
             self.tree.active_filters[index]['enabled'] = bool(enabled)
-            self.tree.apply_all_filters()
+            self.tree.request_apply_filters()
             self._refresh_filters_list()
 
     def _remove_filter(self, index):
         if 0 <= index < len(self.tree.active_filters):
-            del self.tree.active_filters[index]
-            # also remove from persisted list by index (best-effort)
-            if settings_store.get('saved_filters_full'):
+            rec = self.tree.active_filters.pop(index)
+            # حذف payload همان فیلتر از لیست ذخیره‌شده (نه بر اساس شماره؛ فیلترهای بدون payload ذخیره نشده‌اند)
+            payload = rec.get('payload')
+            saved = settings_store.get('saved_filters_full') or []
+            if payload is not None:
                 try:
-                    del settings_store['saved_filters_full'][index]
-                    save_settings(settings_store)
+                    pos = next((i for i, p in enumerate(saved) if p is payload), None)
+                    if pos is None and payload in saved:
+                        pos = saved.index(payload)
+                    if pos is not None:
+                        del saved[pos]
+                        save_settings(settings_store)
                 except Exception:
                     pass
-            self.tree.apply_all_filters()
+            self.tree.request_apply_filters()
             self._refresh_filters_list()
 
     def _clear_all_filters(self):
@@ -1384,7 +2646,7 @@ class AppSettingsDialog(ScrollableToplevel):
 
         self.col_vars_main = {}
         self.col_vars_bottom = {}
-        cols = list(self.app.current_tree.df.columns) if getattr(self.app, 'current_tree', None) else []
+        cols = list(self.app.current_tree.base_df.columns) if getattr(self.app, 'current_tree', None) else []
         for col in cols:
             var = tk.BooleanVar(value=self.app.current_tree.visible_columns.get(col, True) if getattr(self.app, 'current_tree', None) else True)
             cb = ttk.Checkbutton(cb_inner1, text=COLUMN_NAME_MAP.get(col, COLUMN_NAME_MAP.get(col.lower(), col)), variable=var)
@@ -1407,6 +2669,84 @@ class AppSettingsDialog(ScrollableToplevel):
         ttk.Button(btn_frame, text="ذخیره URL", command=self.save_url).pack(side='right', padx=6)
         ttk.Button(btn_frame, text="بستن", command=self.destroy).pack(side='right', padx=6)
 
+        # سرور محلی فقط‌خواندنی snapshot (snapshot_server.py)؛ فقط روی 127.0.0.1
+        api_frame = ttk.Frame(frame)
+        api_frame.grid(row=5, column=0, columnspan=2, sticky='ew', padx=8, pady=(0,8))
+        self.api_enabled_var = tk.BooleanVar(value=bool(settings_store.get('api_server_enabled', False)))
+        ttk.Checkbutton(api_frame, text="سرور محلی API (HTTP/WebSocket)", variable=self.api_enabled_var).pack(side='left')
+        ttk.Label(api_frame, text="پورت:").pack(side='left', padx=(12,4))
+        self.api_port_var = tk.StringVar(value=str(settings_store.get('api_port', 8765)))
+        ttk.Entry(api_frame, textvariable=self.api_port_var, width=8).pack(side='left')
+        self.shm_enabled_var = tk.BooleanVar(value=bool(settings_store.get('shm_enabled', False)))
+        ttk.Checkbutton(api_frame, text="انتشار در حافظهٔ مشترک", variable=self.shm_enabled_var).pack(side='left', padx=(12,0))
+        ttk.Button(api_frame, text="اعمال", command=self.apply_api_server).pack(side='left', padx=6)
+
+        # حالت پروفایل: ضبط cProfile/tracemalloc دور refresh، فیلتر، مرتب‌سازی، جستجو و خروجی
+        prof_frame = ttk.Frame(frame)
+        prof_frame.grid(row=6, column=0, columnspan=2, sticky='ew', padx=8, pady=(0,8))
+        self.profiling_var = tk.BooleanVar(value=op_profiler.enabled)
+        ttk.Checkbutton(prof_frame, text="حالت پروفایل (cProfile + tracemalloc، فقط همین اجرا)", variable=self.profiling_var,
+                        command=self.apply_profiling).pack(side='left')
+        self.profiling_dir_label = ttk.Label(prof_frame, text="", foreground="#555")
+        self.profiling_dir_label.pack(side='left', padx=8)
+        self._update_profiling_label()
+
+        # پارس و آماده‌سازی دیدبان در چند پردازه (parse_market_sharded)؛ 0 یعنی تعداد هسته‌ها
+        par_frame = ttk.Frame(frame)
+        par_frame.grid(row=7, column=0, columnspan=2, sticky='ew', padx=8, pady=(0,8))
+        self.parallel_var = tk.BooleanVar(value=bool(settings_store.get('parallel_parse', False)))
+        ttk.Checkbutton(par_frame, text="پارس موازی دیدبان (چند پردازه)", variable=self.parallel_var).pack(side='left')
+        ttk.Label(par_frame, text="تعداد پردازه:").pack(side='left', padx=(12,4))
+        self.workers_var = tk.StringVar(value=str(settings_store.get('parse_workers', 0)))
+        ttk.Spinbox(par_frame, from_=0, to=max(1, os.cpu_count() or 1), textvariable=self.workers_var, width=5).pack(side='left')
+        ttk.Button(par_frame, text="اعمال", command=self.apply_parallel_parse).pack(side='left', padx=6)
+
+    def _update_profiling_label(self):
+        try:
+            d = op_profiler.output_dir or os.path.join(os.path.dirname(os.path.abspath(SETTINGS_FILE)), 'profiles')
+            self.profiling_dir_label.config(text=f"پوشهٔ خروجی: {d}  ({len(op_profiler.files)} فایل در این اجرا)")
+        except Exception:
+            pass
+
+    def apply_parallel_parse(self):
+        try:
+            workers = max(0, int(self.workers_var.get() or 0))
+        except ValueError:
+            messagebox.showerror("خطا", "تعداد پردازه نامعتبر است", parent=self)
+            return
+        settings_store['parallel_parse'] = bool(self.parallel_var.get())
+        settings_store['parse_workers'] = workers
+        save_settings(settings_store)
+        if settings_store['parallel_parse']:
+            warm_market_pool(workers or None)
+        else:
+            shutdown_market_pool()
+
+    def apply_profiling(self):
+        op_profiler.enabled = bool(self.profiling_var.get())
+        self._update_profiling_label()
+
+    def apply_api_server(self):
+        try:
+            port = int(self.api_port_var.get())
+        except ValueError:
+            port = 0
+        if not 0 < port < 65536:
+            messagebox.showerror("خطا", "پورت نامعتبر است (1 تا 65535)", parent=self)
+            return
+        settings_store['api_server_enabled'] = bool(self.api_enabled_var.get())
+        settings_store['api_port'] = port
+        settings_store['shm_enabled'] = bool(self.shm_enabled_var.get())
+        save_settings(settings_store)
+        if hasattr(self.app, 'configure_api_server'):
+            err = self.app.configure_api_server()
+            if err:
+                messagebox.showerror("خطا در راه‌اندازی سرور", err, parent=self)
+        if hasattr(self.app, 'configure_shm_publisher'):
+            err = self.app.configure_shm_publisher()
+            if err:
+                messagebox.showerror("خطا در حافظهٔ مشترک", err, parent=self)
+
     def apply_visibility_changes(self):
         if getattr(self.app, 'current_tree', None):
             for col, var in self.col_vars_main.items():
@@ -1420,7 +2760,7 @@ class AppSettingsDialog(ScrollableToplevel):
 
         selected_bottom = [c for c, var in self.col_vars_bottom.items() if var.get()]
         if not selected_bottom and getattr(self.app, 'current_tree', None):
-            selected_bottom = list(self.app.current_tree.df.columns)
+            selected_bottom = list(self.app.current_tree.base_df.columns)
         settings_store['bottom_visible_columns'] = selected_bottom
         save_settings(settings_store)
 
@@ -1450,4 +2790,266 @@ class AppSettingsDialog(ScrollableToplevel):
             save_settings(settings_store)
 
 
+# ------------------------
+# ProfilingPanel (زمان مراحل خط لوله)
+# ------------------------
+class ProfilingPanel(tk.Toplevel):
+    """
+    نمایش زمان مراحل آخرین به‌روزرسانی و آمار تجمعی هر مرحله از pipeline_profiler.
+    """
+    STAGE_COLS = ('مرحله', 'ثانیه', 'ردیف', 'بایت')
+    SUMMARY_COLS = ('مرحله', 'تعداد', 'آخرین', 'میانگین', 'بیشینه', 'جمع')
+
+    def __init__(self, parent, profiler: PipelineProfiler = None):
+        super().__init__(parent)
+        self.title("پروفایل مراحل بارگذاری")
+        self.geometry("760x560")
+        self.profiler = profiler or pipeline_profiler
+        frame = ttk.Frame(self, padding=8); frame.pack(fill=tk.BOTH, expand=True)
+        self.run_label = ttk.Label(frame, text="", font=("Tahoma", 10, "bold"))
+        self.run_label.pack(anchor='w')
+        self.stage_table = self._make_table(frame, self.STAGE_COLS, height=9)
+        ttk.Label(frame, text="آمار تجمعی (تاریخچهٔ چرخشی)", font=("Tahoma", 10, "bold")).pack(anchor='w', pady=(8,0))
+        self.summary_table = self._make_table(frame, self.SUMMARY_COLS, height=9)
+        self.frame_label = ttk.Label(frame, text="")
+        self.frame_label.pack(anchor='w')
+        btns = ttk.Frame(frame); btns.pack(fill='x', pady=(6,0))
+        ttk.Button(btns, text="تازه‌سازی", command=self.refresh).pack(side='left', padx=4)
+        ttk.Button(btns, text="بستن", command=self.destroy).pack(side='right', padx=4)
+        self.refresh()
+
+    def _make_table(self, parent, cols, height):
+        table = ttk.Treeview(parent, columns=cols, show='headings', height=height)
+        for i, c in enumerate(cols):
+            table.heading(c, text=c)
+            table.column(c, width=200 if i == 0 else 90, anchor='w' if i == 0 else 'center', stretch=False)
+        table.pack(fill='both', expand=True, pady=4)
+        return table
+
+    def refresh(self):
+        for table in (self.stage_table, self.summary_table):
+            table.delete(*table.get_children())
+        run = self.profiler.last_run()
+        if run:
+            self.run_label.config(text=f"آخرین اجرا: {run.get('started', '')}   کل: {run.get('total_seconds', '')} ثانیه")
+            for rec in run.get('stages', []):
+                self.stage_table.insert('', 'end', values=(rec.get('stage', ''), rec.get('seconds', ''),
+                                                           '' if rec.get('rows') is None else rec['rows'],
+                                                           '' if rec.get('bytes') is None else rec['bytes']))
+        else:
+            self.run_label.config(text="هنوز اجرایی ثبت نشده است")
+        for name, st in sorted(self.profiler.summary().items(), key=lambda x: -x[1]['total']):
+            self.summary_table.insert('', 'end', values=(name, st['count'], st['last'], st['mean'], st['max'], st['total']))
+        fs = ui_dispatcher.frame_stats()
+        if fs.get('frames'):
+            self.frame_label.config(text=(f"فریم‌های UI: {fs['frames']}  میانگین {fs['mean_ms']} ms  p95 {fs['p95_ms']} ms  "
+                                          f"بیشینه {fs['max_ms']} ms  بیش از بودجه {fs['over_budget']}  "
+                                          f"بیشینهٔ تأخیر {fs['max_lag_ms']} ms  ادغام‌شده {fs['coalesced']}"))
+        else:
+            self.frame_label.config(text="فریم‌های UI: هنوز کاری در صف اجرا نشده است")
+
+
+# ------------------------
+# پنل هشدارها (قواعد و رویدادها)
+# ------------------------
+class AlertsPanel(tk.Toplevel):
+    """
+    مدیریت قواعد alert_engine و نمایش رویدادهای اخیر. قاعدهٔ جدید از فیلترهای فعال جدول جاری
+    (همان payloadهای add_*_filter) ساخته می‌شود و در settings_store['alert_rules'] ذخیره می‌شود.
+    """
+    RULE_COLS = ('نام', 'فعال', 'شرط‌ها', 'نمادهای برقرار')
+    EVENT_COLS = ('زمان', 'قاعده', 'نماد')
+
+    def __init__(self, parent, engine: AlertEngine = None, tree=None):
+        super().__init__(parent)
+        self.title("هشدارها")
+        self.geometry("760x600")
+        self.engine = engine or alert_engine
+        self.tree = tree
+        frame = ttk.Frame(self, padding=8); frame.pack(fill=tk.BOTH, expand=True)
+        ttk.Label(frame, text="قواعد", font=("Tahoma", 10, "bold")).pack(anchor='w')
+        self.rule_table = self._make_table(frame, self.RULE_COLS, height=8)
+        add_row = ttk.Frame(frame); add_row.pack(fill='x', pady=(2,0))
+        ttk.Label(add_row, text="نام قاعده:").pack(side='left')
+        self.name_var = tk.StringVar()
+        ttk.Entry(add_row, textvariable=self.name_var, width=30).pack(side='left', padx=4)
+        ttk.Button(add_row, text="افزودن از فیلترهای فعال", command=self.add_from_filters).pack(side='left', padx=4)
+        ttk.Button(add_row, text="فعال/غیرفعال", command=self.toggle_selected).pack(side='left', padx=4)
+        ttk.Button(add_row, text="حذف", command=self.remove_selected).pack(side='left', padx=4)
+        ttk.Label(frame, text="رویدادهای اخیر", font=("Tahoma", 10, "bold")).pack(anchor='w', pady=(8,0))
+        self.event_table = self._make_table(frame, self.EVENT_COLS, height=12)
+        btns = ttk.Frame(frame); btns.pack(fill='x', pady=(6,0))
+        ttk.Button(btns, text="تازه‌سازی", command=self.refresh).pack(side='left', padx=4)
+        ttk.Button(btns, text="پاک کردن رویدادها", command=self.clear_events).pack(side='left', padx=4)
+        ttk.Button(btns, text="بستن", command=self.destroy).pack(side='right', padx=4)
+        self.refresh()
+
+    def _make_table(self, parent, cols, height):
+        table = ttk.Treeview(parent, columns=cols, show='headings', height=height)
+        for i, c in enumerate(cols):
+            table.heading(c, text=c)
+            table.column(c, width=320 if c == 'شرط‌ها' else (200 if i == 0 else 90),
+                         anchor='w' if i == 0 or c == 'شرط‌ها' else 'center', stretch=False)
+        table.pack(fill='both', expand=True, pady=4)
+        return table
+
+    def _save_rules(self, rules):
+        self.engine.set_rules(rules)
+        settings_store['alert_rules'] = self.engine.rules
+        save_settings(settings_store)
+        self.refresh()
+
+    def add_from_filters(self):
+        tree = self.tree
+        payloads = [f['payload'] for f in getattr(tree, 'active_filters', []) if f.get('enabled') and f.get('payload')] if tree else []
+        if not payloads:
+            messagebox.showinfo("هشدار جدید", "ابتدا شرط‌ها را به صورت فیلتر روی جدول اعمال کنید", parent=self)
+            return
+        name = self.name_var.get().strip() or f"قاعده {len(self.engine.rules) + 1}"
+        self._save_rules(self.engine.rules + [{'name': name, 'conditions': payloads, 'enabled': True}])
+        self.name_var.set("")
+
+    def _selected_indexes(self):
+        return sorted(int(iid) for iid in self.rule_table.selection())
+
+    def toggle_selected(self):
+        rules = [dict(r) for r in self.engine.rules]
+        for i in self._selected_indexes():
+            rules[i]['enabled'] = not rules[i].get('enabled', True)
+        self._save_rules(rules)
+
+    def remove_selected(self):
+        drop = set(self._selected_indexes())
+        self._save_rules([r for i, r in enumerate(self.engine.rules) if i not in drop])
+
+    def clear_events(self):
+        self.engine.events.clear()
+        self.refresh()
+
+    def refresh(self):
+        for table in (self.rule_table, self.event_table):
+            table.delete(*table.get_children())
+        counts = list(self.engine.active_counts().values())
+        for i, rule in enumerate(self.engine.rules):
+            name = rule.get('name') or f"قاعده {i + 1}"
+            conds = []
+            for p in rule.get('conditions') or []:
+                try:
+                    conds.append(_text_payload_predicate(p)[3] if p.get('type') in ('value', 'pattern')
+                                 else f"{p.get('left')} {p.get('op')} {p.get('right')}")
+                except Exception:
+                    conds.append(str(p))
+            err = self.engine.errors.get(name)
+            self.rule_table.insert('', 'end', iid=str(i), values=(name, 'بله' if rule.get('enabled', True) else 'خیر',
+                                                                  ' و '.join(conds), f"خطا: {err}" if err else counts[i]))
+        for ev in reversed(self.engine.events):
+            self.event_table.insert('', 'end', values=(ev['time'], ev['rule'], ev['symbol']))
+
+
+# ------------------------
+# پنل آمار گروهی (صنعت / کد بازار)
+# ------------------------
+class GroupStatsPanel(tk.Toplevel):
+    """
+    جمع ارزش معاملات، ارزش بازار، صف‌ها و تعداد نمادها به تفکیک یک ستون گروه روی نمای فعلی جدول.
+    با هر تغییر فیلتر (on_update_callbacks) فقط اختلاف ردیف‌ها در tree.group_aggregates اعمال می‌شود.
+    """
+    GROUP_COLUMNS = ('نوع_صنعت', 'گروه_صنعت', 'کد_بازار')
+
+    def __init__(self, parent, tree: AdvancedTreeview):
+        super().__init__(parent)
+        self.title("آمار گروهی")
+        self.geometry("900x520")
+        self.tree = tree
+        self._after_id = None
+        frame = ttk.Frame(self, padding=8); frame.pack(fill=tk.BOTH, expand=True)
+        top = ttk.Frame(frame); top.pack(fill='x')
+        ttk.Label(top, text="گروه‌بندی بر اساس:").pack(side='left')
+        choices = [c for c in self.GROUP_COLUMNS if c in tree.base_df.columns]
+        self.group_var = tk.StringVar(value=choices[0] if choices else '')
+        combo = ttk.Combobox(top, textvariable=self.group_var, values=choices, state='readonly', width=20)
+        combo.pack(side='left', padx=6)
+        combo.bind("<<ComboboxSelected>>", lambda _e: self.refresh())
+        self.combo = combo
+        self.info_label = ttk.Label(top, text="")
+        self.info_label.pack(side='left', padx=10)
+        ttk.Button(top, text="بستن", command=self.destroy).pack(side='right')
+        self.table = ttk.Treeview(frame, show='headings')
+        ysb = ttk.Scrollbar(frame, orient='vertical', command=self.table.yview)
+        self.table.configure(yscrollcommand=ysb.set)
+        ysb.pack(side='right', fill='y')
+        self.table.pack(fill='both', expand=True, pady=4)
+        if self.refresh_debounced not in tree.on_update_callbacks:
+            tree.on_update_callbacks.append(self.refresh_debounced)
+        self.bind("<Destroy>", self._on_destroy, add=True)
+        self.refresh()
+
+    def _on_destroy(self, event):
+        if event.widget is not self:
+            return
+        try:
+            self.tree.on_update_callbacks.remove(self.refresh_debounced)
+        except (ValueError, AttributeError):
+            pass
+
+    def set_tree(self, tree: AdvancedTreeview):
+        """اتصال پنل به جدول تازه (مثلاً پس از refresh که تب‌ها از نو ساخته می‌شوند)."""
+        if tree is None or tree is self.tree:
+            return
+        try:
+            self.tree.on_update_callbacks.remove(self.refresh_debounced)
+        except (ValueError, AttributeError):
+            pass
+        self.tree = tree
+        choices = [c for c in self.GROUP_COLUMNS if c in tree.base_df.columns]
+        self.combo.configure(values=choices)
+        if self.group_var.get() not in choices:
+            self.group_var.set(choices[0] if choices else '')
+        if self.refresh_debounced not in tree.on_update_callbacks:
+            tree.on_update_callbacks.append(self.refresh_debounced)
+        self.refresh()
+
+    def refresh_debounced(self, delay=200):
+        if ui_dispatcher.attached:
+            ui_dispatcher.post(self.refresh, key=('group_stats', id(self)))
+            return
+        try:
+            if self._after_id:
+                self.after_cancel(self._after_id)
+            self._after_id = self.after(delay, self.refresh)
+        except Exception:
+            self._after_id = None
+
+    @staticmethod
+    def _fmt(col, v):
+        if col.startswith('جمع '):
+            if 'ارزش بازار همت' in col:
+                return f"{v:.1f}"
+            return f"{v:,.0f}"
+        return str(v)
+
+    def refresh(self):
+        self._after_id = None
+        col = self.group_var.get()
+        if not col or col not in self.tree.base_df.columns:
+            return
+        try:
+            agg = self.tree.group_aggregates(col)
+            table = agg.table()
+        except Exception as e:
+            self.info_label.config(text=f"خطا: {e}")
+            return
+        cols = list(table.columns)
+        if tuple(self.table['columns']) != tuple(cols):
+            self.table.configure(columns=cols)
+            for i, c in enumerate(cols):
+                self.table.heading(c, text=c)
+                self.table.column(c, width=180 if i == 0 else 120, anchor='w' if i == 0 else 'center', stretch=False)
+        self.table.delete(*self.table.get_children())
+        for row in table.itertuples(index=False):
+            self.table.insert('', 'end', values=[row[0]] + [self._fmt(c, v) for c, v in zip(cols[1:], row[1:])])
+        mode = 'افزایشی' if agg.last_update['mode'] == 'delta' else 'کامل'
+        self.info_label.config(text=f"{len(table)} گروه، {int(agg.count.sum())} نماد  (به‌روزرسانی {mode}: {agg.last_update['rows']} ردیف)")
+
+
 # پایان بخش دوم
@@ -0,0 +1,413 @@
+# market_frame.py
+# لایهٔ دادهٔ دیدبان بدون وابستگی به tkinter و تنظیمات: نرمال‌سازی متن، پارس ردیف‌های بخش 2/3،
+# دفتر سفارش، آماده‌سازی ستون‌های مشتق (prepare_market_frame) و کار هر تکه در پارس موازی.
+# import این ماژول هیچ فایلی نمی‌خواند یا نمی‌نویسد؛ به همین دلیل پروسه‌های کاری ProcessPoolExecutor
+# (parse_market_sharded در core) توابع را از همین‌جا اجرا می‌کنند. core همهٔ نام‌های عمومی را دوباره صادر می‌کند.
+
+import re
+
+import numpy as np
+import pandas as pd
+
+# ------------------------
+# نرمال‌سازی متن (حروف عربی -> فارسی، ارقام فارسی -> لاتین، حذف نیم‌فاصله)
+# ------------------------
+ARABIC_TO_PERSIAN = {
+    'ي': 'ی', 'ى': 'ی', 'ك': 'ک', 'ﻻ': 'لا', 'ة': 'ه',
+    'ؤ': 'و', 'إ': 'ا', 'أ': 'ا', 'آ': 'ا',
+    'ئ': 'ی', '\u200c': '', '\u0640': ''
+}
+PERSIAN_DIGITS = str.maketrans('۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩', '01234567890123456789')
+_ar_re = re.compile('|'.join(map(re.escape, ARABIC_TO_PERSIAN.keys())))
+
+def normalize_text(s):
+    """نرمال‌سازی متن فارسی/عربی و ارقام؛ خروجی رشتهٔ تمیز شده."""
+    if s is None:
+        return ''
+    s = str(s)
+    s = _ar_re.sub(lambda m: ARABIC_TO_PERSIAN[m.group(0)], s)
+    s = s.translate(PERSIAN_DIGITS)
+    s = s.replace('\u200c', ' ').strip()
+    s = re.sub(r'\s+', ' ', s)
+    return s
+
+# ------------------------
+# کدگذاری دیکشنری (categorical) ستون‌های متنی تکراری
+# ------------------------
+# ستون‌هایی که مقدارهای تکراری زیادی دارند؛ هنگام پارس به categorical تبدیل می‌شوند
+CATEGORICAL_COLUMNS = ('نماد', 'نام_شرکت', 'گروه_صنعت', 'نوع_صنعت', 'کد_بازار', 'بازار_اصلی', 'دسته_بندی_تخصصی')
+
+
+def map_unique(s: pd.Series, fn, categorical=False) -> pd.Series:
+    """
+    fn فقط یک بار برای هر مقدار یکتای s اجرا و نتیجه با کدهای factorize به ردیف‌ها پخش می‌شود.
+    categorical=True: خروجی categorical (یکتاهایی که پس از fn یکی می‌شوند در یک category ادغام می‌شوند).
+    """
+    codes, uniques = pd.factorize(s, use_na_sentinel=False)
+    mapped = pd.Series(uniques, dtype=object).astype(str).fillna('').map(fn)
+    if categorical:
+        ucodes, labels = pd.factorize(mapped, use_na_sentinel=False)
+        cat = pd.Categorical.from_codes(ucodes[codes], categories=pd.Index(labels, dtype=object))
+        return pd.Series(cat, index=s.index, name=s.name)
+    return pd.Series(mapped.to_numpy(dtype=object)[codes], index=s.index, name=s.name)
+
+
+def encode_categorical_columns(df: pd.DataFrame, columns=CATEGORICAL_COLUMNS) -> pd.DataFrame:
+    """ستون‌های columns (در صورت وجود) در جا به categorical نرمال‌شده تبدیل می‌شوند."""
+    for c in columns:
+        if c in df.columns:
+            df[c] = map_unique(df[c], normalize_text, categorical=True)
+    return df
+
+
+def numeric_values(s: pd.Series) -> np.ndarray:
+    """آرایهٔ float64 یک ستون (NaN برای غیرعددی)؛ ستون categorical فقط روی categoryها تبدیل می‌شود."""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        cats = pd.to_numeric(pd.Series(s.cat.categories, dtype=object), errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+        codes = s.cat.codes.to_numpy()
+        if not len(cats):
+            return np.full(len(s), np.nan)
+        return np.where(codes >= 0, cats[codes], np.nan)
+    return pd.to_numeric(s, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+# ------------------------
+# نگاشت صنایع
+# ------------------------
+INDUSTRY_MAP_LIST = [
+    ['01', 'زراعت و خدمات وابسته'], ['02', 'جنگلداري و ماهيگيري'],
+    ['10', 'استخراج زغال سنگ'], ['11', 'استخراج نفت گاز و خدمات جنبي جز اکتشاف'],
+    ['13', 'استخراج کانه هاي فلزي'], ['14', 'استخراج ساير معادن'],
+    ['15', 'حذف شده- فرآورده‌هاي غذايي و آشاميدني'], ['17', 'منسوجات'],
+    ['19', 'دباغي، پرداخت چرم و ساخت انواع پاپوش'], ['20', 'محصولات چوبي'],
+    ['21', 'محصولات كاغذي'], ['22', 'انتشار، چاپ و تکثير'],
+    ['23', 'فراورده هاي نفتي، كک و سوخت هسته اي'], ['24', 'حذف شده-مواد و محصولات شيميايي'],
+    ['25', 'لاستيك و پلاستيك'], ['26', 'توليد محصولات كامپيوتري الكترونيكي ونوري'],
+    ['27', 'فلزات اساسي'], ['28', 'ساخت محصولات فلزي'],
+    ['29', 'ماشين آلات و تجهيزات'], ['31', 'ماشين آلات و دستگاه‌هاي برقي'],
+    ['32', 'ساخت دستگاه‌ها و وسايل ارتباطي'], ['33', 'ابزارپزشکي، اپتيکي و اندازه‌گيري'],
+    ['34', 'خودرو و ساخت قطعات'], ['35', 'ساير تجهيزات حمل و نقل'],
+    ['36', 'مبلمان و مصنوعات ديگر'], ['38', 'قند و شكر'],
+    ['39', 'شرکتهاي چند رشته اي صنعتي'], ['40', 'عرضه برق، گاز، بخاروآب گرم'],
+    ['41', 'جمع آوري، تصفيه و توزيع آب'], ['42', 'محصولات غذايي و آشاميدني به جز قند و شكر'],
+    ['43', 'مواد و محصولات دارويي'], ['44', 'محصولات شيميايي'],
+    ['45', 'پيمانكاري صنعتي'], ['46', 'تجارت عمده فروشي به جز وسايل نقليه موتور'],
+    ['47', 'خرده فروشي،باستثناي وسايل نقليه موتوري'], ['49', 'كاشي و سراميك'],
+    ['50', 'تجارت عمده وخرده فروشي وسائط نقليه موتور'], ['51', 'حمل و نقل هوايي'],
+    ['52', 'انبارداري و حمايت از فعاليتهاي حمل و نقل'], ['53', 'سيمان، آهك و گچ'],
+    ['54', 'ساير محصولات كاني غيرفلزي'], ['55', 'هتل و رستوران'],
+    ['56', 'سرمايه گذاريها'], ['57', 'بانكها و موسسات اعتباري'],
+    ['58', 'ساير واسطه گريهاي مالي'], ['59', 'اوراق حق تقدم استفاده از تسهيلات مسكن'],
+    ['60', 'حمل ونقل، انبارداري و ارتباطات'], ['61', 'حمل و نقل آبی'],
+    ['63', 'فعاليت های پشتیبانی و کمکی حمل و نقل'], ['64', 'مخابرات'],
+    ['65', 'واسطه‌گری‌های مالی و پولی'], ['66', 'بیمه وصندوق بازنشستگی به جز تامین اجتماعی'],
+    ['67', 'فعالیت‌هاي کمکی به نهادهای مالی واسط'], ['68', 'صندوق سرمایه گذاری قابل معامله'],
+    ['69', 'اوراق تامین مالی'], ['70', 'انبوه سازی، املاک و مستغلات'],
+    ['71', 'فعالیت مهندسی، تجزیه، تحلیل و آزمایش فنی'], ['72', 'رایانه و فعالیت‌های وابسته به آن'],
+    ['73', 'اطلاعات و ارتباطات'], ['74', 'خدمات فنی و مهندسی'],
+    ['76', 'اوراق بهادار مبتنی بر دارایی فکری'], ['77', 'فعالبت های اجاره و لیزینگ'],
+    ['80', 'تبلیغات و بازارپژوهی'], ['82', 'فعالیت پشتیبانی اجرائی اداری و حمایت کسب'],
+    ['84', 'سلامت انسان و مددکاری اجتماعی'], ['90', 'فعالیت های هنری، سرگرمی و خلاقانه'],
+    ['93', 'فعالیت‌های فرهنگی و ورزشی'], ['98', 'گروه اوراق غیر فعال'],
+    ['X1', 'شاخص']
+]
+INDUSTRY_MAP = {k: v for k, v in INDUSTRY_MAP_LIST}
+
+
+# ------------------------
+# پارس ردیف‌های یک بخش و ادغام بخش 3 (S3)
+# ------------------------
+def _parse_section_rows(section_text, mapping):
+    rows = [r for r in section_text.split(';') if r.strip()]
+    data = []
+    for i, row in enumerate(rows):
+        fields = row.split(',')
+        rec = {'ردیف': i+1}
+        if mapping:
+            for idx, name in mapping.items():
+                rec[name] = fields[idx] if idx < len(fields) else ''
+        else:
+            for j, val in enumerate(fields):
+                rec[f"ستون{j}"] = val
+        data.append(rec)
+    if not data:
+        return pd.DataFrame()
+    df = pd.DataFrame(data)
+    if mapping:
+        encode_categorical_columns(df)
+    return df
+
+
+def _s3_column_names():
+    return [f"S3_L{lv}_C{j}" for lv in range(1, ORDER_BOOK_LEVELS + 1) for j in range(2, 8)]
+
+def _merge_section3_rows(df2, df3):
+    if df2 is None or df3 is None or df2.empty or df3.empty:
+        return df2.copy() if df2 is not None else pd.DataFrame()
+    key_df3 = 'ستون0'
+    key_df2 = 'کد_داخلی' if 'کد_داخلی' in df2.columns else ('ستون0' if 'ستون0' in df2.columns else None)
+    if key_df2 is None or key_df3 not in df3.columns:
+        return df2.copy()
+    block_cols = [f'ستون{i}' for i in range(2, 8)]
+    for c in block_cols:
+        if c not in df3.columns:
+            df3[c] = ''
+    level_col = 'ستون1'
+    if level_col not in df3.columns:
+        df3[level_col] = ''
+    # بدون حلقه روی ردیف‌ها: هر ردیف بخش 3 با (کلید، سطح) در آرایهٔ نمادها × 5 سطح × 6 فیلد جا می‌گیرد
+    k3 = df3[key_df3].astype(str).str.strip()
+    lv_str = df3[level_col].astype(str).str.strip()
+    valid = (k3 != '') & lv_str.str.fullmatch(r'\d+').fillna(False).astype(bool)
+    lv = pd.to_numeric(lv_str.where(valid), errors='coerce')
+    valid &= lv.between(1, ORDER_BOOK_LEVELS)
+    k3 = k3[valid]
+    lv = lv[valid].to_numpy(dtype=np.int64) - 1
+    slot_keys = pd.Index(k3.to_numpy(dtype=object)).unique()
+    slots = slot_keys.get_indexer(k3.to_numpy(dtype=object))
+    blocks = np.empty((len(slot_keys) + 1, ORDER_BOOK_LEVELS, len(block_cols)), dtype=object)
+    blocks[:] = ''
+    # ردیف تکراری (کلید و سطح یکسان): مثل قبل آخرین ردیف معتبر است
+    blocks[slots, lv, :] = df3.loc[valid, block_cols].to_numpy(dtype=object)
+    k2 = df2[key_df2].astype(str).str.strip().to_numpy(dtype=object)
+    pos = slot_keys.get_indexer(k2)
+    pos[pos < 0] = len(slot_keys)  # ردیف خالی انتهای blocks
+    extra_df = pd.DataFrame(blocks[pos].reshape(len(k2), -1), columns=_s3_column_names())
+    merged = pd.concat([df2.reset_index(drop=True), extra_df], axis=1)
+    return merged
+
+# ------------------------
+# دفتر سفارش (بخش 3) به صورت آرایهٔ عددی نمادها × سطح × فیلد و شاخص‌های عمق
+# ------------------------
+ORDER_BOOK_LEVELS = 5
+# ترتیب فیلدها همان ستون‌های C2..C7 بخش 3 است
+ORDER_BOOK_FIELDS = ('تعداد فروشنده', 'تعداد خریدار', 'قیمت خریدار', 'قیمت فروشنده', 'حجم خریدار', 'حجم فروشنده')
+_OB_BID_PRICE, _OB_ASK_PRICE, _OB_BID_VOL, _OB_ASK_VOL = 2, 3, 4, 5
+
+
+def order_book_from_frame(df: pd.DataFrame) -> np.ndarray:
+    """
+    آرایهٔ float64 با شکل (تعداد ردیف، 5، 6) از ستون‌های S3_L{lv}_C{2..7} (نام بزرگ/کوچک فرقی ندارد).
+    سطح یا ستون ناموجود و مقدار غیرعددی NaN است.
+    """
+    n = len(df)
+    book = np.full((n, ORDER_BOOK_LEVELS, len(ORDER_BOOK_FIELDS)), np.nan)
+    lower = {str(c).lower(): c for c in df.columns}
+    for lv in range(ORDER_BOOK_LEVELS):
+        for f in range(len(ORDER_BOOK_FIELDS)):
+            col = lower.get(f"s3_l{lv + 1}_c{f + 2}")
+            if col is not None:
+                book[:, lv, f] = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    return book
+
+
+def order_book_metrics(book: np.ndarray, max_allowed=None, min_allowed=None) -> dict:
+    """
+    شاخص‌های عمق بازار برای همهٔ نمادها به صورت برداری:
+    ارزش تجمعی سفارش‌های خرید/فروش در 5 سطح، اسپرد سطح 1 (درصد از میانه)، نسبت عدم تعادل
+    (خرید - فروش) / (خرید + فروش)، و صف خرید/فروش (ارزش سطح 1 وقتی قیمت روی سقف/کف مجاز است).
+    """
+    n = book.shape[0]
+    bid_p, ask_p = book[:, :, _OB_BID_PRICE], book[:, :, _OB_ASK_PRICE]
+    bid_value = np.nansum(bid_p * book[:, :, _OB_BID_VOL], axis=1)
+    ask_value = np.nansum(ask_p * book[:, :, _OB_ASK_VOL], axis=1)
+    bid1, ask1 = bid_p[:, 0], ask_p[:, 0]
+    max_allowed = np.full(n, np.nan) if max_allowed is None else np.asarray(max_allowed, dtype=np.float64)
+    min_allowed = np.full(n, np.nan) if min_allowed is None else np.asarray(min_allowed, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mid = (bid1 + ask1) / 2.0
+        spread = np.where((bid1 > 0) & (ask1 > 0), (ask1 - bid1) / mid * 100.0, np.nan)
+        total = bid_value + ask_value
+        imbalance = np.where(total > 0, (bid_value - ask_value) / total, np.nan)
+        buy_queue_at = bid1 == max_allowed
+        sell_queue_at = ask1 == min_allowed
+    buy_queue = np.where(buy_queue_at, np.nan_to_num(book[:, 0, _OB_BID_VOL]) * bid1, 0.0)
+    sell_queue = np.where(sell_queue_at, np.nan_to_num(book[:, 0, _OB_ASK_VOL]) * ask1, 0.0)
+    return {
+        'bid_value': bid_value, 'ask_value': ask_value, 'spread_pct': spread, 'imbalance': imbalance,
+        'buy_queue': np.nan_to_num(buy_queue), 'sell_queue': np.nan_to_num(sell_queue),
+        'buy_queue_flag': buy_queue_at, 'sell_queue_flag': sell_queue_at,
+    }
+
+
+# ------------------------
+# FIELD_MAPPING نمونه برای بخش 2
+# ------------------------
+FIELD_MAPPING = {
+    0: "کد_داخلی",
+    1: "کد_بین_المللی",
+    2: "نماد",
+    3: "نام_شرکت",
+    4: "زمان_آخرین_معامله",
+    5: "اولین_قیمت",
+    6: "قیمت_پایانی",
+    7: "قیمت_آخرین_معامله",
+    8: "تعداد_معاملات",
+    9: "حجم_معاملات",
+    10: "ارزش_معاملات",
+    11: "کمترین_قیمت",
+    12: "بیشترین_قیمت",
+    13: "قیمت_دیروز",
+    14: "EPS",
+    15: "حجم_مبنا",
+    16: "تعداد_بازدید_کننده",
+    17: "بازار_اصلی",
+    18: "گروه_صنعت",
+    19: "حداکثر_قیمت_مجاز",
+    20: "حداقل_قیمت_مجاز",
+    21: "تعداد_کل_سهام",
+    22: "کد_بازار",
+    23: "NAV",
+    24: "موقعیت_های_باز",
+    25: "دسته_بندی_تخصصی"
+}
+
+# ------------------------
+# آماده‌سازی دیدبان (نرمال‌سازی و ستون‌های مشتق) بدون وابستگی به ویجت
+# ------------------------
+def _map_industry(x):
+    k = normalize_text(str(x)).strip()
+    if not k:
+        return ''
+    m = re.match(r'^([A-Za-z0-9Xx]+)', k)
+    key = m.group(1) if m else k
+    key = key.strip()
+    if key.isdigit() and len(key) == 1:
+        key = key.zfill(2)
+    return INDUSTRY_MAP.get(key, INDUSTRY_MAP.get(key.zfill(2), ''))
+
+def prepare_market_frame(df: pd.DataFrame) -> np.ndarray:
+    """
+    نرمال‌سازی متن ستون‌ها و افزودن ستون‌های مشتق (ارزش بازار، PE، نوع صنعت، شاخص‌های دفتر سفارش) در جا.
+    خروجی: دفتر سفارش عددی (order_book_from_frame). تابع خالص است و در پردازهٔ کاری هم اجرا می‌شود.
+    """
+    # نرمال‌سازی برای هر مقدار یکتا یک بار؛ ستون‌های تکراری (CATEGORICAL_COLUMNS) categorical می‌مانند
+    for col in list(df.columns):
+        if col == 'ردیف':
+            continue
+        s = df[col]
+        categorical = col in CATEGORICAL_COLUMNS or isinstance(s.dtype, pd.CategoricalDtype)
+        df[col] = map_unique(s, normalize_text, categorical=categorical)
+
+    # ارزش بازار همت = قیمت_پایانی * تعداد_کل_سهام / 1e13
+    if 'قیمت_پایانی' in df.columns and 'تعداد_کل_سهام' in df.columns:
+        try:
+            num_price = pd.to_numeric(df['قیمت_پایانی'], errors='coerce')
+            num_shares = pd.to_numeric(df['تعداد_کل_سهام'], errors='coerce')
+            df['ارزش بازار همت'] = (num_price * num_shares) / 1e13
+        except Exception:
+            df['ارزش بازار همت'] = pd.NA
+
+    # PE = قیمت_آخرین_معامله / EPS
+    if 'قیمت_آخرین_معامله' in df.columns and 'EPS' in df.columns:
+        try:
+            num_last = pd.to_numeric(df['قیمت_آخرین_معامله'], errors='coerce')
+            num_eps = pd.to_numeric(df['EPS'], errors='coerce')
+            df['PE'] = num_last / num_eps.replace({0: pd.NA})
+        except Exception:
+            df['PE'] = pd.NA
+
+    # نوع_صنعت از گروه_صنعت
+    if 'گروه_صنعت' in df.columns:
+        df['نوع_صنعت'] = map_unique(df['گروه_صنعت'], _map_industry, categorical=True)
+
+    # دفتر سفارش بخش 3 به صورت آرایهٔ عددی (ردیف × سطح × فیلد) و شاخص‌های عمق از روی آن
+    n = len(df)
+    book = order_book_from_frame(df)
+    try:
+        max_allowed = numeric_values(df['حداکثر_قیمت_مجاز']) if 'حداکثر_قیمت_مجاز' in df.columns else None
+        min_allowed = numeric_values(df['حداقل_قیمت_مجاز']) if 'حداقل_قیمت_مجاز' in df.columns else None
+        m = order_book_metrics(book, max_allowed, min_allowed)
+    except Exception:
+        df['صف خرید'] = np.zeros(n)
+        df['صف فروش'] = np.zeros(n)
+        return book
+    df['صف خرید'] = m['buy_queue']
+    df['صف فروش'] = m['sell_queue']
+    if not any(str(c).lower().startswith('s3_l') for c in df.columns):
+        return book
+    df['ارزش سفارش خرید 5 سطح'] = m['bid_value']
+    df['ارزش سفارش فروش 5 سطح'] = m['ask_value']
+    df['اسپرد (%)'] = np.round(m['spread_pct'], 2)
+    df['عدم تعادل سفارش‌ها'] = np.round(m['imbalance'], 3)
+    df['وضعیت صف'] = np.where(m['buy_queue_flag'], 'صف خرید', np.where(m['sell_queue_flag'], 'صف فروش', ''))
+    return book
+
+
+# ------------------------
+# تکه‌های پارس موازی (اجرا در پروسه‌های کاری ProcessPoolExecutor)
+# ------------------------
+def _split_market_rows(section2, section3, shards):
+    """
+    ردیف‌های بخش 2 به shards تکهٔ پیوسته تقسیم می‌شوند و هر ردیف بخش 3 به تکهٔ صاحب کدش می‌رود.
+    خروجی: [(متن بخش 2، متن بخش 3، شمارهٔ اولین ردیف)]
+    """
+    rows2 = [r for r in section2.split(';') if r.strip()]
+    bounds = np.linspace(0, len(rows2), shards + 1).astype(int)
+    owner = {}
+    for s in range(shards):
+        for r in rows2[bounds[s]:bounds[s + 1]]:
+            owner.setdefault(r.split(',', 1)[0].strip(), set()).add(s)
+    rows3 = [[] for _ in range(shards)]
+    for r in (section3 or '').split(';'):
+        if r.strip():
+            for s in owner.get(r.split(',', 1)[0].strip(), ()):
+                rows3[s].append(r)
+    return [(';'.join(rows2[bounds[s]:bounds[s + 1]]), ';'.join(rows3[s]), int(bounds[s])) for s in range(shards)]
+
+def _prepare_market_shard(args):
+    """کار هر پردازه: پارس، ادغام بخش 3 و prepare_market_frame روی یک تکه؛ خروجی (df، دفتر سفارش)."""
+    text2, text3, offset, mapping, with_section3 = args
+    df = _parse_section_rows(text2, mapping)
+    if df.empty:
+        return df, np.full((0, ORDER_BOOK_LEVELS, len(ORDER_BOOK_FIELDS)), np.nan)
+    df['ردیف'] = np.arange(offset + 1, offset + 1 + len(df))
+    if with_section3:
+        df3 = _parse_section_rows(text3, None) if text3.strip() else pd.DataFrame()
+        if df3.empty:
+            # تکهٔ بدون ردیف بخش 3 همان ستون‌های خالی S3 را می‌گیرد تا با بقیهٔ تکه‌ها یکسان باشد
+            df = pd.concat([df.reset_index(drop=True),
+                            pd.DataFrame('', index=range(len(df)), columns=_s3_column_names(), dtype=object)], axis=1)
+        else:
+            df = _merge_section3_rows(df, df3)
+    return df, prepare_market_frame(df)
+
+def _concat_shards(frames):
+    """
+    به هم چسباندن تکه‌ها؛ categoryهای ستون‌های categorical به ترتیب اولین ظهور ادغام و کدها بازنگاشت
+    می‌شوند تا خروجی همان dtype پارس یکجا را داشته باشد.
+    """
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    out = {}
+    for col in frames[0].columns:
+        parts = [f[col] for f in frames]
+        if any(isinstance(p.dtype, pd.CategoricalDtype) for p in parts):
+            parts = [p if isinstance(p.dtype, pd.CategoricalDtype) else p.astype('category') for p in parts]
+            cats = pd.Index(np.concatenate([p.cat.categories.to_numpy(dtype=object) for p in parts]), dtype=object).unique()
+            codes = []
+            for p in parts:
+                local = p.cat.codes.to_numpy()
+                remap = cats.get_indexer(p.cat.categories)
+                c = np.full(len(local), -1, dtype=np.int64)
+                c[local >= 0] = remap[local[local >= 0]]
+                codes.append(c)
+            out[col] = pd.Series(pd.Categorical.from_codes(np.concatenate(codes), categories=cats), name=col)
+        else:
+            out[col] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(out)
+
+
+def _warm_worker(_):
+    """کار خالی برای بالا آوردن پروسه‌های pool پیش از اولین refresh موازی."""
+    return True
+
+
+__all__ = [
+    "normalize_text", "CATEGORICAL_COLUMNS", "map_unique", "encode_categorical_columns", "numeric_values",
+    "INDUSTRY_MAP", "FIELD_MAPPING", "ORDER_BOOK_LEVELS", "ORDER_BOOK_FIELDS",
+    "order_book_from_frame", "order_book_metrics", "prepare_market_frame"
+]
@@ -0,0 +1,266 @@
+# shm_snapshot.py
+# انتشار ستون‌های عددی snapshot دیدبان در یک قطعهٔ حافظهٔ مشترک نام‌دار برای پردازه‌های محلی دیگر.
+# این ماژول به tkinter و core وابسته نیست؛ خواننده فقط numpy (و برای to_frame، pandas) لازم دارد.
+#
+# ساختار قطعه:
+#   header (64 بایت، little-endian):
+#     magic 8s | seq u64 | version u64 | rows u64 | cols u32 | schema_len u32 | data_offset u64 | retired u32 | pad u32 | published f64
+#   schema: JSON (utf-8) {"key": {...}, "columns": [{"name", "dtype", "offset"}, ...]}
+#   data: آرایه‌های ستونی پشت سر هم (کلید int64 و بقیهٔ ستون‌ها float64)
+#
+# سازگاری خواندن با seqlock: نویسنده پیش از نوشتن seq را فرد و پس از آن زوج می‌کند؛ خواننده اگر seq فرد
+# یا قبل و بعد از کپی متفاوت باشد دوباره می‌خواند. اگر جای قطعه کم باشد نویسنده قطعهٔ قبلی را retired
+# علامت می‌زند و قطعهٔ بزرگ‌تری با همان نام می‌سازد؛ خواننده با دیدن retired دوباره attach می‌کند.
+#
+# نمونهٔ استفاده در پردازهٔ دیگر:
+#   from shm_snapshot import SharedSnapshotReader
+#   with SharedSnapshotReader("tse2_market") as r:
+#       version, key, cols = r.read()          # cols: {نام ستون: np.ndarray}
+#       df = r.to_frame()                       # همان به صورت DataFrame با ایندکس کد_داخلی
+
+from __future__ import annotations
+
+import sys
+import json
+import time
+import struct
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_NAME = "tse2_market"
+MAGIC = b"TSESNAP1"
+HEADER = struct.Struct("<8sQQQIIQIId")
+HEADER_SIZE = 64
+KEY_COLUMN = "کد_داخلی"
+_OWNED = set()  # نام قطعه‌هایی که همین پردازه ساخته است (ثبت resource_tracker آن‌ها دست نمی‌خورد)
+# ستون‌های عددی پیش‌فرض دیدبان (ستون‌های ناموجود نادیده گرفته می‌شوند)
+DEFAULT_COLUMNS = (
+    "اولین_قیمت", "قیمت_پایانی", "قیمت_آخرین_معامله", "تعداد_معاملات", "حجم_معاملات", "ارزش_معاملات",
+    "کمترین_قیمت", "بیشترین_قیمت", "قیمت_دیروز", "EPS", "حجم_مبنا", "حداکثر_قیمت_مجاز", "حداقل_قیمت_مجاز",
+    "تعداد_کل_سهام", "NAV", "ارزش بازار همت", "PE", "صف خرید", "صف فروش",
+    "ارزش سفارش خرید 5 سطح", "ارزش سفارش فروش 5 سطح", "اسپرد (%)", "عدم تعادل سفارش‌ها",
+)
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """attach بدون ثبت در resource_tracker (تا خروج خواننده قطعهٔ نویسنده را unlink نکند)."""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    if name in _OWNED:
+        return shm
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+
+def _key_array(values) -> np.ndarray:
+    out = np.full(len(values), -1, dtype=np.int64)
+    for i, v in enumerate(values):
+        try:
+            out[i] = int(str(v).strip())
+        except ValueError:
+            pass
+    return out
+
+# ------------------------
+# نویسنده (در برنامهٔ اصلی)
+# ------------------------
+class SharedSnapshotWriter:
+    """
+    publish(df) ستون‌های عددی df را در قطعهٔ name می‌نویسد. numeric(col) اختیاری است و آرایهٔ float64
+    ستون را برمی‌گرداند (مثلاً AdvancedTreeview.numeric_column که cache دارد)؛ پیش‌فرض pd.to_numeric.
+    """
+    def __init__(self, name: str = DEFAULT_NAME, columns: Iterable[str] = DEFAULT_COLUMNS, key: str = KEY_COLUMN):
+        self.name = name
+        self.columns = list(columns)
+        self.key = key
+        self.version = 0
+        self._shm: Optional[shared_memory.SharedMemory] = None
+
+    def _ensure_capacity(self, size: int) -> None:
+        if self._shm is not None and self._shm.size >= size:
+            return
+        old, self._shm = self._shm, None
+        if old is not None:
+            self._write_header(old, retired=1)
+            old.close()
+            try:
+                old.unlink()
+            except FileNotFoundError:
+                pass
+        size = max(size * 3 // 2, 1 << 16)  # جای رشد تعداد نمادها/ستون‌ها
+        try:
+            self._shm = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+            _OWNED.add(self.name)
+        except FileExistsError:
+            # باقی‌ماندهٔ اجرای قبلی؛ حذف و ساخت دوباره
+            try:
+                stale = shared_memory.SharedMemory(name=self.name)
+                stale.close()
+                stale.unlink()
+            except FileNotFoundError:
+                pass
+            self._shm = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+            _OWNED.add(self.name)
+
+    def _write_header(self, shm, seq=None, rows=0, cols=0, schema_len=0, data_offset=0, retired=0, published=0.0):
+        if seq is None:
+            seq = HEADER.unpack_from(shm.buf, 0)[1] if bytes(shm.buf[:8]) == MAGIC else 0
+        HEADER.pack_into(shm.buf, 0, MAGIC, seq, self.version, rows, cols, schema_len, data_offset, retired, 0, published)
+
+    def publish(self, df, numeric: Optional[Callable[[str], np.ndarray]] = None) -> int:
+        """نوشتن snapshot؛ نسخهٔ منتشرشده را برمی‌گرداند."""
+        import pandas as pd
+        if numeric is None:
+            numeric = lambda c: pd.to_numeric(df[c], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+        n = len(df)
+        keys = _key_array(df[self.key].to_numpy(dtype=object)) if self.key in df.columns else np.arange(n, dtype=np.int64)
+        cols = [c for c in self.columns if c in df.columns]
+        arrays = []
+        for c in cols:
+            try:
+                arrays.append(np.asarray(numeric(c), dtype=np.float64))
+            except Exception:
+                arrays.append(np.full(n, np.nan))
+        offset = 0
+        schema_cols = []
+        for c in cols:
+            offset += n * 8
+            schema_cols.append({'name': c, 'dtype': 'float64', 'offset': offset})
+        schema = json.dumps({'key': {'name': self.key, 'dtype': 'int64', 'offset': 0}, 'columns': schema_cols},
+                            ensure_ascii=False).encode('utf-8')
+        data_offset = HEADER_SIZE + ((len(schema) + 7) // 8) * 8
+        total = data_offset + n * 8 * (len(cols) + 1)
+        self._ensure_capacity(total)
+        shm = self._shm
+        seq = HEADER.unpack_from(shm.buf, 0)[1] if bytes(shm.buf[:8]) == MAGIC else 0
+        seq += 1 if seq % 2 == 0 else 0  # فرد: در حال نوشتن
+        self.version += 1
+        self._write_header(shm, seq=seq)
+        buf = shm.buf
+        buf[HEADER_SIZE:HEADER_SIZE + len(schema)] = schema
+        np.ndarray(n, dtype=np.int64, buffer=buf, offset=data_offset)[:] = keys
+        for arr, meta in zip(arrays, schema_cols):
+            np.ndarray(n, dtype=np.float64, buffer=buf, offset=data_offset + meta['offset'])[:] = arr
+        self._write_header(shm, seq=seq + 1, rows=n, cols=len(cols), schema_len=len(schema),
+                           data_offset=data_offset, published=time.time())
+        return self.version
+
+    def close(self, unlink: bool = True) -> None:
+        shm, self._shm = self._shm, None
+        if shm is None:
+            return
+        try:
+            self._write_header(shm, retired=1)
+        except Exception:
+            pass
+        shm.close()
+        if unlink:
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+            _OWNED.discard(self.name)
+
+# ------------------------
+# خواننده (بدون وابستگی به GUI)
+# ------------------------
+class SharedSnapshotReader:
+    """attach به قطعهٔ name و خواندن سازگار آخرین snapshot."""
+    def __init__(self, name: str = DEFAULT_NAME):
+        self.name = name
+        self._shm: Optional[shared_memory.SharedMemory] = None
+        self._schema_cache: Tuple[int, Optional[dict]] = (-1, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _segment(self) -> shared_memory.SharedMemory:
+        if self._shm is None:
+            self._shm = _attach(self.name)
+        return self._shm
+
+    def header(self) -> dict:
+        h = HEADER.unpack_from(self._segment().buf, 0)
+        if h[0] != MAGIC:
+            raise ValueError(f"قطعهٔ {self.name} قالب snapshot ندارد")
+        return {'seq': h[1], 'version': h[2], 'rows': h[3], 'cols': h[4], 'schema_len': h[5],
+                'data_offset': h[6], 'retired': bool(h[7]), 'published': h[9]}
+
+    def _schema(self, h) -> dict:
+        if self._schema_cache[0] != h['seq']:
+            raw = bytes(self._shm.buf[HEADER_SIZE:HEADER_SIZE + h['schema_len']])
+            self._schema_cache = (h['seq'], json.loads(raw.decode('utf-8')))
+        return self._schema_cache[1]
+
+    def read(self, copy: bool = True, retries: int = 100) -> Tuple[int, np.ndarray, Dict[str, np.ndarray]]:
+        """
+        (version, keys, {ستون: آرایه}). با copy=False آرایه‌ها view مستقیم روی حافظهٔ مشترک‌اند (بدون کپی)؛
+        در این حالت پس از استفاده با is_current(version) از ثابت ماندن داده مطمئن شوید.
+        """
+        for _ in range(retries):
+            h = self.header()
+            if h['retired']:
+                self.close()
+                time.sleep(0.01)
+                continue
+            if h['seq'] % 2 == 1 or h['version'] == 0:
+                time.sleep(0.001)
+                continue
+            schema = self._schema(h)
+            buf, n, base = self._shm.buf, h['rows'], h['data_offset']
+            take = (lambda a: a.copy()) if copy else (lambda a: a)
+            keys = take(np.ndarray(n, dtype=np.int64, buffer=buf, offset=base))
+            cols = {c['name']: take(np.ndarray(n, dtype=np.dtype(c['dtype']), buffer=buf, offset=base + c['offset']))
+                    for c in schema['columns']}
+            if not copy or HEADER.unpack_from(buf, 0)[1] == h['seq']:
+                return h['version'], keys, cols
+        raise TimeoutError(f"خواندن سازگار از {self.name} ممکن نشد")
+
+    def is_current(self, version: int) -> bool:
+        h = self.header()
+        return not h['retired'] and h['seq'] % 2 == 0 and h['version'] == version
+
+    def to_frame(self):
+        """snapshot به صورت pandas.DataFrame (کپی) با ایندکس کد_داخلی."""
+        import pandas as pd
+        version, keys, cols = self.read(copy=True)
+        df = pd.DataFrame(cols, index=pd.Index(keys, name=KEY_COLUMN))
+        df.attrs['version'] = version
+        return df
+
+    def wait_for_update(self, version: int, timeout: float = 30.0, poll: float = 0.05) -> int:
+        """انتظار تا انتشار نسخه‌ای جدیدتر از version؛ نسخهٔ جدید یا همان version در صورت timeout."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                h = self.header()
+                if h['retired']:
+                    self.close()
+                elif h['version'] > version and h['seq'] % 2 == 0:
+                    return h['version']
+            except FileNotFoundError:
+                pass
+            time.sleep(poll)
+        return version
+
+    def close(self) -> None:
+        shm, self._shm = self._shm, None
+        self._schema_cache = (-1, None)
+        if shm is not None:
+            try:
+                shm.close()
+            except BufferError:
+                pass  # view بدون کپی هنوز در دست فراخواننده است
+
+
+__all__ = ["SharedSnapshotWriter", "SharedSnapshotReader", "DEFAULT_NAME", "DEFAULT_COLUMNS"]
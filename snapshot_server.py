@@ -0,0 +1,393 @@
+# snapshot_server.py
+# سرور محلی فقط‌خواندنی برای snapshot آمادهٔ دیدبان (base_df بخش 2 با ستون‌های مشتق)
+# فقط کتابخانهٔ استاندارد پایتون؛ خروجی Arrow فقط اگر pyarrow نصب باشد.
+#
+# مسیرها:
+#   GET  /meta                               نسخه، زمان، تعداد ردیف و ستون‌ها (JSON)
+#   GET  /snapshot?format=json|arrow&columns=a,b
+#   GET  /view?format=...                    snapshot با فیلترهای ذخیره‌شدهٔ برنامه (saved_filters_full)
+#   POST /view?format=...                    بدنه: {"filters": [payload, ...]} با همان قالب add_*_filter
+#   GET  /ws                                 WebSocket؛ پس از هر به‌روزرسانی پیام diff (JSON) ارسال می‌شود
+#
+# json: ستونی {"version", "columns": [...], "data": {ستون: [مقادیر]}}
+# arrow: Arrow IPC stream (application/vnd.apache.arrow.stream)
+
+from __future__ import annotations
+
+import io
+import json
+import time
+import queue
+import base64
+import select
+import socket
+import struct
+import hashlib
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse, parse_qs
+
+import pandas as pd
+
+from core import settings_store, payload_mask
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+ARROW_MIME = "application/vnd.apache.arrow.stream"
+
+# ------------------------
+# سریال‌سازی ستونی
+# ------------------------
+def frame_to_json_bytes(df: pd.DataFrame, version: int) -> bytes:
+    """DataFrame -> JSON ستونی؛ NaN/NA به null تبدیل می‌شود (to_json سریع pandas برای هر ستون)."""
+    cols = [str(c) for c in df.columns]
+    body = ",".join(json.dumps(c, ensure_ascii=False) + ":" + df[c].to_json(orient='values', force_ascii=False)
+                    for c in df.columns)
+    head = json.dumps({'version': version, 'rows': len(df), 'columns': cols}, ensure_ascii=False)
+    return (head[:-1] + ',"data":{' + body + '}}').encode('utf-8')
+
+
+def frame_to_arrow_bytes(df: pd.DataFrame) -> bytes:
+    """DataFrame -> Arrow IPC stream؛ بدون pyarrow RuntimeError."""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise RuntimeError("برای خروجی arrow نصب pyarrow لازم است: pip install pyarrow")
+    frame = df.copy(deep=False)
+    frame.columns = [str(c) for c in frame.columns]
+    for c in frame.columns:
+        if frame[c].dtype == object:
+            # ستون‌های مختلط (مثلاً pd.NA در کنار float) به عدد یا متن یکدست تبدیل می‌شوند
+            num = pd.to_numeric(frame[c], errors='coerce')
+            frame[c] = num if num.notna().sum() == frame[c].notna().sum() else frame[c].astype(str)
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def diff_message(df: pd.DataFrame, diff, version: int, key: str = 'کد_داخلی') -> bytes:
+    """
+    پیام WebSocket برای یک SnapshotDiff: کلیدهای حذف‌شده، ردیف کامل نمادهای جدید،
+    و برای نمادهای تغییرکرده فقط ستون‌های عوض‌شده.
+    """
+    msg: Dict[str, Any] = {'type': 'diff', 'version': version, 'removed': [str(k) for k in diff.removed]}
+    if len(diff.inserted):
+        rows = df[df[key].astype(str).isin(diff.inserted)]
+        msg['inserted'] = json.loads(rows.to_json(orient='records', force_ascii=False))
+    else:
+        msg['inserted'] = []
+    changed = []
+    if len(diff.changed):
+        keys = df[key].astype(str)
+        sub = df[keys.isin(diff.changed)]
+        sub_keys = keys[sub.index]
+        records = json.loads(sub.to_json(orient='records', force_ascii=False))
+        for k, rec in zip(sub_keys, records):
+            cols = diff.columns_for(k)
+            changed.append({key: k, 'values': {c: rec.get(c) for c in cols}})
+    msg['changed'] = changed
+    return json.dumps(msg, ensure_ascii=False).encode('utf-8')
+
+# ------------------------
+# WebSocket حداقلی (RFC 6455، فقط فریم‌های متنی سمت سرور)
+# ------------------------
+def _ws_frame(payload: bytes, opcode: int = 0x1) -> bytes:
+    n = len(payload)
+    if n < 126:
+        header = struct.pack('!BB', 0x80 | opcode, n)
+    elif n < (1 << 16):
+        header = struct.pack('!BBH', 0x80 | opcode, 126, n)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, n)
+    return header + payload
+
+
+def _ws_read_frame(rfile) -> Optional[tuple]:
+    """(opcode, payload) یک فریم کلاینت (ماسک‌شده)؛ None اگر اتصال بسته شده باشد."""
+    head = rfile.read(2)
+    if len(head) < 2:
+        return None
+    b1, b2 = head
+    n = b2 & 0x7F
+    if n == 126:
+        n = struct.unpack('!H', rfile.read(2))[0]
+    elif n == 127:
+        n = struct.unpack('!Q', rfile.read(8))[0]
+    mask = rfile.read(4) if b2 & 0x80 else b'\x00\x00\x00\x00'
+    data = bytearray(rfile.read(n))
+    for i in range(len(data)):
+        data[i] ^= mask[i % 4]
+    return b1 & 0x0F, bytes(data)
+
+# ------------------------
+# سرور
+# ------------------------
+class SnapshotServer:
+    """
+    نگهدارندهٔ آخرین snapshot و سرور HTTP/WebSocket روی localhost.
+    publish(df, diff) پس از هر refresh از رشتهٔ GUI صدا زده می‌شود؛ خروجی سریال‌شدهٔ هر قالب
+    برای هر نسخه یک بار ساخته و بین همهٔ درخواست‌ها مشترک می‌شود.
+    """
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, key: str = 'کد_داخلی'):
+        self.host = host
+        self.port = port
+        self.key = key
+        self.version = 0
+        self.published_at = None
+        self._df: Optional[pd.DataFrame] = None
+        self._encoded: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+        self._clients: List[queue.Queue] = []
+        self._httpd: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    # ---------- انتشار ----------
+    def publish(self, df: pd.DataFrame, diff=None) -> None:
+        # کپی سطحی: تغییر نام/افزودن ستون در base_df جدول روی snapshot منتشرشده اثر ندارد
+        snap = df.copy(deep=False)
+        with self._lock:
+            self.version += 1
+            self._df = snap
+            self._encoded = {}
+            self.published_at = time.strftime("%Y-%m-%d %H:%M:%S")
+            clients = list(self._clients)
+            version = self.version
+        if not clients:
+            return
+        try:
+            if diff is not None:
+                msg = diff_message(snap, diff, version, self.key)
+            else:
+                msg = json.dumps({'type': 'snapshot', 'version': version}).encode('utf-8')
+        except Exception as e:
+            msg = json.dumps({'type': 'snapshot', 'version': version, 'error': str(e)}, ensure_ascii=False).encode('utf-8')
+        for q in clients:
+            try:
+                q.put_nowait(msg)
+            except queue.Full:
+                pass  # کلاینت کند؛ پیام رد می‌شود و باید /snapshot را دوباره بخواند
+
+    def snapshot(self):
+        with self._lock:
+            return self._df, self.version
+
+    def encoded(self, fmt: str) -> bytes:
+        """snapshot کامل در قالب fmt، با cache به ازای نسخه."""
+        with self._lock:
+            hit = self._encoded.get(fmt)
+            df, version = self._df, self.version
+        if hit is not None:
+            return hit
+        data = self.encode(df, fmt, version)
+        with self._lock:
+            if self.version == version:
+                self._encoded[fmt] = data
+        return data
+
+    @staticmethod
+    def encode(df: pd.DataFrame, fmt: str, version: int) -> bytes:
+        if fmt == 'arrow':
+            return frame_to_arrow_bytes(df)
+        return frame_to_json_bytes(df, version)
+
+    def meta(self) -> Dict[str, Any]:
+        df, version = self.snapshot()
+        return {'version': version, 'published_at': self.published_at,
+                'rows': 0 if df is None else len(df),
+                'columns': [] if df is None else [str(c) for c in df.columns],
+                'clients': len(self._clients)}
+
+    # ---------- WebSocket ----------
+    def _add_client(self) -> queue.Queue:
+        q: queue.Queue = queue.Queue(maxsize=64)
+        with self._lock:
+            self._clients.append(q)
+        return q
+
+    def _remove_client(self, q: queue.Queue) -> None:
+        with self._lock:
+            if q in self._clients:
+                self._clients.remove(q)
+
+    # ---------- چرخهٔ عمر ----------
+    def start(self) -> None:
+        if self._httpd is not None:
+            return
+        server = self
+        handler = type('SnapshotRequestHandler', (_SnapshotHandler,), {'server_ref': server})
+        self._httpd = ThreadingHTTPServer((self.host, self.port), handler)
+        self._httpd.daemon_threads = True
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="snapshot-server", daemon=True)
+        self._thread.start()
+        logging.info("snapshot server: http://%s:%s", self.host, self.port)
+
+    def stop(self) -> None:
+        httpd, self._httpd = self._httpd, None
+        if httpd is None:
+            return
+        with self._lock:
+            clients = list(self._clients)
+        for q in clients:
+            try:
+                q.put_nowait(None)  # پایان حلقهٔ WebSocket
+            except queue.Full:
+                pass
+        try:
+            httpd.shutdown()
+            httpd.server_close()
+        except Exception:
+            pass
+
+    @property
+    def running(self) -> bool:
+        return self._httpd is not None
+
+
+class _SnapshotHandler(BaseHTTPRequestHandler):
+    server_ref: SnapshotServer = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        logging.debug("snapshot server: " + fmt, *args)
+
+    # ---------- پاسخ‌ها ----------
+    def _send(self, status: int, body: bytes, content_type: str = "application/json; charset=utf-8") -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: int, message: str) -> None:
+        self._send(status, json.dumps({'error': message}, ensure_ascii=False).encode('utf-8'))
+
+    def _send_frame(self, df: pd.DataFrame, fmt: str, version: int) -> None:
+        data = SnapshotServer.encode(df, fmt, version)
+        self._send(200, data, ARROW_MIME if fmt == 'arrow' else "application/json; charset=utf-8")
+
+    # ---------- مسیرها ----------
+    def do_GET(self):
+        url = urlparse(self.path)
+        qs = parse_qs(url.query)
+        if url.path == '/ws':
+            return self._websocket()
+        if url.path == '/meta':
+            return self._send(200, json.dumps(self.server_ref.meta(), ensure_ascii=False).encode('utf-8'))
+        if url.path == '/snapshot':
+            return self._snapshot(qs)
+        if url.path == '/view':
+            return self._view(qs, settings_store.get('saved_filters_full', []))
+        self._send_error(404, "مسیر ناشناخته")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/view':
+            return self._send_error(404, "مسیر ناشناخته")
+        try:
+            n = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(n).decode('utf-8') or '{}')
+            filters = body.get('filters', [])
+            if not isinstance(filters, list):
+                raise ValueError("filters باید فهرست باشد")
+        except Exception as e:
+            return self._send_error(400, f"بدنهٔ نامعتبر: {e}")
+        self._view(parse_qs(url.query), filters)
+
+    def _format(self, qs) -> str:
+        fmt = (qs.get('format') or ['json'])[0].lower()
+        if fmt not in ('json', 'arrow'):
+            raise ValueError(f"قالب ناشناخته: {fmt}")
+        return fmt
+
+    def _select_columns(self, df: pd.DataFrame, qs) -> pd.DataFrame:
+        cols = [c for c in ','.join(qs.get('columns') or []).split(',') if c]
+        if not cols:
+            return df
+        missing = [c for c in cols if c not in df.columns]
+        if missing:
+            raise KeyError(', '.join(missing))
+        return df[cols]
+
+    def _snapshot(self, qs):
+        df, version = self.server_ref.snapshot()
+        if df is None:
+            return self._send_error(503, "هنوز snapshotی منتشر نشده است")
+        try:
+            fmt = self._format(qs)
+            if not qs.get('columns'):
+                data = self.server_ref.encoded(fmt)
+                return self._send(200, data, ARROW_MIME if fmt == 'arrow' else "application/json; charset=utf-8")
+            self._send_frame(self._select_columns(df, qs), fmt, version)
+        except KeyError as e:
+            self._send_error(400, f"ستون ناموجود: {e}")
+        except (ValueError, RuntimeError) as e:
+            self._send_error(400, str(e))
+
+    def _view(self, qs, filters):
+        df, version = self.server_ref.snapshot()
+        if df is None:
+            return self._send_error(503, "هنوز snapshotی منتشر نشده است")
+        try:
+            fmt = self._format(qs)
+            mask = None
+            for payload in filters:
+                m = payload_mask(payload, df)
+                mask = m if mask is None else (mask & m)
+            view = df if mask is None else df[mask]
+            self._send_frame(self._select_columns(view, qs), fmt, version)
+        except KeyError as e:
+            self._send_error(400, f"ستون ناموجود: {e}")
+        except (ValueError, RuntimeError) as e:
+            self._send_error(400, str(e))
+
+    # ---------- WebSocket ----------
+    def _websocket(self):
+        key = self.headers.get('Sec-WebSocket-Key')
+        if not key or 'websocket' not in (self.headers.get('Upgrade') or '').lower():
+            return self._send_error(400, "درخواست WebSocket نامعتبر")
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode('ascii')).digest()).decode('ascii')
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.close_connection = True
+        srv = self.server_ref
+        q = srv._add_client()
+        try:
+            hello = json.dumps({'type': 'hello', 'version': srv.version}).encode('utf-8')
+            self.wfile.write(_ws_frame(hello)); self.wfile.flush()
+            sock = self.connection
+            while True:
+                try:
+                    msg = q.get(timeout=0.5)
+                except queue.Empty:
+                    msg = b''
+                if msg is None:
+                    self.wfile.write(_ws_frame(b'', 0x8))
+                    break
+                if msg:
+                    self.wfile.write(_ws_frame(msg)); self.wfile.flush()
+                # فریم‌های کلاینت: close پایان، ping پاسخ pong؛ بقیه نادیده گرفته می‌شوند
+                readable, _, _ = select.select([sock], [], [], 0)
+                if readable:
+                    frame = _ws_read_frame(self.rfile)
+                    if frame is None or frame[0] == 0x8:
+                        break
+                    if frame[0] == 0x9:
+                        self.wfile.write(_ws_frame(frame[1], 0xA)); self.wfile.flush()
+        except (OSError, socket.error, ValueError):
+            pass
+        finally:
+            srv._remove_client(q)
+
+
+__all__ = ["SnapshotServer", "frame_to_json_bytes", "frame_to_arrow_bytes", "diff_message",
+           "DEFAULT_HOST", "DEFAULT_PORT"]
@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# core فایل tsetmc_settings.json را هنگام import در پوشهٔ جاری می‌خواند/می‌نویسد؛ تست‌ها در پوشهٔ موقت اجرا می‌شوند
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix="tse2-tests-"))
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+from core import diff_snapshots
+
+
+def _snapshot(prices, pe, names=("الف", "ب", "ج")):
+    return pd.DataFrame({
+        'کد_داخلی': ['101', '102', '103'],
+        'نماد': pd.Categorical(list(names)),
+        'قیمت_پایانی': prices,
+        'PE': pd.array(pe, dtype=object),
+    })
+
+
+def test_changed_row_with_na_pe():
+    prev = _snapshot([1000, 2000, 3000], [pd.NA, 5.5, pd.NA])
+    curr = _snapshot([1000, 2000, 3100], [pd.NA, 5.5, pd.NA])
+    d = diff_snapshots(prev, curr)
+    assert list(d.changed) == ['103']
+    assert d.columns_for('103') == ['قیمت_پایانی']
+    assert d.curr_positions.tolist() == [2]
+
+
+def test_na_appearing_or_clearing_counts_as_change():
+    prev = _snapshot([1000, 2000, 3000], [pd.NA, 5.5, 7.0])
+    curr = _snapshot([1000, 2000, 3000], [4.0, pd.NA, 7.0])
+    d = diff_snapshots(prev, curr)
+    assert sorted(d.changed) == ['101', '102']
+    assert d.changed_by_column().keys() == {'PE'}
+
+
+def test_categories_differ_between_snapshots():
+    prev = _snapshot([1000, 2000, 3000], [np.nan, 1.0, 2.0], names=("الف", "ب", "ج"))
+    curr = _snapshot([1000, 2000, 3000], [np.nan, 1.0, 2.0], names=("الف", "ب", "د"))
+    d = diff_snapshots(prev, curr)
+    assert list(d.changed) == ['103']
+    assert d.columns_for('103') == ['نماد']
+    assert d.is_empty is False